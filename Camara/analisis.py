@@ -4,12 +4,137 @@ Created on Fri Aug 19 16:27:48 2016
 
 @author: Alejandro
 """
-from scipy import signal
-from scipy.optimize import curve_fit
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.style as style
-from matplotlib import animation
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from time import time
+import threading
+
+# scipy y matplotlib se importan en las funciones que los utilizan: los
+# procesos de analizar_lote sólo cargan lo necesario para el análisis
+
+def minimos_cwt(eje_y, ancho_min, ancho_max):
+    """
+    Mínimos locales mediante signal.find_peaks_cwt sobre el perfil
+    invertido, con anchos entre ancho_min y ancho_max (método original)
+    """
+    # La conversión a float evita que el perfil uint8 de la cámara se
+    # desborde al invertirlo
+    from scipy import signal
+    eje_y = np.asarray(eje_y, dtype=float)
+    return np.array(signal.find_peaks_cwt(-eje_y, 
+                                          np.arange(ancho_min, ancho_max)),
+                    dtype=int)
+
+def minimos_rapido(eje_y, ancho_min, ancho_max):
+    """
+    Mínimos locales mediante suavizado gaussiano y búsqueda vectorizada
+    de extremos (signal.find_peaks) con distancia mínima y prominencia.
+    
+    El suavizado y la distancia mínima se derivan de ancho_min; la
+    prominencia exigida se estima a partir del ruido del perfil. Es
+    O(N) frente a O(N·W) de la transformada wavelet.
+    """
+    from scipy import signal, ndimage
+    eje_y = np.asarray(eje_y, dtype=float)
+    
+    suave = ndimage.gaussian_filter1d(eje_y, max(ancho_min / 4, 0.5))
+    
+    # Desviación del ruido estimada por la mediana de los residuos
+    ruido = np.median(np.abs(eje_y - suave)) / 0.6745
+    rango = suave.max() - suave.min()
+    prominencia = max(2 * ruido, 1e-6 * rango)
+    
+    minimos, _ = signal.find_peaks(-suave, distance=max(1, ancho_min),
+                                   prominence=prominencia)
+    return minimos
+
+# Métodos disponibles para la detección de mínimos en analizar_patron
+metodos_minimos = {'Rapido': minimos_rapido,
+                   'CWT': minimos_cwt}
+
+def analizar_lote(eje_x, perfiles, procesos=None, modelo=False, 
+                  orden_dinamico=True, umbral=0.5, **experimento):
+    """
+    Análisis de una secuencia de perfiles apilados (cuadros x pixels)
+    
+    Las etapas comunes (máximo, ancho del pico central y posición de la
+    saturación) se calculan vectorizadas sobre el eje de cuadros. La
+    búsqueda de mínimos (o el ajuste) de cada cuadro puede repartirse en
+    bloques entre varios procesos. En Windows la llamada con procesos
+    debe estar protegida por if __name__ == '__main__'.
+    
+    Parámetros:
+    -----------
+    eje_x : 1D array
+        Eje espacial común a todos los perfiles
+    perfiles : 2D array
+        Un perfil de intensidad por fila
+    procesos : int opcional
+        Cantidad de procesos. None o 1 analiza en el proceso actual
+    modelo : bool opcional
+        Utiliza ajustar_modelo (con arranque desde el cuadro anterior
+        dentro de cada bloque) en lugar de analizar_patron
+    orden_dinamico, umbral : opcionales
+        Igual que en analizar_patron
+    experimento : opcionales
+        Parámetros de Difraccion (long_onda, distancia_pantalla, ...)
+        
+    Retorna:
+    --------
+    1D arrays (uno por cuadro): rendija, interfranja, franjas contadas y
+    centro. Los cuadros que no pudieron analizarse valen NaN.
+    """
+    eje_x = np.asarray(eje_x, dtype=float)
+    perfiles = np.asarray(perfiles)
+    assert perfiles.ndim == 2 and perfiles.shape[1] == len(eje_x)
+    
+    # Etapas vectorizadas sobre todos los cuadros
+    maximos = perfiles.max(axis=1)
+    anchos = (perfiles > (maximos * umbral)[:, np.newaxis]).sum(axis=1) / 2
+    saturaciones = perfiles.argmax(axis=1)
+    
+    opciones = dict(modelo=modelo, orden_dinamico=orden_dinamico,
+                    umbral=umbral, experimento=experimento)
+    
+    if procesos is None or procesos <= 1:
+        resultados = _analizar_bloque(eje_x, perfiles, anchos, saturaciones,
+                                      opciones)
+    else:
+        limites = np.linspace(0, len(perfiles), 
+                              min(procesos, len(perfiles)) + 1).astype(int)
+        tramos = list(zip(limites[:-1], limites[1:]))
+        with ProcessPoolExecutor(procesos) as ejecutor:
+            futuros = [ejecutor.submit(_analizar_bloque, eje_x, 
+                                       perfiles[a:b], anchos[a:b], 
+                                       saturaciones[a:b], opciones)
+                       for a, b in tramos]
+            resultados = np.concatenate([f.result() for f in futuros])
+    
+    return tuple(resultados.T)
+
+def _analizar_bloque(eje_x, perfiles, anchos, saturaciones, opciones):
+    """ Analiza un bloque de cuadros consecutivos (usado por analizar_lote) """
+    resultados = np.full((len(perfiles), 4), np.nan)
+    patron = Difraccion(eje_x, perfiles[0], **opciones['experimento'])
+    
+    for i in range(len(perfiles)):
+        patron.actualizar(eje_x, perfiles[i])
+        try:
+            if opciones['modelo']:
+                patron.ajustar_modelo(orden_dinamico=opciones['orden_dinamico'],
+                                      umbral=opciones['umbral'])
+            else:
+                patron.analizar_patron(opciones['orden_dinamico'], 
+                                       ancho_picos=anchos[i],
+                                       primera_saturacion=saturaciones[i])
+        except (IndexError, ValueError, RuntimeError):
+            # Cuadro sin franjas suficientes o ajuste sin convergencia
+            continue
+        resultados[i] = (patron._rendija, patron._interfranja,
+                         patron._franjas_contadas, patron._desplazamiento)
+    
+    return resultados
 
 class Difraccion(object):
     """
@@ -30,9 +155,12 @@ class Difraccion(object):
        Distancia entre la rendija y la pantalla en la unidad de distancia
     unidad : str opcional
         Nombre de la unidad de distancia utilizada                      
+    metodo_minimos : str o función opcional
+        Detección de mínimos: 'Rapido' (por defecto), 'CWT' o una función
+        f(eje_y, ancho_min, ancho_max) que devuelva los índices
     """
     def __init__(self, eje_x, eje_y, long_onda=670e-9,
-                 distancia_pantalla=2, unidad='m'):                
+                 distancia_pantalla=2, unidad='m', metodo_minimos='Rapido'):
         
         assert len(eje_x) == len(eje_y)
         
@@ -41,6 +169,8 @@ class Difraccion(object):
         
         self._len = len(eje_x)
         self._centro = None
+        # Desplazamiento acumulado del eje x respecto del original
+        self._desplazamiento = 0
         self._long_onda = long_onda
         self._distancia_pantalla = distancia_pantalla
         self._unidad = unidad
@@ -50,8 +180,19 @@ class Difraccion(object):
         self._franjas_contadas = None
         self._amplitud = None
         self._rendija = None
+        self._error_rendija = None
         self._red_calibracion = None       
         
+        # Parámetros del último ajuste sinc^2 (x0 en el eje original)
+        self._parametros = None
+        
+        # Análisis dinámico: hilo, último resultado e historial
+        self._activo = False
+        self._hilo = None
+        self._error_dinamico = None
+        self._resultado = None
+        self._historial = deque()
+        
         self._ancho_central = None
         self._minimos = None 
         self._minimos_izquierda = None
@@ -59,14 +200,28 @@ class Difraccion(object):
         self._orden_tolerado = None
         
         self._factor_tolerancia = 0.3
+        
+        if callable(metodo_minimos):
+            self._buscar_minimos = metodo_minimos
+        else:
+            self._buscar_minimos = metodos_minimos[metodo_minimos]
        
         assert 0 < long_onda
         assert 0 < distancia_pantalla
         
     def configurar_experimento(self):
         pass
+    
+    def actualizar(self, eje_x, eje_y):
+        """ Reemplaza el patrón a analizar (por ejemplo un nuevo cuadro) """
+        assert len(eje_x) == len(eje_y)
+        self._eje_x = np.array(eje_x, dtype=float)
+        self._eje_y = np.asarray(eje_y)
+        self._len = len(eje_x)
+        self._desplazamiento = 0
      
-    def analizar_patron(self, orden_dinamico=True, umbral=0.5):
+    def analizar_patron(self, orden_dinamico=True, umbral=0.5,
+                        ancho_picos=None, primera_saturacion=None):
         """
         Análisis automático del patrón introducido
         
@@ -75,6 +230,9 @@ class Difraccion(object):
         orden_dinamico : bool opcional
             Permite al método alterar dinámicamente el número de
             ordenes analizados.
+        ancho_picos, primera_saturacion : opcionales
+            Estimaciones ya calculadas (ver analizar_lote, que las obtiene
+            para todos los cuadros a la vez). Por defecto se calculan.
             
         Retorna:
         --------
@@ -92,13 +250,14 @@ class Difraccion(object):
         #       tradujo al eje x. Hasta entonces las variables internas del
         #       método analizar_patron corresponden a índices del eje y
         
-        # Encuentra el valor máximo en la grafica
-        maximo_absoluto = np.max(self._eje_y)
-        
-        # Utiliza un porcentaje del valor máximo para estimar el ancho del
-        # pico central
-        cota = maximo_absoluto * umbral
-        ancho_picos = len(self._eje_y[self._eje_y > cota]) / 2
+        if ancho_picos is None:
+            # Encuentra el valor máximo en la grafica
+            maximo_absoluto = np.max(self._eje_y)
+            
+            # Utiliza un porcentaje del valor máximo para estimar el ancho
+            # del pico central
+            cota = maximo_absoluto * umbral
+            ancho_picos = len(self._eje_y[self._eje_y > cota]) / 2
         
         # Genera un intervalo para la deteccion de los picos
         # como el ancho esperado +/- %25
@@ -108,15 +267,15 @@ class Difraccion(object):
         # Busca los mínimos locales
         # La conversión a np.array facilita la manipulación posterior
                                                    
-        minimos = np.array(signal.find_peaks_cwt(-self._eje_y, 
-                                                 np.arange(ap1,ap2)))
+        minimos = self._buscar_minimos(self._eje_y, ap1, ap2)
         
         # Asumiendo que el máximo principal de un sinc^2 satura al
         # instrumento (para un sinc[x]^2 la intensidad del primer orden 
         # se reduce al 5% del orden cero)
         
         # Busca el primer punto saturado
-        primera_saturacion = np.argmax(self._eje_y)
+        if primera_saturacion is None:
+            primera_saturacion = np.argmax(self._eje_y)
         
         # Separa los minimos respecto del centro de saturacion
         minimos_izquierda = minimos[minimos < primera_saturacion]
@@ -130,13 +289,14 @@ class Difraccion(object):
         # Calcula el ancho central (sin informacion del eje x aun)
         ancho_central = minimo_central_der - minimo_central_izq
         # Calcula la posición del maximo_central en el array del eje y
-        maximo_central = np.int((minimo_central_izq + ancho_central / 2)) 
+        maximo_central = int((minimo_central_izq + ancho_central / 2)) 
         
         # Obtiene la posicion del centro para el eje x
         self._centro = self._eje_x[maximo_central]
         
         # Desplaza el origen del eje x al máximo central
         self._eje_x -= self._centro
+        self._desplazamiento += self._centro
         
         if orden_dinamico == True:       
             # Recalcula los máximos y mínimos utilizando la información
@@ -145,8 +305,7 @@ class Difraccion(object):
             ancho_picos = ancho_central / 8
             ap1 = ancho_picos * 0.5
             ap2 = ancho_picos * 1                                                    
-            minimos = np.array(signal.find_peaks_cwt(-self._eje_y, 
-                                                     np.arange(ap1,ap2))) 
+            minimos = self._buscar_minimos(self._eje_y, ap1, ap2)
             minimos_izquierda = minimos[minimos < primera_saturacion]
             minimos_derecha = minimos[minimos > primera_saturacion]
         
@@ -188,10 +347,100 @@ class Difraccion(object):
         return (self._eje_x , self._eje_y , self._rendija, 
                 self._minimos)
     
+    def _modelo(self, x, intensidad, rendija, x0, fondo):
+        # I(x) = I0 sinc^2(pi a (x - x0) / (lambda D)) + fondo
+        escala = self._long_onda * self._distancia_pantalla
+        return intensidad * np.sinc(rendija * (x - x0) / escala) ** 2 + fondo
+    
+    def ajustar_modelo(self, saturacion=255, arranque_previo=True,
+                       orden_dinamico=True, umbral=0.5):
+        """
+        Ajuste por cuadrados mínimos del modelo de Fraunhofer
+        
+            I(x) = I0 sinc^2(pi a (x - x0) / (lambda D)) + fondo
+        
+        excluyendo los pixels saturados. El ajuste parte de los parámetros
+        del cuadro anterior (si existen) o de la estimación por mínimos de
+        analizar_patron. El error de la rendija surge de la covarianza.
+        
+        Parámetros:
+        -----------
+        saturacion : float opcional
+            Nivel a partir del cual los pixels se consideran saturados
+        arranque_previo : bool opcional
+            Utiliza el resultado del ajuste anterior como punto de partida
+        orden_dinamico, umbral : opcionales
+            Se pasan a analizar_patron cuando se requiere una estimación
+            
+        Retorna:
+        --------
+        Lo mismo que analizar_patron (los mínimos son los del modelo)
+        """
+        escala = self._long_onda * self._distancia_pantalla
+        
+        if arranque_previo and self._parametros is not None:
+            intensidad, rendija, x0, fondo = self._parametros
+            p0 = [intensidad, rendija, x0 - self._desplazamiento, fondo]
+        else:
+            self.analizar_patron(orden_dinamico, umbral)
+            fondo = float(np.min(self._eje_y))
+            intensidad = float(np.max(self._eje_y)) - fondo
+            if np.max(self._eje_y) >= saturacion:
+                # El orden cero saturado supera en mucho al máximo medido
+                intensidad *= 4
+            p0 = [intensidad, self._rendija, 0.0, fondo]
+        
+        validos = self._eje_y < saturacion
+        x = self._eje_x[validos]
+        y = np.asarray(self._eje_y[validos], dtype=float)
+        
+        from scipy.optimize import curve_fit
+        try:
+            popt, pcov = curve_fit(self._modelo, x, y, p0=p0)
+        except RuntimeError:
+            if not (arranque_previo and self._parametros is not None):
+                raise
+            # Si el arranque previo no converge vuelve a estimar
+            self._parametros = None
+            return self.ajustar_modelo(saturacion, False, 
+                                       orden_dinamico, umbral)
+        
+        intensidad, rendija, x0, fondo = popt
+        rendija = abs(rendija)
+        
+        self._rendija = rendija
+        self._error_rendija = np.sqrt(pcov[1, 1])
+        self._interfranja = escala / rendija
+        self._error_interfranja = (self._interfranja * self._error_rendija / 
+                                   rendija)
+        self._amplitud = intensidad
+        
+        # Centra el eje x en el máximo del modelo
+        self._centro = x0
+        self._eje_x -= x0
+        self._desplazamiento += x0
+        self._parametros = (intensidad, rendija, self._desplazamiento, fondo)
+        
+        # Mínimos del modelo dentro del rango observado
+        orden = np.arange(np.floor(self._eje_x[0] / self._interfranja),
+                          np.ceil(self._eje_x[-1] / self._interfranja) + 1)
+        minimos = orden[orden != 0] * self._interfranja
+        self._minimos = minimos[(minimos >= self._eje_x[0]) & 
+                                (minimos <= self._eje_x[-1])]
+        self._minimos_izquierda = -self._minimos[self._minimos < 0][::-1]
+        self._minimos_derecha = self._minimos[self._minimos > 0]
+        self._franjas_contadas = max(len(self._minimos) - 1, 0)
+        
+        return (self._eje_x , self._eje_y , self._rendija, 
+                self._minimos)
+    
     def reporte(self):
         print('\nRESULTADOS')
         print('----------')
         print('    Rendija: ' + str(self._rendija) + self._unidad)
+        if self._error_rendija is not None:
+            print('    Error rendija (ajuste): ' + str(self._error_rendija)
+                  + self._unidad)
         print('    Interfranja promedio: ' + str(self._interfranja)
               + self._unidad)
         print('    Interfranja 1er orden: ' + str(self._minimos_derecha[0])
@@ -202,6 +451,7 @@ class Difraccion(object):
         
         self.analizar_patron(umbral=umbral)
         
+        import matplotlib.pyplot as plt
         figura = plt.figure()
         ax = figura.add_subplot(111)
         ax.set_xlabel('Distancia (' + self._unidad + ')')
@@ -211,12 +461,85 @@ class Difraccion(object):
             ax.axvline(minimo * 1000, c='k', ls='--')
         self.reporte()
     
-    def analisis_dinamico(self, func, *args):
-        # Grafica en forma dinamica el resultado del análisis      
+    def _registrar(self):
+        """
+        Publica el resultado actual como una tupla inmutable (la lee el
+        hilo del gráfico) y agrega sus valores escalares al historial
+        """
+        resultado = (time(), self._eje_x.copy(), np.array(self._eje_y),
+                     self._rendija, self._error_rendija, self._interfranja,
+                     self._franjas_contadas, self._desplazamiento,
+                     np.array(self._minimos))
+        self._resultado = resultado
+        self._historial.append(resultado[:1] + resultado[3:8])
+    
+    def historial(self):
+        """
+        Devuelve el historial del análisis dinámico como 2D array con las
+        columnas: tiempo, rendija, error rendija, interfranja, franjas
+        contadas y centro (error NaN si no se ajustó el modelo)
+        """
+        return np.array([[np.nan if v is None else v for v in fila]
+                         for fila in list(self._historial)], dtype=float)
+    
+    def exportar_historial(self, nombre_archivo='historial.csv'):
+        """ Guarda el historial del análisis dinámico en un archivo CSV """
+        np.savetxt(nombre_archivo, self.historial(), delimiter=',',
+                   header='Tiempo,Rendija,Error rendija,Interfranja,'
+                          'Franjas,Centro')
+    
+    def detener_dinamico(self):
+        """
+        Detiene el hilo de adquisición del análisis dinámico. Si el hilo
+        terminó por un error inesperado, lo relanza.
+        """
+        self._activo = False
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+        error, self._error_dinamico = self._error_dinamico, None
+        if error is not None:
+            raise RuntimeError('Falló la adquisición del análisis '
+                               'dinámico: ' + repr(error)) from error
+    
+    def analisis_dinamico(self, func, *args, modelo=False, historial=1000,
+                          intervalo=1500):
+        """
+        Grafica en forma dinámica el resultado del análisis
+        
+        La adquisición (func) y el análisis corren en un hilo aparte; la
+        animación sólo muestra el último resultado disponible. Las líneas
+        de los mínimos se reutilizan entre cuadros y el historial guarda
+        como máximo 'historial' resultados (ver exportar_historial). El
+        hilo se detiene al cerrar la figura o con detener_dinamico. Un error
+        inesperado en la adquisición detiene el hilo y la animación, se
+        muestra en la figura y detener_dinamico lo relanza.
+        
+        Parámetros:
+        -----------
+        func, args : 
+            Función que devuelve (eje_x, eje_y), por ejemplo
+            Camara.perfil_intensidad
+        modelo : bool opcional
+            Ajusta sinc^2 partiendo del cuadro anterior (ajustar_modelo)
+        historial : int opcional
+            Cantidad máxima de resultados conservados
+        intervalo : int opcional
+            Período de actualización del gráfico en ms
+        """
+        
+        analizar = self.ajustar_modelo if modelo else self.analizar_patron
+        
+        self.detener_dinamico()
+        self._historial = deque(maxlen=historial)
         
-        self._eje_x, self._eje_y = func(*args)
+        # El primer cuadro se analiza aquí para configurar el gráfico
+        self.actualizar(*func(*args))
+        analizar()
+        self._registrar()
         
-        self.analizar_patron()
+        import matplotlib.pyplot as plt
+        from matplotlib import animation
         bbox_props = dict(boxstyle="round,pad=0.3", fc="white", ec="b", lw=2)
         figura = plt.figure()
         ax = figura.add_subplot(111)
@@ -232,6 +555,34 @@ class Difraccion(object):
                               bbox=bbox_props,
                               transform=ax.transAxes)
         
+        # Líneas reutilizables: la central y una por mínimo
+        central = ax.axvline(0, c='b', ls='--')
+        lineas = list()
+        
+        # Si func es un método de una Camara con captura en segundo plano,
+        # cada cuadro se analiza una sola vez (ver Camara.esperar_cuadro)
+        esperar = getattr(getattr(func, '__self__', None), 'esperar_cuadro',
+                          None)
+        
+        def adquirir():
+            # Bucle del hilo de adquisición y análisis
+            while self._activo:
+                try:
+                    if esperar is not None and not esperar():
+                        continue
+                    self.actualizar(*func(*args))
+                    analizar()
+                except (IndexError, ValueError, RuntimeError):
+                    # Cuadro sin franjas suficientes: se descarta
+                    continue
+                except Exception as error:
+                    # Cualquier otro error (cámara desconectada, etc.)
+                    # termina la adquisición; la animación lo informa
+                    self._error_dinamico = error
+                    self._activo = False
+                    return
+                self._registrar()
+        
         def init():
             datos.set_data([],[])
             txtRendija.set_text("")
@@ -242,31 +593,47 @@ class Difraccion(object):
             return graficos
         
         def animate(i):
-        
-            self._eje_x, self._eje_y = func(*args)
-            self.analizar_patron()
-            x = self._eje_x
-            y = self._eje_y
+            
+            if self._error_dinamico is not None:
+                anim.event_source.stop()
+                ax.set_title('Adquisición detenida: ' +
+                             repr(self._error_dinamico), color='r')
+                figura.canvas.draw_idle()
+                return list()
+            
+            (tiempo, x, y, rendija, error, interfranja, franjas, centro,
+             minimos) = self._resultado
             datos.set_data(x, y)
-            graficos = list()
-
-            linea = ax.axvline(0, c='b', ls='--')
-            graficos.append(linea)
-            texto1 = "Rendija: {0:.5e} {1:s}".format(self._rendija, 
-                                                self._unidad)
-            texto2 = "Franjas válidas: {0}".format(self._franjas_contadas)
+            
+            texto1 = "Rendija: {0:.5e} {1:s}".format(rendija, self._unidad)
+            texto2 = "Franjas válidas: {0}".format(franjas)
             txtRendija.set_text(texto1)
             txtContadas.set_text(texto2)
             
-            for minimo in self._minimos:
-                linea = ax.axvline(minimo, c='b', ls='--')
-                graficos.append(linea)
+            # Agrega líneas sólo si faltan y oculta las que sobran
+            while len(lineas) < len(minimos):
+                lineas.append(ax.axvline(0, c='b', ls='--'))
+            for linea, minimo in zip(lineas, minimos):
+                linea.set_xdata([minimo, minimo])
+                linea.set_visible(True)
+            for linea in lineas[len(minimos):]:
+                linea.set_visible(False)
+            
+            graficos = [central] + lineas
             graficos.append(txtRendija)
             graficos.append(txtContadas)
             graficos.append(datos)                
             return graficos
+        
+        self._activo = True
+        self._hilo = threading.Thread(target=adquirir, daemon=True)
+        self._hilo.start()
+        figura.canvas.mpl_connect('close_event', 
+                                  lambda evento: self.detener_dinamico())
             
+        # Sin caché de cuadros para mantener la memoria constante
         anim = animation.FuncAnimation(figura, animate, init_func=init,
-                                   interval=1500, blit=True)
+                                   interval=intervalo, blit=True,
+                                   cache_frame_data=False)
         plt.show()
-        return anim
\ No newline at end of file
+        return anim
@@ -5,12 +5,203 @@ Created on Wed Aug 17 21:36:40 2016
 @author: Alejandro
 """
 
-import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import animation
-from scipy.optimize import curve_fit
-from time import time
+from time import time, sleep
+import threading
+
+# OpenCV se importa al abrir la primera cámara y matplotlib al graficar,
+# de modo que importar el módulo es inmediato (ver _cargar_cv2)
+cv2 = None
+
+def _cargar_cv2():
+    """ Importa OpenCV la primera vez que se necesita """
+    global cv2
+    if cv2 is None:
+        import cv2 as modulo
+        cv2 = modulo
+    return cv2
+
+class Capturador(object):
+    """
+    Hilo de captura continua sobre un cv2.VideoCapture.
+    
+    Lee cuadros en un buffer circular preasignado, guardando para cada uno
+    la marca de tiempo y el número de secuencia. Los consumidores obtienen
+    el último cuadro o un bloque de cuadros consecutivos sin bloquear la
+    captura.
+    
+    Parámetros
+    ----------
+    camara : 
+       cv2.VideoCapture ya abierto
+    largo : 
+       Cantidad de cuadros del buffer circular
+    """
+    def __init__(self, camara, largo=32):
+        
+        assert largo >= 3
+        _cargar_cv2()
+        
+        self._camara = camara
+        self._largo = largo
+        
+        # Buffer circular (se asigna con el primer cuadro recibido)
+        self._cuadros = None
+        self._tiempos = np.zeros(largo)
+        self._secuencias = np.full(largo, -1, dtype=np.int64)
+        
+        # Número de cuadros escritos (el último está en escritos - 1)
+        self._escritos = 0
+        self._entregado = -1
+        
+        # Estadísticas
+        self._fallidos = 0
+        self._sobrescritos = 0
+        self._perdidos = 0
+        self._periodo = 0
+        fps = camara.get(cv2.CAP_PROP_FPS)
+        if fps > 0:
+            self._periodo = 1 / fps
+        
+        self._bloqueo = threading.Lock()
+        self._nuevo = threading.Condition(self._bloqueo)
+        self._activo = False
+        self._hilo = None
+        
+    def iniciar(self):
+        """ Inicia el hilo de captura """
+        if self._activo:
+            return
+        self._activo = True
+        self._hilo = threading.Thread(target=self._capturar, daemon=True)
+        self._hilo.start()
+        
+    def detener(self):
+        """ Detiene el hilo de captura y espera su finalización """
+        self._activo = False
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+            
+    def _capturar(self):
+        # Bucle del hilo: escribe siempre en la ranura siguiente a la última.
+        # Tras una lectura fallida (cámara desconectada o fin del video)
+        # espera antes de reintentar, con intervalos crecientes
+        espera = 0.005
+        while self._activo:
+            
+            if self._cuadros is None:
+                ok, cuadro = self._camara.read()
+                if not ok:
+                    self._fallidos += 1
+                    sleep(espera)
+                    espera = min(2 * espera, 0.5)
+                    continue
+                self._cuadros = np.empty((self._largo,) + cuadro.shape,
+                                         dtype=cuadro.dtype)
+                self._cuadros[0] = cuadro
+            else:
+                destino = self._cuadros[self._escritos % self._largo]
+                # Antes de escribir verifica si el cuadro nunca fue leído
+                if self._secuencias[self._escritos % self._largo] > \
+                   self._entregado:
+                    self._sobrescritos += 1
+                ok, cuadro = self._camara.read(destino)
+                if not ok:
+                    self._fallidos += 1
+                    sleep(espera)
+                    espera = min(2 * espera, 0.5)
+                    continue
+                if cuadro is not destino:
+                    destino[...] = cuadro
+            
+            espera = 0.005
+            ranura = self._escritos % self._largo
+            ahora = time()
+            
+            # Estima los cuadros perdidos por el dispositivo a partir
+            # del tiempo transcurrido respecto del período nominal
+            if self._escritos > 0 and self._periodo > 0:
+                dt = ahora - self._tiempos[(self._escritos - 1) % self._largo]
+                if dt > 1.5 * self._periodo:
+                    self._perdidos += int(round(dt / self._periodo)) - 1
+            
+            with self._bloqueo:
+                self._tiempos[ranura] = ahora
+                self._secuencias[ranura] = self._escritos
+                self._escritos += 1
+                self._nuevo.notify_all()
+                
+    def ultimo(self):
+        """
+        Devuelve una copia del último cuadro, su marca de tiempo y su
+        número de secuencia. Si aún no hay cuadros devuelve None.
+        """
+        cuadros, tiempos, secuencias = self.bloque(1)
+        if cuadros is None:
+            return None, None, None
+        return cuadros[0], tiempos[0], secuencias[0]
+    
+    def esperar(self, secuencia, limite=None):
+        """
+        Espera un cuadro con número de secuencia mayor que 'secuencia'.
+        Devuelve False si pasan 'limite' segundos sin cuadros nuevos.
+        """
+        if secuencia is None:
+            secuencia = -1
+        with self._nuevo:
+            return self._nuevo.wait_for(
+                lambda: self._escritos - 1 > secuencia, limite)
+    
+    def bloque(self, n, salida=None):
+        """
+        Devuelve los últimos n cuadros consecutivos (del más antiguo al más
+        reciente) junto con sus marcas de tiempo y números de secuencia.
+        
+        Parámetros
+        ----------
+        n : 
+           Cantidad de cuadros (como máximo largo - 2)
+        salida : 
+           Array opcional de forma (n, alto, ancho, canales) a reutilizar
+        """
+        assert 1 <= n <= self._largo - 2
+        
+        while True:
+            with self._bloqueo:
+                escritos = self._escritos
+            if escritos < n:
+                return None, None, None
+            
+            ranuras = np.arange(escritos - n, escritos) % self._largo
+            cuadros = np.take(self._cuadros, ranuras, axis=0, out=salida)
+            tiempos = self._tiempos[ranuras]
+            secuencias = self._secuencias[ranuras]
+            
+            # Si durante la copia el hilo alcanzó las ranuras leídas,
+            # repite la lectura
+            with self._bloqueo:
+                if self._escritos - escritos < self._largo - n:
+                    self._entregado = max(self._entregado, escritos - 1)
+                    return cuadros, tiempos, secuencias
+            
+    def estadisticas(self):
+        """ Devuelve un diccionario con las estadísticas de captura """
+        with self._bloqueo:
+            escritos = self._escritos
+            if escritos > 1:
+                ranuras = np.arange(max(0, escritos - self._largo), 
+                                    escritos) % self._largo
+                dt = self._tiempos[ranuras[-1]] - self._tiempos[ranuras[0]]
+                fps = (len(ranuras) - 1) / dt if dt > 0 else 0
+            else:
+                fps = 0
+        return {'capturados': escritos,
+                'fallidos': self._fallidos,
+                'sobrescritos': self._sobrescritos,
+                'perdidos': self._perdidos,
+                'fps': fps,
+                'fps_nominal': 1 / self._periodo if self._periodo else 0}
 
 class Camara(object):  
     """
@@ -33,12 +224,18 @@ class Camara(object):
        Cantidad de pixels cada 1 unidad de distancia
        (ej : 480 pixels = 1 metro)
     direccion :
-       Horizontal, vertical o libre (no implementada)       
+       Horizontal, vertical o libre (segmento con cualquier inclinación)
     """
+    # Direcciones de análisis admitidas por perfil_intensidad
+    _direcciones = ('Horizontal', 'Vertical', 'Libre')
+    
     def __init__(self, camara=0, x0=0, y0=0, x1=0, y1=240, x2=639, y2=240, 
                  unidad='m', razon=480, direccion='Horizontal'):
+        
+        self._validar_direccion(direccion)
                 
         # Configuracion de cámara y verificación
+        _cargar_cv2()
         self._camara = cv2.VideoCapture(camara)
         assert self._camara.isOpened() == True , "Dispositivo no disponible"
         
@@ -63,11 +260,23 @@ class Camara(object):
         
         self._imagen = None
         self._capa_dibujo = None
-        self._gray = None
+        self._mapa = None
         
         self._calibrando = False
         self._dibujando = False
         
+        self._capturador = None
+        self._secuencia = None
+        
+        # Promediado espacial (banda) y temporal de los perfiles
+        self._ancho_banda = 1
+        self._cuadros = 1
+        self._metodo = 'Promedio'
+        self._pila = None
+        self._pila_indice = 0
+        self._pila_llenos = 0
+        self._secuencia_apilada = None
+        
         # Verificación de los parámetros recibidos
         assert 0 <= x0 < self._ancho
         assert 0 <= x1 < self._ancho
@@ -82,9 +291,72 @@ class Camara(object):
         Libera la cámara y elimina las ventanas abiertas
         (ATENCION: elimina todas las ventanas correspondientes a OpenCV)
         """
+        # La inicialización pudo fallar antes de abrir la cámara
+        if not hasattr(self, '_camara'):
+            return
+        self.detener_captura()
         self._camara.release()
         cv2.destroyAllWindows()   
         
+    def _validar_direccion(self, direccion):
+        if direccion not in self._direcciones:
+            raise ValueError(self._direcciones)
+        
+    def iniciar_captura(self, largo=32):
+        """
+        Inicia la captura en segundo plano sobre un buffer circular de
+        'largo' cuadros. A partir de entonces los métodos de lectura
+        utilizan el último cuadro disponible sin esperar al dispositivo.
+        """
+        if self._capturador is None:
+            self._capturador = Capturador(self._camara, largo)
+        self._capturador.iniciar()
+        
+    def detener_captura(self):
+        """ Detiene la captura en segundo plano """
+        if self._capturador is not None:
+            self._capturador.detener()
+            self._capturador = None
+            
+    def estadisticas_captura(self):
+        """ Estadísticas de la captura en segundo plano (o None) """
+        if self._capturador is None:
+            return None
+        return self._capturador.estadisticas()
+    
+    def esperar_cuadro(self, limite=0.5):
+        """
+        Con la captura en segundo plano espera un cuadro posterior al
+        último leído (False si pasan 'limite' segundos sin cuadros). Sin
+        captura devuelve True enseguida: cada lectura es un cuadro nuevo.
+        """
+        if self._capturador is None:
+            return True
+        return self._capturador.esperar(self._secuencia, limite)
+    
+    def bloque(self, n, salida=None):
+        """ Devuelve los últimos n cuadros capturados en segundo plano """
+        assert self._capturador is not None, "Captura no iniciada"
+        return self._capturador.bloque(n, salida)
+        
+    def _leer(self, limite=5):
+        """
+        Devuelve un cuadro: el último del capturador si está activo (si
+        aún no hay ninguno espera hasta 'limite' segundos) o una lectura
+        directa del dispositivo en caso contrario
+        """
+        if self._capturador is not None:
+            # El dispositivo lo lee sólo el hilo de captura: al iniciarla
+            # se espera su primer cuadro
+            if not self._capturador.esperar(None, limite):
+                raise IOError('La captura no entregó cuadros en ' +
+                              str(limite) + ' s')
+            cuadro, _, self._secuencia = self._capturador.ultimo()
+            return cuadro
+        self._secuencia = None
+        _, cuadro = self._camara.read()
+        return cuadro
+        
     def _calcular_distancia(self, x1=0, x2=0, y1=0, y2=0):
         """        
         Calcula la distancia entre coordenadas
@@ -212,7 +484,7 @@ class Camara(object):
         direccion : 
            Permite restringir o no la dirección del análisis:
            
-           'Horizontal', 'Vertical', 'Libre' -> No implementado aún                        
+           'Horizontal', 'Vertical', 'Libre'
         """  
         
         # Si la unidad o la direccion se vio modificada
@@ -220,6 +492,7 @@ class Camara(object):
         if unidad != '':
             self._unidad = unidad           
         if direccion != '':
+            self._validar_direccion(direccion)
             self._direccion = direccion
             
         # Verifica que no se introduzcan distancias negativas       
@@ -239,7 +512,7 @@ class Camara(object):
             # Mientras no comience el modo "dibujando"
             if self._dibujando == False:
                # Captura y muestra imágenes de la cámara
-               _, self._imagen = self._camara.read()
+               self._imagen = self._leer()
                cv2.imshow('Calibrando',self._imagen)
             
             # Invoca el método waitKey y en caso de que la tecla pulsada
@@ -262,11 +535,126 @@ class Camara(object):
             self._razon = self._calcular_distancia() / distancia    
             print (str(self._razon) + ' pixels = 1 ' + self._unidad) 
             
-    def perfil_intensidad(self, x0=0, y0=0, x1=0, y1=0, x2=0, y2=0):
+    def configurar_perfil(self, ancho=1, cuadros=1, metodo='Promedio'):
+        """
+        Configura el promediado de los perfiles de intensidad
+        
+        Parámetros
+        ----------
+        ancho : 
+           Cantidad de filas (o columnas) perpendiculares a la línea de
+           análisis que se promedian en cada cuadro
+        cuadros : 
+           Cantidad de cuadros consecutivos que se combinan
+        metodo : 
+           Combinación temporal: 'Promedio' o 'Mediana'
+        """
+        assert ancho >= 1
+        assert cuadros >= 1
+        assert metodo in ('Promedio', 'Mediana')
+        
+        self._ancho_banda = int(ancho)
+        self._cuadros = int(cuadros)
+        self._metodo = metodo
+        
+        # Descarta la pila temporal anterior
+        self._pila = None
+    
+    def _extraer_gris(self, imagen, filas, columnas, salida=None, eje=0):
+        """
+        Convierte a escala de grises sólo la región indicada (slices de
+        filas y columnas) directamente desde el cuadro BGR, sin generar
+        la imagen completa en grises. Si la región tiene más de una fila
+        (o columna, según 'eje') éstas se promedian. El resultado es un
+        array 1D float32 (cualquiera sea el ancho) y puede escribirse sobre
+        'salida', que debe ser float32.
+        """
+        if salida is not None and salida.dtype != np.float32:
+            raise ValueError('salida debe ser float32, no ' + 
+                             str(salida.dtype))
+        region = imagen[filas, columnas]
+        gris = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+        if region.shape[eje] > 1:
+            return np.mean(gris, axis=eje, dtype=np.float32, out=salida)
+        if salida is None:
+            return gris.ravel().astype(np.float32)
+        np.copyto(salida, gris.ravel())
+        return salida
+    
+    def _banda(self, centro, limite):
+        """ Slice de ancho _ancho_banda centrado en 'centro' """
+        inicio = max(0, centro - (self._ancho_banda - 1) // 2)
+        return slice(inicio, min(limite, inicio + self._ancho_banda))
+    
+    def _mapa_muestreo(self, x1, y1, x2, y2):
+        """
+        Mapas de muestreo para cv2.remap a lo largo del segmento 
+        (x1, y1) -> (x2, y2), con un punto por pixel de longitud y
+        _ancho_banda líneas paralelas desplazadas en la dirección normal.
+        
+        Se calculan una única vez por juego de coordenadas (es decir, por
+        calibración) y se guardan en formato de punto fijo, de modo que
+        cada cuadro sólo paga la interpolación de esos puntos.
+        """
+        clave = (x1, y1, x2, y2, self._ancho_banda)
+        if self._mapa is not None and self._mapa[0] == clave:
+            return self._mapa[1]
+        
+        distancia = np.hypot(x2 - x1, y2 - y1)
+        n = int(distancia) + 1
+        t = np.linspace(0, 1, n)
+        
+        # Desplazamientos perpendiculares al segmento (uno por línea)
+        k = np.arange(self._ancho_banda) - (self._ancho_banda - 1) / 2
+        normal_x = -(y2 - y1) / distancia if distancia else 0
+        normal_y = (x2 - x1) / distancia if distancia else 0
+        
+        mapa_x = x1 + t * (x2 - x1) + k[:, np.newaxis] * normal_x
+        mapa_y = y1 + t * (y2 - y1) + k[:, np.newaxis] * normal_y
+        mapa1, mapa2 = cv2.convertMaps(mapa_x.astype(np.float32),
+                                       mapa_y.astype(np.float32),
+                                       cv2.CV_16SC2)
+        
+        # Posición de cada muestra a lo largo del segmento (en pixels)
+        self._mapa = (clave, (mapa1, mapa2, t * distancia))
+        return self._mapa[1]
+    
+    def _apilar(self, perfil, salida=None):
+        """
+        Agrega el perfil a la pila temporal (buffer circular preasignado)
+        y devuelve la combinación de los últimos _cuadros perfiles
+        """
+        n = len(perfil)
+        if self._pila is None or self._pila.shape != (self._cuadros, n):
+            self._pila = np.empty((self._cuadros, n), dtype=np.float32)
+            self._pila_indice = 0
+            self._pila_llenos = 0
+            self._secuencia_apilada = None
+        
+        # Con la captura en segundo plano evita apilar dos veces el
+        # mismo cuadro
+        if self._secuencia is None or \
+           self._secuencia != self._secuencia_apilada:
+            self._pila[self._pila_indice] = perfil
+            self._pila_indice = (self._pila_indice + 1) % self._cuadros
+            self._pila_llenos = min(self._pila_llenos + 1, self._cuadros)
+            self._secuencia_apilada = self._secuencia
+        
+        pila = self._pila[:self._pila_llenos]
+        if self._metodo == 'Mediana':
+            return np.median(pila, axis=0, out=salida)
+        return np.mean(pila, axis=0, out=salida)
+    
+    def perfil_intensidad(self, x0=0, y0=0, x1=0, y1=0, x2=0, y2=0, 
+                          salida=None):
         """
         Método para analizar una linea de la imagen levantando el perfil
         de intensidades de la misma
         
+        El perfil puede promediarse sobre una banda perpendicular a la
+        línea y sobre los últimos cuadros (ver configurar_perfil). El
+        resultado es siempre float32.
+        
         Parámetros
         ----------
         <coords>  : 
@@ -276,7 +664,10 @@ class Camara(object):
            la dirección de analisis configurada)*
                     
            ej: si la dirección es horizontal la coordenada y2
-           es irrelevante                   
+           es irrelevante   
+        salida : 
+           Array 1D float32 opcional reutilizado para el perfil. Evita
+           asignar memoria en cada cuadro (ver graficar_intensidad)
         """    
         # Configura los parámetros por defecto
         if x1==0 & x2==0 & y1==0 & y2==0:    
@@ -287,19 +678,37 @@ class Camara(object):
             x2 = self._x2
             y2 = self._y2
         
-        # Captura la imagen actual y la convierte a escala de grises
-        _, self._imagen = self._camara.read()
-        self._gray = cv2.cvtColor(self._imagen,cv2.COLOR_BGR2GRAY)
+        # Captura la imagen actual y convierte a escala de grises sólo
+        # la línea analizada (o la banda alrededor de ella)
+        self._imagen = self._leer()
+        alto, ancho = self._imagen.shape[:2]
+        
+        # La salida recibe directamente el perfil sólo si no hay pila
+        destino = salida if self._cuadros == 1 else None
         
         # Calcula los datos acorde a la dirección de análisis
         if self._direccion == 'Horizontal':
             self._eje_x = np.arange(0,(x2-x1),1) / self._razon
-            self._eje_y = self._gray[y1,x1:x2]
+            perfil = self._extraer_gris(self._imagen, self._banda(y1, alto),
+                                        slice(x1, x2), destino, eje=0)
         elif self._direccion == 'Vertical':
             self._eje_x = np.arange(0,(y2-y1),1) / self._razon
-            self._eje_y = self._gray[x1,y1:y2]    
+            perfil = self._extraer_gris(self._imagen, slice(y1, y2),
+                                        self._banda(x1, ancho), destino, 
+                                        eje=1)
         elif self._direccion == 'Libre':
-            pass
+            mapa1, mapa2, posiciones = self._mapa_muestreo(x1, y1, x2, y2)
+            self._eje_x = posiciones / self._razon
+            # Interpolación bilineal sobre el cuadro BGR (sólo los puntos
+            # de la banda)
+            tira = cv2.remap(self._imagen, mapa1, mapa2, cv2.INTER_LINEAR)
+            perfil = self._extraer_gris(tira, slice(None), slice(None),
+                                        destino, eje=0)
+        
+        if self._cuadros > 1:
+            perfil = self._apilar(perfil, salida)
+        
+        self._eje_y = perfil
         
         return self._eje_x, self._eje_y
     
@@ -340,6 +749,8 @@ class Camara(object):
         # ----------------------------------------------
         
         # Configura la figura
+        import matplotlib.pyplot as plt
+        from matplotlib import animation
         fig1 = plt.figure()
         
         # Obtiene un primer conjunto de datos mediante perfil_intensidad()
@@ -360,9 +771,12 @@ class Camara(object):
             perfil.set_data([],[])
             return perfil,
 
+        # Buffer reutilizado por perfil_intensidad en cada cuadro
+        buffer = np.empty_like(eje_y)
+
         # La funcion animate genera el cuadro siguiente a mostrar
         def animate(i):
-            eje_x, eje_y = self.perfil_intensidad()
+            eje_x, eje_y = self.perfil_intensidad(salida=buffer)
             perfil.set_data(eje_x, eje_y)
             return perfil,
 
@@ -379,8 +793,7 @@ class Camara(object):
         
     def captura(self, color='Color'):
         # Realiza y devuelve una captura de imagen
-        _, captura = self._camara.read()
-        return captura
+        return self._leer()
         
     def color_a_gris(self, imagen):
         # Recibe una imagen color y la devuelve en escala de grises
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Comparación de los métodos de detección de mínimos de Difraccion.
+
+Mide la velocidad de analizar_patron con cada método y la concordancia de
+los mínimos encontrados respecto de find_peaks_cwt, sobre patrones sinc^2
+sintéticos y (opcionalmente) sobre perfiles grabados.
+
+Uso:
+    python rendimiento.py [perfiles.csv]
+
+El archivo de perfiles grabados contiene un perfil por fila (como los que
+devuelve Camara.perfil_intensidad) y la primera fila es el eje x.
+"""
+import sys
+from time import perf_counter
+import numpy as np
+from analisis import Difraccion, metodos_minimos
+
+def patron_sinc2(rendija=100e-6, long_onda=670e-9, distancia_pantalla=2,
+                 pixels=640, razon=6400, centro=0.05, saturacion=8,
+                 ruido=2, semilla=0):
+    """
+    Genera un perfil de intensidad sinc^2 como el de la cámara (uint8)
+
+    Parámetros:
+    -----------
+    rendija, long_onda, distancia_pantalla : float
+        Parámetros del experimento (en metros)
+    pixels : int
+        Largo del perfil
+    razon : float
+        Pixels por metro
+    centro : float
+        Posición del máximo central (m)
+    saturacion : float
+        Intensidad del orden cero respecto del nivel de saturación (255)
+    ruido : float
+        Desvío del ruido gaussiano en cuentas
+    """
+    azar = np.random.RandomState(semilla)
+    eje_x = np.arange(pixels) / razon
+    fase = rendija * (eje_x - centro) / (long_onda * distancia_pantalla)
+    eje_y = 255 * saturacion * np.sinc(fase) ** 2
+    eje_y = eje_y + azar.normal(0, ruido, pixels)
+    return eje_x, np.clip(eje_y, 0, 255).astype(np.uint8)
+
+def concordancia(referencia, minimos, tolerancia=0.1):
+    """
+    Fracción de los mínimos de referencia con un mínimo encontrado a
+    menos de 'tolerancia' veces la interfranja y la distancia media entre
+    los pares
+    """
+    if len(referencia) < 2 or len(minimos) == 0:
+        return 0.0, np.nan
+    tolerancia = tolerancia * np.median(np.diff(referencia))
+    distancias = np.abs(referencia[:, np.newaxis] - minimos).min(axis=1)
+    validos = distancias <= tolerancia
+    if not validos.any():
+        return 0.0, np.nan
+    return validos.mean(), distancias[validos].mean()
+
+def comparar_minimos(eje_x, perfiles, rendijas=None, repeticiones=3,
+                     **experimento):
+    """
+    Analiza cada perfil con todos los métodos de metodos_minimos y
+    devuelve un diccionario con cuadros/s, concordancia de los mínimos
+    respecto de 'CWT' y, si se conocen las rendijas reales (patrones
+    sintéticos), el error relativo medio de la rendija obtenida
+    """
+    resultados = dict()
+    minimos = dict()
+    for nombre in metodos_minimos:
+        obtenidas = list()
+        minimos[nombre] = list()
+        # Llamada sin cronometrar: las importaciones diferidas (scipy) y
+        # las inicializaciones de cada método no cuentan en la medición
+        if len(perfiles) > 0:
+            Difraccion(np.array(eje_x, dtype=float), perfiles[0],
+                       metodo_minimos=nombre,
+                       **experimento).analizar_patron()
+        inicio = perf_counter()
+        for _ in range(repeticiones):
+            for eje_y in perfiles:
+                patron = Difraccion(np.array(eje_x, dtype=float), eje_y,
+                                    metodo_minimos=nombre, **experimento)
+                x, y, rendija, m = patron.analizar_patron()
+                obtenidas.append(rendija)
+                # Vuelve los mínimos al eje original (sin centrar)
+                minimos[nombre].append(m + patron._centro)
+        duracion = perf_counter() - inicio
+        resultados[nombre] = {
+            'cuadros_por_segundo': repeticiones * len(perfiles) / duracion,
+            'error_rendija': np.nan}
+        if rendijas is not None:
+            obtenidas = np.array(obtenidas[:len(perfiles)])
+            resultados[nombre]['error_rendija'] = np.mean(
+                np.abs(obtenidas / np.asarray(rendijas) - 1))
+
+    for nombre in metodos_minimos:
+        pares = [concordancia(a, b) for a, b in
+                 zip(minimos['CWT'], minimos[nombre])]
+        resultados[nombre]['concordancia'] = np.mean([p[0] for p in pares])
+        resultados[nombre]['desvio_medio'] = np.nanmean([p[1] for p in pares])
+        resultados[nombre]['aceleracion'] = (
+            resultados[nombre]['cuadros_por_segundo'] /
+            resultados['CWT']['cuadros_por_segundo'])
+    return resultados
+
+def imprimir(titulo, resultados):
+    print('\n' + titulo)
+    print('-' * len(titulo))
+    for nombre, r in resultados.items():
+        print('{0:>8s}: {1:9.1f} cuadros/s  x{2:6.1f}  concordancia {3:6.1%}'
+              '  desvío {4:.2e}  error rendija {5:6.2%}'.format(
+              nombre, r['cuadros_por_segundo'], r['aceleracion'],
+              r['concordancia'], r['desvio_medio'], r['error_rendija']))
+
+if __name__ == '__main__':
+
+    #%% Patrones sintéticos (rendijas de 60 a 200 um)
+
+    perfiles = list()
+    rendijas = np.linspace(60e-6, 200e-6, 20)
+    for i, rendija in enumerate(rendijas):
+        eje_x, eje_y = patron_sinc2(rendija=rendija, semilla=i)
+        perfiles.append(eje_y)
+    imprimir('Patrones sintéticos', 
+             comparar_minimos(eje_x, perfiles, rendijas))
+
+    #%% Perfiles grabados
+
+    if len(sys.argv) > 1:
+        datos = np.loadtxt(sys.argv[1], delimiter=',')
+        imprimir('Perfiles grabados: ' + sys.argv[1],
+                 comparar_minimos(datos[0], datos[1:]))
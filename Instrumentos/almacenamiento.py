@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Almacenamiento binario por columnas de las mediciones.
+
+Un archivo de datos es un .npz sin compresión (puede abrirse también con
+np.load) que contiene:
+
+    columnas.npy        nombres de las columnas
+    estado.npy          estado del instrumento y otros datos (JSON)
+    <columna>.npy       datos de cada columna (archivo compactado)
+    <columna>_#####.npy bloques de cada columna (durante la adquisición)
+
+Durante la adquisición ArchivoDatos agrega bloques al final del archivo,
+de modo que un corte conserva lo medido hasta el último bloque. Al
+cerrarlo los bloques se unen en una única entrada por columna, que cargar
+abre con memory-map sin copiar los datos.
+
+Ejemplo:
+
+    with ArchivoDatos('barrido.npz', ['F', 'X', 'Y']) as archivo:
+        for fila in filas:
+            archivo.agregar(fila)
+
+    datos = cargar('barrido.npz')
+    datos['X']
+"""
+import os
+import json
+import time
+import struct
+import zipfile
+from collections import OrderedDict
+import numpy as np
+
+def _escribirArray(archivoZip, nombre, array):
+    """ Agrega un array como entrada .npy sin compresión """
+    with archivoZip.open(nombre + '.npy', 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, np.asanyarray(array),
+                                  allow_pickle=False)
+
+def _estadoJSON(estado):
+    """ Convierte el estado (con tipos de numpy) a JSON """
+    def convertir(valor):
+        if hasattr(valor, 'item'):
+            return valor.item()
+        return str(valor)
+    return json.dumps(estado, default=convertir, ensure_ascii=False)
+
+class ArchivoDatos(object):
+    '''
+    Archivo de datos en el que se agregan filas durante la adquisición.
+
+    Parámetros
+    ----------
+    ruta : str
+        Archivo a crear (se sobrescribe si existe).
+    columnas : list
+        Nombres de las columnas.
+    estado : dict (opcional)
+        Estado del instrumento u otros datos a guardar junto a los datos.
+    puntosBloque : int
+        Filas acumuladas en memoria antes de escribir un bloque.
+    '''
+    def __init__(self, ruta, columnas, estado=None, puntosBloque=1024):
+        if len(set(columnas)) != len(columnas):
+            raise ValueError('Nombres de columna repetidos')
+        self.ruta = ruta
+        self.columnas = [str(c) for c in columnas]
+        self.puntosBloque = puntosBloque
+        self.filas = 0
+
+        self._pendientes = list()
+        self._enMemoria = 0
+        self._bloques = 0
+
+        descripcion = {'estado': estado if estado is not None else dict(),
+                       'fecha': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with zipfile.ZipFile(ruta, 'w', zipfile.ZIP_STORED) as archivo:
+            _escribirArray(archivo, 'columnas', np.array(self.columnas))
+            _escribirArray(archivo, 'estado',
+                           np.array(_estadoJSON(descripcion)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self.cerrar()
+
+    def agregar(self, datos):
+        """ Agrega una fila o un array de filas (una columna por campo) """
+        datos = np.array(datos, dtype=float, ndmin=2)
+        if datos.shape[1] != len(self.columnas):
+            raise ValueError('Se esperaban ' + str(len(self.columnas)) +
+                             ' columnas: ' + ', '.join(self.columnas))
+        self._pendientes.append(datos)
+        self._enMemoria += len(datos)
+        self.filas += len(datos)
+        if self._enMemoria >= self.puntosBloque:
+            self.vaciar()
+
+    def vaciar(self):
+        """ Escribe en el archivo las filas acumuladas como un bloque """
+        if self._enMemoria == 0:
+            return
+        bloque = np.concatenate(self._pendientes)
+        with zipfile.ZipFile(self.ruta, 'a', zipfile.ZIP_STORED) as archivo:
+            for j, columna in enumerate(self.columnas):
+                _escribirArray(archivo,
+                               '{0}_{1:05d}'.format(columna, self._bloques),
+                               bloque[:, j])
+        self._bloques += 1
+        self._pendientes = list()
+        self._enMemoria = 0
+
+    def cerrar(self, compactar=True):
+        """ Escribe lo pendiente y une los bloques de cada columna """
+        self.vaciar()
+        if compactar:
+            compactarArchivo(self.ruta)
+
+def compactarArchivo(ruta):
+    """ Reescribe el archivo con una única entrada por columna """
+    columnas = _leerColumnas(ruta)
+    temporal = ruta + '.tmp'
+    with zipfile.ZipFile(ruta) as origen, \
+         zipfile.ZipFile(temporal, 'w', zipfile.ZIP_STORED) as destino:
+        for nombre in ('columnas.npy', 'estado.npy'):
+            destino.writestr(origen.getinfo(nombre), origen.read(nombre))
+        for columna in columnas:
+            partes = [_cargarEntrada(ruta, origen, entrada, False)
+                      for entrada in _entradas(origen, columna)]
+            datos = np.concatenate(partes) if partes else np.empty(0)
+            _escribirArray(destino, columna, datos)
+    os.replace(temporal, ruta)
+
+def _leerColumnas(ruta):
+    with np.load(ruta) as archivo:
+        return [str(c) for c in archivo['columnas']]
+
+def _entradas(archivoZip, columna):
+    """ Entradas de una columna en orden (compactada o en bloques) """
+    nombres = archivoZip.namelist()
+    if columna + '.npy' in nombres:
+        return [columna + '.npy']
+    prefijo = columna + '_'
+    return sorted(n for n in nombres if n.startswith(prefijo) and
+                  n[len(prefijo):-4].isdigit() and n.endswith('.npy'))
+
+def _cargarEntrada(ruta, archivoZip, entrada, mmap):
+    """ Lee una entrada .npy; con mmap la abre sin copiarla a memoria """
+    info = archivoZip.getinfo(entrada)
+    if not mmap or info.compress_type != zipfile.ZIP_STORED:
+        with archivoZip.open(entrada) as f:
+            return np.lib.format.read_array(f, allow_pickle=False)
+    with open(ruta, 'rb') as f:
+        # Encabezado local de la entrada (30 bytes + nombre + extra)
+        f.seek(info.header_offset)
+        local = f.read(30)
+        largoNombre, largoExtra = struct.unpack('<HH', local[26:30])
+        f.seek(info.header_offset + 30 + largoNombre + largoExtra)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            forma, fortran, tipo = np.lib.format.read_array_header_1_0(f)
+        else:
+            forma, fortran, tipo = np.lib.format.read_array_header_2_0(f)
+        inicio = f.tell()
+    if int(np.prod(forma)) == 0:
+        return np.empty(forma, dtype=tipo)
+    return np.memmap(ruta, dtype=tipo, mode='r', offset=inicio, shape=forma,
+                     order='F' if fortran else 'C')
+
+def cargar(ruta, mmap=True):
+    """
+    Carga un archivo de datos. Devuelve un diccionario ordenado columna ->
+    array. Las columnas de un archivo compactado se abren con memory-map
+    (mmap=True); las que están en bloques se concatenan.
+    """
+    columnas = _leerColumnas(ruta)
+    datos = OrderedDict()
+    with zipfile.ZipFile(ruta) as archivo:
+        for columna in columnas:
+            entradas = _entradas(archivo, columna)
+            if len(entradas) == 1:
+                datos[columna] = _cargarEntrada(ruta, archivo, entradas[0],
+                                                mmap)
+            else:
+                partes = [_cargarEntrada(ruta, archivo, e, False)
+                          for e in entradas]
+                datos[columna] = (np.concatenate(partes) if partes
+                                  else np.empty(0))
+    return datos
+
+def leerEstado(ruta):
+    """ Devuelve el estado guardado junto a los datos (y la fecha) """
+    with np.load(ruta) as archivo:
+        return json.loads(str(archivo['estado']))
+
+def guardar(ruta, columnas, datos, estado=None):
+    """
+    Guarda las columnas indicadas (secuencia de arrays del mismo largo) en
+    un archivo de datos compactado
+    """
+    if len(columnas) != len(datos):
+        raise ValueError(str(len(columnas)) + ' nombres para ' +
+                         str(len(datos)) + ' columnas')
+    archivo = ArchivoDatos(ruta, columnas, estado)
+    archivo.agregar(np.column_stack(datos))
+    archivo.cerrar()
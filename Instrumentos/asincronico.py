@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Variante asincrónica (asyncio) del manejo del Lockin SR830.
+
+Cada instrumento tiene un hilo propio para las llamadas bloqueantes de
+VISA, de modo que varios Lockin (o un Lockin y la Camara) conectados a la
+misma PC adquieren en forma concurrente: el tiempo total queda dado por
+el instrumento más lento y no por la suma de todos.
+
+Ejemplo:
+
+    async def medir(loc1, loc2):
+        return await asyncio.gather(
+            loc1.barrerFrecuencia(100, 20000, 100, 'X', 'Y'),
+            loc2.barrerFrecuencia(100, 20000, 100, 'R', 'T'))
+
+    loc1 = LockinAsincronico('GPIB0::8::INSTR')
+    loc2 = LockinAsincronico('GPIB0::9::INSTR')
+    (f1, datos1), (f2, datos2) = asyncio.run(medir(loc1, loc2))
+"""
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from instrumentos import Lockin
+
+class LockinAsincronico(object):
+    '''
+    Envoltorio asincrónico de la clase Lockin.
+
+    Parámetros
+    ----------
+    resource : Cadena (opcional)
+        Nombre del dispositivo a utilizar (ver Lockin).
+    modo_simulador : Bool (opcional)
+        Utiliza el simulador en lugar del instrumento.
+    lockin : Lockin (opcional)
+        Objeto Lockin ya conectado a utilizar en lugar de crear uno nuevo.
+
+    Todas las llamadas al instrumento se ejecutan en un único hilo por
+    instrumento (se respeta el orden de los comandos) y las esperas se
+    realizan con asyncio.sleep sin bloquear al resto de las tareas.
+    '''
+
+    def __init__(self, resource='', modo_simulador=False, lockin=None):
+        if lockin is None:
+            lockin = Lockin(resource, modo_simulador)
+        self.lockin = lockin
+        self._ejecutor = ThreadPoolExecutor(max_workers=1)
+
+    def cerrar(self):
+        """ Libera el hilo del instrumento """
+        self._ejecutor.shutdown(wait=True)
+
+    async def ejecutar(self, funcion, *args, **kwargs):
+        """
+        Ejecuta una función bloqueante en el hilo del instrumento y espera
+        su resultado sin bloquear el bucle de eventos
+        """
+        bucle = asyncio.get_running_loop()
+        return await bucle.run_in_executor(
+            self._ejecutor, functools.partial(funcion, *args, **kwargs))
+
+    #----------------------------------------------------------------------
+    # Propiedades
+    #----------------------------------------------------------------------
+
+    def _validarPropiedad(self, nombre):
+        if nombre not in Lockin._nombresPropiedades:
+            raise ValueError(Lockin._nombresPropiedades)
+
+    async def leer(self, nombre):
+        """ Lee la propiedad indicada (p. ej. 'refFrec') """
+        self._validarPropiedad(nombre)
+        # Los valores de la copia local se devuelven sin pasar por el hilo.
+        # Se toma el valor guardado y no la propiedad: si la copia vence
+        # entre la comprobación y la lectura, la propiedad consultaría el
+        # instrumento desde este hilo, en paralelo con el del Lockin.
+        if self.lockin._cacheValida(nombre):
+            return getattr(self.lockin, '_' + nombre)
+        return await self.ejecutar(getattr, self.lockin, nombre)
+
+    async def escribir(self, nombre, valor):
+        """ Escribe la propiedad indicada """
+        self._validarPropiedad(nombre)
+        await self.ejecutar(setattr, self.lockin, nombre, valor)
+
+    async def configurar(self, verificar=False, **propiedades):
+        """ Configura varias propiedades en una única escritura """
+        await self.ejecutar(self.lockin.configurar, verificar,
+                            **propiedades)
+
+    async def sincronizar(self):
+        """ Relee todas las propiedades desde el instrumento """
+        return await self.ejecutar(self.lockin.sincronizar)
+
+    #----------------------------------------------------------------------
+    # Autofunciones
+    #----------------------------------------------------------------------
+
+    async def _esperarFinalizacion(self, espera=0.01, maxima=0.5, limite=60):
+        """
+        Consulta el byte de estado con intervalos crecientes hasta que el
+        instrumento termina de ejecutar los comandos
+        """
+        inicio = time.time()
+        while not await self.ejecutar(self.lockin._finalizado):
+            if time.time() - inicio > limite:
+                raise TimeoutError('El instrumento no finalizó')
+            await asyncio.sleep(espera)
+            espera = min(2 * espera, maxima)
+
+    async def autoGanancia(self):
+        """ Ejecuta la funcion AutoGanancia del Lockin """
+        await self.ejecutar(self.lockin._lockin.write, 'AGAN')
+        self.lockin.invalidar('inpSens')
+        await self._esperarFinalizacion()
+
+    async def autoReserva(self):
+        """ Ejecuta la funcion AutoReserva del Lockin """
+        await self.ejecutar(self.lockin._lockin.write, 'ARSV')
+        self.lockin.invalidar('inpRmod')
+        await self._esperarFinalizacion()
+
+    async def autoFase(self):
+        """ Ejecuta la funcion AutoFase del Lockin """
+        await self.ejecutar(self.lockin._lockin.write, 'APHS')
+        self.lockin.invalidar('refFase')
+        await asyncio.sleep(2)
+
+    async def autoOffset(self, num):
+        """ Ejecuta la funcion AutoOffset del Lockin: X(1), Y(2), R(3) """
+        if not (num == 1 or num == 2 or num == 3):
+            raise ValueError('X(1), Y(2), R(3)')
+        await self.ejecutar(self.lockin._lockin.write,
+                            'AOFF{0}'.format(num))
+        await asyncio.sleep(2)
+
+    #----------------------------------------------------------------------
+    # Adquisición
+    #----------------------------------------------------------------------
+
+    async def consultarSimultaneo(self, *parametros):
+        """ Consulta simultaneamente los valores indicados (ver Lockin) """
+        return await self.ejecutar(self.lockin.consultarSimultaneo,
+                                   *parametros)
+
+    async def tiempoAsentamiento(self, constantes=None):
+        """ Tiempo de asentamiento del filtro de salida (ver Lockin) """
+        return await self.ejecutar(self.lockin.tiempoAsentamiento,
+                                   constantes)
+
+    async def barrerFrecuencia(self, inicio, fin, pasos, *parametros,
+                               espaciado='Lineal', espera=None):
+        """
+        Barrido de frecuencia con obtención de multiples parámetros (ver
+        Lockin.barrerFrecuencia). Durante el asentamiento del filtro el
+        bucle de eventos atiende a los demás instrumentos. Devuelve las
+        frecuencias y los datos (un parámetro por fila); no grafica.
+        """
+        frecuencias = self.lockin._frecuenciasBarrido(inicio, fin, pasos,
+                                                      espaciado)
+        if espera is None:
+            espera = await self.tiempoAsentamiento()
+
+        await self.consultarSimultaneo(*parametros)
+
+        datos = np.zeros([len(frecuencias), len(parametros)])
+        for i, frecuencia in enumerate(frecuencias):
+            inicioPaso = time.time()
+            await self.escribir('refFrec', frecuencia)
+            await asyncio.sleep(max(0, espera - (time.time() - inicioPaso)))
+            datos[i] = await self.consultarSimultaneo(*parametros)
+
+        self.lockin._frecBarrido = frecuencias
+        self.lockin._datosBarrido = datos.transpose()
+        self.lockin._parametrosBarrido = parametros
+        self.lockin.registro.agregar(
+            'Barrido', parametros,
+            [('F', frecuencias)] + list(zip(parametros,
+                                            self.lockin._datosBarrido)),
+            self.lockin.estadoPropiedades(consultar=False))
+        return frecuencias, self.lockin._datosBarrido
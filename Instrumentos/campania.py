@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Campañas de medición: barridos de frecuencia sobre varias muestras
+descriptos por un plan.
+
+El plan es una lista de etapas. Cada etapa indica la carpeta de destino,
+las muestras y los parámetros del barrido; cada muestra se mide
+'repeticiones' veces. Los resultados de cada barrido se guardan como
+
+    <raiz>/<carpeta>/<muestra>.npz    datos y estado (almacenamiento.py)
+    <raiz>/<carpeta>/<muestra>.log    propiedades del Lockin (crearRegistro)
+    <raiz>/<carpeta>/<muestra>.png    gráfico
+
+(con el sufijo _01, _02, ... si hay repeticiones). El .npz se escribe con
+otro nombre y se renombra al terminar, de modo que su existencia indica un
+barrido completo: al ejecutar de nuevo la campaña (por ejemplo tras un
+corte) se omite lo ya medido y sólo se grafican los PNG faltantes.
+
+Mientras el Lockin mide un barrido, el anterior se escribe en un hilo
+aparte y se grafica en otro proceso. Al finalizar se informa el tiempo
+utilizado en cada fase.
+
+Ejemplo:
+
+    plan = [dict(carpeta='Primera medición - 100 pts',
+                 muestras=('Vacio', 'Bronce13mm', 'Aluminio13mm'),
+                 inicio=100, fin=20000, pasos=100, parametros=('X', 'Y'),
+                 graficar=2),
+            dict(carpeta='Sexta medición', muestras=('Vacio', 'Acero'),
+                 inicio=100, fin=20000, pasos=1000,
+                 parametros=('T', 'R', 'X', 'Y'), graficar=1,
+                 repeticiones=3)]
+
+    campania = Campania(loc1, plan, raiz='Datos')
+    campania.ejecutar()
+"""
+import os
+import contextlib
+from time import perf_counter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import almacenamiento
+import graficos
+
+# Claves de una etapa del plan: obligatorias y opcionales (con su valor por
+# defecto). graficar=None grafica todos los parámetros y 0 ninguno.
+_requeridas = ('carpeta', 'muestras', 'inicio', 'fin', 'pasos', 'parametros')
+_opcionales = {'espaciado': 'Lineal', 'espera': None, 'refinar': 0,
+               'repeticiones': 1, 'graficar': None, 'propiedades': None}
+
+def _graficar(archivoDatos, archivo, cantidad):
+    """ Grafica un barrido guardado (en el proceso graficador) """
+    inicio = perf_counter()
+    parcial = archivo + '.parcial.png'
+    graficos.guardarArchivo(archivoDatos, parcial, cantidad)
+    os.replace(parcial, archivo)
+    return perf_counter() - inicio
+
+class Item(object):
+    '''
+    Un barrido de la campaña: muestra, repetición y etapa del plan.
+    'base' es la ruta de los archivos sin extensión.
+    '''
+    def __init__(self, etapa, muestra, repeticion, base):
+        self.etapa = etapa
+        self.muestra = muestra
+        self.repeticion = repeticion
+        self.base = base
+
+    def __repr__(self):
+        return 'Item(' + self.base + ')'
+
+class Campania(object):
+    '''
+    Ejecuta un plan de barridos con un Lockin.
+
+    Parámetros
+    ----------
+    lockin : Lockin
+        Instrumento a utilizar.
+    plan : list
+        Etapas (diccionarios) con las claves carpeta, muestras, inicio,
+        fin, pasos y parametros (ver Lockin.medirBarrido), y opcionalmente
+        espaciado, espera, refinar, repeticiones, graficar (cantidad de
+        parámetros) y propiedades (diccionario para Lockin.configurar).
+    raiz : str
+        Directorio donde se crean las carpetas.
+    confirmar : function (opcional)
+        Se llama con el Item antes de medir cada muestra nueva (por ej.
+        para esperar el cambio de muestra). Sin ella la campaña no se
+        detiene.
+    procesos : int
+        Procesos que grafican en paralelo.
+    '''
+    fases = ('espera', 'configuracion', 'medicion', 'escritura', 'graficos')
+
+    def __init__(self, lockin, plan, raiz='.', confirmar=None, procesos=1):
+        self.lockin = lockin
+        self.raiz = raiz
+        self.confirmar = confirmar
+        self.procesos = procesos
+        self.items = self._expandir(plan)
+        self.tiempos = OrderedDict((fase, list()) for fase in self.fases)
+        self.omitidos = 0
+        self.duracion = 0
+
+    def _expandir(self, plan):
+        """ Valida el plan y devuelve la lista de Items en orden """
+        items = list()
+        for etapa in plan:
+            faltan = [c for c in _requeridas if c not in etapa]
+            sobran = [c for c in etapa
+                      if c not in _requeridas and c not in _opcionales]
+            if faltan or sobran:
+                raise ValueError('Etapa ' + str(etapa.get('carpeta')) +
+                                 ': faltan ' + str(faltan) +
+                                 ', desconocidas ' + str(sobran))
+            completa = dict(_opcionales)
+            completa.update(etapa)
+            for muestra in completa['muestras']:
+                for r in range(completa['repeticiones']):
+                    base = os.path.join(self.raiz, completa['carpeta'],
+                                        muestra)
+                    if completa['repeticiones'] > 1:
+                        base += '_{0:02d}'.format(r + 1)
+                    items.append(Item(completa, muestra, r, base))
+        return items
+
+    def _completo(self, item):
+        return os.path.exists(item.base + '.npz')
+
+    def pendientes(self):
+        """ Items que todavía no tienen sus datos en disco """
+        return [item for item in self.items if not self._completo(item)]
+
+    @contextlib.contextmanager
+    def _cronometro(self, fase):
+        inicio = perf_counter()
+        try:
+            yield
+        finally:
+            self.tiempos[fase].append(perf_counter() - inicio)
+
+    def _escribir(self, item, arrays, estado, registro, graficador, dibujos):
+        """ Guarda el barrido (hilo escritor) y encarga su gráfico """
+        with self._cronometro('escritura'):
+            with open(item.base + '.log', 'w') as f:
+                f.write(registro)
+            parcial = item.base + '.parcial'
+            almacenamiento.guardar(parcial, list(arrays),
+                                   list(arrays.values()), estado)
+            os.replace(parcial, item.base + '.npz')
+        if item.etapa['graficar'] != 0:
+            dibujos.append(graficador.submit(
+                _graficar, item.base + '.npz', item.base + '.png',
+                item.etapa['graficar']))
+
+    def ejecutar(self):
+        """
+        Mide los barridos pendientes. Ante un error se terminan de guardar
+        los barridos ya medidos antes de propagarlo. Devuelve el resumen.
+        """
+        self.tiempos = OrderedDict((fase, list()) for fase in self.fases)
+        self.omitidos = 0
+        inicio = perf_counter()
+        escritor = ThreadPoolExecutor(max_workers=1)
+        graficador = ProcessPoolExecutor(max_workers=self.procesos)
+        escrituras = list()
+        dibujos = list()
+        anterior = None
+        try:
+            for n, item in enumerate(self.items):
+                etapa = item.etapa
+                if self._completo(item):
+                    self.omitidos += 1
+                    if (etapa['graficar'] != 0 and
+                        not os.path.exists(item.base + '.png')):
+                        dibujos.append(graficador.submit(
+                            _graficar, item.base + '.npz',
+                            item.base + '.png', etapa['graficar']))
+                    continue
+
+                print('[{0}/{1}] {2}'.format(n + 1, len(self.items),
+                                             item.base))
+                if self.confirmar is not None and item.muestra != anterior:
+                    with self._cronometro('espera'):
+                        self.confirmar(item)
+                anterior = item.muestra
+
+                with self._cronometro('configuracion'):
+                    os.makedirs(os.path.dirname(item.base) or '.',
+                                exist_ok=True)
+                    if etapa['propiedades']:
+                        self.lockin.configurar(**etapa['propiedades'])
+                    registro = list()
+                    self.lockin.listarPropiedades(impr=registro.append,
+                                                  nL='\n')
+
+                with self._cronometro('medicion'):
+                    medicion = self.lockin.medirBarrido(
+                        etapa['inicio'], etapa['fin'], etapa['pasos'],
+                        *etapa['parametros'], espaciado=etapa['espaciado'],
+                        espera=etapa['espera'], refinar=etapa['refinar'])
+
+                # Los arrays se toman aquí: el registro del Lockin puede
+                # volcarlos a disco mientras el escritor los guarda
+                escrituras.append(escritor.submit(
+                    self._escribir, item, medicion.arrays, medicion.estado,
+                    ''.join(registro), graficador, dibujos))
+        finally:
+            escritor.shutdown(wait=True)
+            graficador.shutdown(wait=True)
+            self.duracion = perf_counter() - inicio
+
+        for escritura in escrituras:
+            escritura.result()
+        for dibujo in dibujos:
+            self.tiempos['graficos'].append(dibujo.result())
+        return self.resumen()
+
+    def resumen(self, impr=print):
+        """
+        Imprime y devuelve el tiempo total, la cantidad y el promedio de
+        cada fase. La escritura y los gráficos se superponen con las
+        mediciones, por lo que las fases pueden sumar más que el total.
+        """
+        resultado = OrderedDict()
+        impr('{0:>14s} {1:>10s} {2:>6s} {3:>10s}'.format(
+             'Fase', 'Total (s)', 'N', 'Prom. (s)'))
+        for fase, tiempos in self.tiempos.items():
+            total = sum(tiempos)
+            promedio = total / len(tiempos) if tiempos else 0
+            resultado[fase] = (total, len(tiempos), promedio)
+            impr('{0:>14s} {1:10.2f} {2:6d} {3:10.3f}'.format(
+                 fase, total, len(tiempos), promedio))
+        medidos = len(self.tiempos['medicion'])
+        impr('Total: {0:.2f} s, {1} barridos medidos, {2} omitidos'.format(
+             self.duracion, medidos, self.omitidos))
+        resultado['total'] = (self.duracion, medidos, self.omitidos)
+        return resultado
@@ -25,31 +25,37 @@ loc1.autoOffset(3)
 loc1.autoReserva()
 
 #%% Se modifican las propiedades
+# Dentro de la transacción los comandos se envían juntos al final
+
+with loc1.transaccion():
+    loc1.refAmpl = 1
+    loc1.refFase = 0
+    loc1.refFrec = 1000
+    loc1.refHarm = 1
+    loc1.refModo = 'Internal'
+    loc1.refRslp = 'Sine'
+    
+    loc1.auxout1 = 0
+    loc1.auxout2 = 0
+    loc1.auxout3 = 0
+    loc1.auxout4 = 0
+    
+    loc1.inpCoup = 'AC'
+    loc1.inpGnd = 'Float'
+    loc1.inpLine = 'Out'
+    loc1.inpModo = 'A'
+    loc1.inpOfsl = '12dB/oct'
+    loc1.inpOflt = '100 ms'
+    loc1.inpRmod = 'Low Noise'
+    loc1.inpSens = 1.0
+    loc1.inpSync = 'Off'
+    
+    loc1.ch1Modo = 'X'
+    loc1.ch2Modo = 'Y'
 
-loc1.refAmpl = 1
-loc1.refFase = 0
-loc1.refFrec = 1000
-loc1.refHarm = 1
-loc1.refModo = 'Internal'
-loc1.refRslp = 'Sine'
-
-loc1.auxout1 = 0
-loc1.auxout2 = 0
-loc1.auxout3 = 0
-loc1.auxout4 = 0
-
-loc1.inpCoup = 'AC'
-loc1.inpGnd = 'Float'
-loc1.inpLine = 'Out'
-loc1.inpModo = 'A'
-loc1.inpOfsl = '12dB/oct'
-loc1.inpOflt = '100 ms'
-loc1.inpRmod = 'Low Noise'
-loc1.inpSens = 1.0
-loc1.inpSync = 'Off'
-
-loc1.ch1Modo = 'X'
-loc1.ch2Modo = 'Y'
+#%% Configuración de varias propiedades en una única escritura
+
+loc1.configurar(refFrec=2000, inpOflt='30 ms', ch1Modo='R', verificar=True)
 
 #%% Crea un archivo .log con los parámetros utilizados
     
@@ -79,6 +85,15 @@ for i in range(len(parametros)):
     
 parametros = 'X', 'Y', 'R'
 resultados = loc1.barrerFrecuencia(100,200,100,2,*parametros)
+
+#%% Barrido sin gráficos (los PNG se dibujan en otro proceso)
+
+from graficos import Renderizador
+
+with Renderizador() as renderizador:
+    medicion = loc1.medirBarrido(100,200,100,*parametros)
+    renderizador.enviar(medicion, 'Barrido.png', 2)
+print(medicion['F'][0], medicion['X'][0], medicion.estado['refFrec'])
     
 #%% Lectura del buffer
 
@@ -89,3 +104,10 @@ x, y, fig = loc1.leerBuffer(canal=1, frecMuestreo='64 Hz', puntos = 100,
                         
 loc1.guardarDatos(archivoDatos='Datos.csv', datos=[x,y], nombre_columnas='X, Y')
 x2, y2 = loc1.cargarDatos(archivoDatos='Datos.csv')
+
+# Formato binario: incluye el estado del instrumento y carga con mmap
+loc1.guardarDatos(archivoDatos='Datos.npz', datos=[x,y], nombre_columnas='Tiempo, X')
+x3, y3 = loc1.cargarDatos(archivoDatos='Datos.npz')
+
+# Último barrido con los nombres de sus parámetros (F, X, Y, R)
+loc1.guardarBarrido('Barrido.npz')
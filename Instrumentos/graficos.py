@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Gráficos de las mediciones, separados de la adquisición.
+
+Las figuras se construyen con matplotlib.figure y el lienzo Agg, sin
+importar pyplot: sirven en una sesión sin pantalla y no interfieren con
+las ventanas abiertas. El Renderizador escribe los PNG en un proceso
+aparte, de modo que la adquisición no espera a matplotlib. Sólo ventana,
+para los gráficos interactivos, utiliza pyplot.
+
+Ejemplo:
+
+    with Renderizador() as renderizador:
+        for nombre in nombres:
+            medicion = loc1.medirBarrido(100, 20000, 100, 'X', 'Y',
+                                         archivoDatos=nombre + '.npz')
+            renderizador.enviar(medicion, nombre + '.png', 2)
+"""
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+def tituloBarrido(frecuencias):
+    """ Título de un barrido entre la primera y la última frecuencia """
+    return ('Barrido de frecuencia: {0:g} a {1:g} Hz'.format(
+            frecuencias[0], frecuencias[-1]) if len(frecuencias) > 0
+            else 'Barrido de frecuencia')
+
+def ventana(titulo):
+    """
+    Figura de pyplot (uso interactivo) con el título de ventana indicado.
+    Es la única función del módulo que importa pyplot.
+    """
+    import matplotlib.pyplot as plt
+    figura = plt.figure()
+    if figura.canvas.manager is not None:
+        figura.canvas.manager.set_window_title(titulo)
+    return figura
+
+def dibujarBarrido(ejes, frecuencias, datos, parametros, cantidad=None):
+    """
+    Dibuja en los ejes los primeros 'cantidad' parámetros de un barrido
+    (datos: un array por parámetro)
+    """
+    if cantidad is None:
+        cantidad = len(parametros)
+    if not 0 < cantidad <= len(parametros):
+        raise ValueError('0 < cantidad <= ' + str(len(parametros)))
+
+    ejes.set_title(tituloBarrido(frecuencias))
+    ejes.set_xlabel('Frecuencia (Hz)')
+    for i in range(cantidad):
+        ejes.plot(frecuencias, datos[i])
+
+    if cantidad == 1:
+        if parametros[0] == 'T':
+            ejes.set_ylabel('Fase (º)')
+        else:
+            ejes.set_ylabel(parametros[0] + '(Vrms)')
+        ejes.legend([parametros[0]], loc='best', frameon=True,
+                    shadow=True, fancybox=True)
+    else:
+        ejes.set_ylabel('Tensión (Vrms)')
+        ejes.legend(parametros, loc='best', frameon=True,
+                    shadow=True, fancybox=True)
+
+def _columnasBarrido(medicion):
+    """ Frecuencias y datos de una Medicion de tipo 'Barrido' """
+    if medicion.tipo != 'Barrido':
+        raise ValueError('Se esperaba un barrido, no ' + str(medicion.tipo))
+    arrays = medicion.arrays
+    return (np.array(arrays['F']),
+            [np.array(arrays[p]) for p in medicion.parametros])
+
+def figuraBarrido(medicion, cantidad=None):
+    """
+    Figura (sin pyplot, lienzo Agg) de una Medicion de tipo 'Barrido'.
+    Se guarda con figura.savefig y se libera al dejar de usarla.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    frecuencias, datos = _columnasBarrido(medicion)
+    figura = Figure()
+    FigureCanvasAgg(figura)
+    dibujarBarrido(figura.add_subplot(111), frecuencias, datos,
+                   medicion.parametros, cantidad)
+    return figura
+
+def _guardarBarrido(archivo, frecuencias, datos, parametros, cantidad, dpi):
+    """ Dibuja y guarda un barrido (se ejecuta en el Renderizador) """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figura = Figure()
+    FigureCanvasAgg(figura)
+    dibujarBarrido(figura.add_subplot(111), frecuencias, datos, parametros,
+                   cantidad)
+    figura.savefig(archivo, dpi=dpi)
+    return archivo
+
+def guardarBarrido(medicion, archivo, cantidad=None, dpi=100):
+    """ Guarda el gráfico de un barrido sin pasar por pyplot """
+    frecuencias, datos = _columnasBarrido(medicion)
+    return _guardarBarrido(archivo, frecuencias, datos, medicion.parametros,
+                           cantidad, dpi)
+
+def guardarArchivo(archivoDatos, archivo, cantidad=None, dpi=100):
+    """
+    Guarda el gráfico de un barrido guardado en disco (formato de
+    almacenamiento.py, primera columna 'F')
+    """
+    import almacenamiento
+    datos = almacenamiento.cargar(archivoDatos)
+    nombres = list(datos)
+    if len(nombres) < 2 or nombres[0] != 'F':
+        raise ValueError(archivoDatos + ' no es un barrido (F, ...)')
+    return _guardarBarrido(archivo, datos['F'],
+                           [datos[n] for n in nombres[1:]], nombres[1:],
+                           cantidad, dpi)
+
+class Renderizador(object):
+    '''
+    Escribe los gráficos de las mediciones en procesos aparte.
+
+    Parámetros
+    ----------
+    procesos : int
+        Cantidad de procesos que dibujan en paralelo.
+
+    enviar devuelve enseguida (los datos se copian al proceso); los errores
+    de dibujo se informan en esperar o al cerrar.
+    '''
+    def __init__(self, procesos=1):
+        self._ejecutor = ProcessPoolExecutor(max_workers=procesos)
+        self._pendientes = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self.cerrar()
+
+    def enviar(self, medicion, archivo, cantidad=None, dpi=100):
+        """ Agrega a la cola el gráfico de un barrido en 'archivo' """
+        frecuencias, datos = _columnasBarrido(medicion)
+        if cantidad is not None and not (
+           0 < cantidad <= len(medicion.parametros)):
+            raise ValueError('0 < cantidad <= ' +
+                             str(len(medicion.parametros)))
+        tarea = self._ejecutor.submit(_guardarBarrido, archivo, frecuencias,
+                                      datos, medicion.parametros, cantidad,
+                                      dpi)
+        self._pendientes.append(tarea)
+        return tarea
+
+    def esperar(self):
+        """ Espera los gráficos pendientes; devuelve los archivos escritos """
+        pendientes, self._pendientes = self._pendientes, list()
+        return [tarea.result() for tarea in pendientes]
+
+    def cerrar(self):
+        """ Espera los gráficos pendientes y termina los procesos """
+        try:
+            self.esperar()
+        finally:
+            self._ejecutor.shutdown(wait=True)
@@ -1,46 +1,106 @@
 # -*- coding: utf-8 -*-
 
 import time
-import visa
+import queue
+import threading
+import contextlib
 import numpy as np
-import matplotlib.pyplot as plt
+from simulador import SimuladorVISA
+import almacenamiento
+from registro import Registro
+
+# visa y matplotlib.pyplot se importan recién al conectar un instrumento o
+# al graficar: el modo simulador y la adquisición sin gráficos no los
+# necesitan (ni requieren PyVISA instalado)
 
 #https://tonysyu.github.io/raw_content/matplotlib-style-gallery/gallery.html
 #import matplotlib.style as pltstyle
 #pltstyle.use('seaborn-white')
 
-class SimuladorVISA:
+class PoolVISA(object):
     """
-    Clase auxiliar para simular la comunicación con un dispositivo PyVISA.
+    Sesiones VISA compartidas por todo el proceso.
+    
+    Reutiliza un único ResourceManager, guarda el resultado de la búsqueda
+    de dispositivos durante 'vidaBusqueda' segundos y entrega la misma
+    sesión abierta a todos los objetos que se conectan a un mismo recurso,
+    contando las referencias. La sesión se cierra cuando la libera el
+    último objeto que la utiliza.
     """
-    def __init__(self):
-        print('Simulador de dispositivo VISA')
-        print('Modo de respuesta automatica: 0')
-    
-    def query(self, cadena, separator=''):
-        #print('>> ' + cadena)
-        if separator == ',':
-            return '0,1'
-        else:
-            if cadena == '*STB? 1':
-                time.sleep(1)
-                return 1
-            elif cadena == 'SPTS?':
-                return 16900
-            else:
-                return '0'
+    def __init__(self, vidaBusqueda=30):
+        self.vidaBusqueda = vidaBusqueda
+        self._administrador = None
+        self._recursos = None
+        self._momentoBusqueda = 0
+        # recurso -> [sesión, identificación, referencias]
+        self._sesiones = dict()
+        self._candado = threading.RLock()
     
-    def query_ascii_values(self, cadena, **args):
-        #print(cadena)
-        return np.random.rand(1)[0] , np.random.rand(1)[0], 0, 0
-            
-    def query_binary_values(self, cadena, **args):
-        #print(cadena)
-        return np.random.rand(100)
+    def administrador(self):
+        """ Devuelve el ResourceManager del proceso (lo crea una vez) """
+        with self._candado:
+            if self._administrador is None:
+                import visa
+                self._administrador = visa.ResourceManager()
+            return self._administrador
     
-    def write(self, cadena):
-        #print(cadena)
-        pass
+    def buscar(self, prefijo='GPIB', forzar=False):
+        """
+        Lista los recursos que comienzan con el prefijo indicado. Repite la
+        búsqueda sólo si la anterior venció o si forzar=True.
+        """
+        with self._candado:
+            if (forzar or self._recursos is None or
+                time.time() - self._momentoBusqueda > self.vidaBusqueda):
+                self._recursos = list(self.administrador().list_resources())
+                self._momentoBusqueda = time.time()
+            return [r for r in self._recursos if r.startswith(prefijo)]
+    
+    def abrir(self, recurso):
+        """
+        Devuelve la sesión y la identificación (*IDN?) del recurso,
+        abriéndolo sólo si ningún otro objeto lo tiene abierto
+        """
+        with self._candado:
+            if recurso not in self._sesiones:
+                sesion = self.administrador().open_resource(recurso)
+                try:
+                    idn = sesion.query('*IDN?')
+                except BaseException:
+                    sesion.close()
+                    raise
+                self._sesiones[recurso] = [sesion, idn, 0]
+            entrada = self._sesiones[recurso]
+            entrada[2] += 1
+            return entrada[0], entrada[1]
+    
+    def liberar(self, recurso, antesDeCerrar=None):
+        """
+        Descuenta una referencia al recurso. Si era la última ejecuta
+        antesDeCerrar(sesion), cierra la sesión y devuelve True.
+        """
+        with self._candado:
+            entrada = self._sesiones.get(recurso)
+            if entrada is None:
+                return False
+            entrada[2] -= 1
+            if entrada[2] > 0:
+                return False
+            del self._sesiones[recurso]
+            try:
+                if antesDeCerrar is not None:
+                    antesDeCerrar(entrada[0])
+            finally:
+                entrada[0].close()
+            return True
+    
+    def referencias(self):
+        """ Diccionario recurso -> cantidad de objetos que lo utilizan """
+        with self._candado:
+            return {r: e[2] for r, e in self._sesiones.items()}
+
+# Sesiones compartidas por todos los instrumentos del proceso
+sesiones = PoolVISA()
 
 class Lockin(object):
     '''
@@ -52,9 +112,27 @@ class Lockin(object):
        Nombre del dispositivo a utilizar. En caso de utilizar un único
        dispositivo del tipo GPIB puede omitirse este parámetro (se buscará
        automáticamente la entrada correspondiente).
-    modo_simulador : Bool (opcional)
+    modo_simulador : Bool o SimuladorVISA (opcional)
         Permite simular la comunicación con el instrumento. Utiliza la clase
         SimuladorVisa para reemplazar los comandos query y write de PyVisa.
+        Puede pasarse un simulador ya configurado (dispositivo bajo prueba,
+        ruido, latencia, etc.).
+        
+    Caché de propiedades:
+    -----
+    
+        Las propiedades escritas desde la PC se leen de una copia local sin
+        consultar al instrumento. Las autofunciones y configCargar invalidan
+        los valores afectados; sincronizar() relee todo el estado. Con
+        politicaCache = 'Desactivada' cada lectura consulta al instrumento.
+        
+    Sesiones compartidas:
+    -----
+    
+        Los objetos creados para un mismo recurso comparten la sesión VISA
+        (ver PoolVISA), por lo que reconectar es inmediato. Cada objeto
+        mantiene su propia copia local: si varios escriben en el mismo
+        instrumento conviene llamar a sincronizar() antes de leer.
         
     Notas del modo simulador:
     -----
@@ -62,11 +140,18 @@ class Lockin(object):
         Algunas funciones pueden resultar afectadas estéticamente en el modo
         simulador dado que se visualizan los comandos enviados.
         
-        Otros pueden tener inconvenientes por las respuestas improvisadas
-        tales como consultarSimultaneo (falla si se pide un número distinto
-        a 4 parámetros). Ésto no ocurre al utilizar el instrumento.
+        Las respuestas provienen de un modelo del instrumento y de un
+        dispositivo bajo prueba (ver simulador.py) con ruido reproducible.
     '''
     
+    # Propiedades del instrumento (en el orden de listarPropiedades)
+    _nombresPropiedades = ('refModo', 'refAmpl', 'refFrec', 'refFase',
+                           'refHarm', 'refRslp', 'inpModo', 'inpGnd',
+                           'inpCoup', 'inpLine', 'inpSens', 'inpRmod',
+                           'inpOflt', 'inpOfsl', 'inpSync', 'ch1Modo',
+                           'ch2Modo', 'auxout1', 'auxout2', 'auxout3',
+                           'auxout4', 'stpLock')
+    
     #----------------------------------------------------------------------
     # Inicializador
     #----------------------------------------------------------------------
@@ -74,7 +159,10 @@ class Lockin(object):
     def __init__(self, resource='', modo_simulador=False):
         
         # Crea el objeto correspondiente según el modo elegido
-        if modo_simulador == True:
+        self._recurso = None
+        if isinstance(modo_simulador, SimuladorVISA):
+            self._lockin = modo_simulador
+        elif modo_simulador == True:
             self._lockin = SimuladorVISA()
         else:
             
@@ -82,13 +170,12 @@ class Lockin(object):
             
             # En caso de no recibir como parámetro la dirección del equipo
             if resource == '':
-                # Busca dispositivos GPIB conectados           
+                # Busca dispositivos GPIB conectados (la búsqueda se
+                # reutiliza durante sesiones.vidaBusqueda segundos)
                 print('Buscando dispositivos compatibles...')            
-                rm = visa.ResourceManager()
-                dispositivos = list(rm.list_resources())
-                for disp in dispositivos:
-                    if disp.startswith('GPIB'):
-                        resource = disp
+                dispositivos = sesiones.buscar('GPIB')
+                if len(dispositivos) > 0:
+                    resource = dispositivos[-1]
             
                 # Si la busqueda no tiene éxito genera una excepción
                 if resource == '':               
@@ -96,10 +183,12 @@ class Lockin(object):
         
             print('Conectando a ' + resource + '...')
         
-            # Establece la conexión y devuelve la identificación del equipo.
+            # Establece la conexión (o reutiliza la sesión ya abierta por
+            # otro objeto) y devuelve la identificación del equipo.
+            import visa
             try:
-                self._lockin = visa.ResourceManager().open_resource(resource)                
-                self._idn = self._lockin.query('*IDN?')
+                self._lockin, self._idn = sesiones.abrir(resource)
+                self._recurso = resource
             except visa.VisaIOError as error:
                 print('Conexión interrumpida')
                 raise Exception(error.description)
@@ -154,11 +243,39 @@ class Lockin(object):
         self._auxout3 = None
         self._auxout4 = None
         
+        # Caché de propiedades: los valores escritos por los setters se
+        # sirven localmente. politicaCache: 'Coherente' o 'Desactivada'
+        # (consulta siempre). vidaCache: segundos de validez (None = sin
+        # vencimiento). Las autofunciones invalidan lo que modifican.
+        self.politicaCache = 'Coherente'
+        self.vidaCache = None
+        self._validas = dict()
+        self._aciertos = 0
+        self._fallos = 0
+        
+        # Transacción de configuración en curso (ver transaccion): nombre
+        # de la propiedad -> comando pendiente
+        self._lote = None
+        self._anteriores = None
+        self._tamEntrada = 256
+        
+        # El bloqueo de teclas se configuró al conectar
+        self._stpLock = 'Local Lockout'
+        self._validas['stpLock'] = time.time()
+        
         
         # Valores permitidos y traducciones
         
         self._tamBuffer = 16383
         
+        self._strFrecMuestreo = ('62.5 mHz', '125 mHz', '250 mHz', 
+                                 '500 mHz', '1 Hz', '2 Hz', '4 Hz', '8 Hz',
+                                 '16 Hz', '32 Hz', '64 Hz', '128 Hz',
+                                 '256 Hz', '512 Hz')
+        self._floatFrecMuestreo = (0.0625, 0.125, 0.25, 0.5, 1.0, 
+                                   2.0, 4.0, 8.0, 16.0, 32.0,
+                                   64.0, 128.0, 256.0, 512.0)
+        
         self._crefModo = ('External', 'Internal')
         self._crefRslp = ('Sine', 'TTL Rising', 'TTL Falling')
         
@@ -169,6 +286,7 @@ class Lockin(object):
         
         self._cinpRmod = ('High Reserve', 'Normal', 'Low Noise')
         self._cinpOfsl = ('6dB/oct', '12dB/oct', '18dB/oct', '24dB/oct')
+        self._constantesAsentamiento = (5, 7, 9, 10)
         self._cinpSync = ('Off', 'On')
         
         self._cch1Modo = ('X', 'R', 'Xn', 'Aux1', 'Aux2')
@@ -230,131 +348,289 @@ class Lockin(object):
 
         self._frecBarrido = None
         self._datosBarrido = None   
+        self._parametrosBarrido = None
 
-        self._figuras = list()
-        self._datos = list()                   
+        # Resultados de la sesión (mediciones y figuras) con presupuesto
+        # de memoria, ver registro.py
+        self.registro = Registro()
     
     #----------------------------------------------------------------------
     # Destructor del objeto
     #----------------------------------------------------------------------
         
     def __del__(self):
-        # Destructor del objeto
-        if isinstance(self._lockin, visa.Resource):
-            self._lockin.write('LOCL0') #Desbloquea el Lockin
-            self._lockin.close()
-            print('Conexión interrumpida')
+        # Destructor del objeto: sólo el último objeto que utiliza la
+        # sesión desbloquea el Lockin y cierra la conexión
+        recurso = getattr(self, '_recurso', None)
+        if recurso is not None:
+            self._recurso = None
+            if sesiones.liberar(recurso, lambda s: s.write('LOCL0')):
+                print('Conexión interrumpida')
+    
+    #----------------------------------------------------------------------
+    # Copia local del estado del instrumento (caché de propiedades)
+    #----------------------------------------------------------------------
+    
+    def _cacheValida(self, nombre):
+        """ Indica si el valor guardado de la propiedad puede utilizarse """
+        if self.politicaCache == 'Desactivada':
+            return False
+        if nombre not in self._validas:
+            return False
+        if (self.vidaCache is not None and 
+            time.time() - self._validas[nombre] > self.vidaCache):
+            return False
+        # Sin bloqueo de teclas el panel frontal puede modificar todo
+        if self._stpLock == 'Local':
+            return False
+        # Con referencia externa la frecuencia la impone la señal
+        if nombre == 'refFrec' and self._refModo != 'Internal':
+            return False
+        return True
+    
+    def _leerPropiedad(self, nombre, consulta):
+        """
+        Devuelve el valor guardado de la propiedad o, si no es válido
+        según la política de la caché, lo consulta al instrumento
+        """
+        if self._cacheValida(nombre):
+            self._aciertos += 1
+            return getattr(self, '_' + nombre)
+        self._fallos += 1
+        valor = consulta()
+        setattr(self, '_' + nombre, valor)
+        self._validas[nombre] = time.time()
+        return valor
+    
+    def _escribir(self, nombre, comando, valor):
+        """
+        Envía el comando de una propiedad y actualiza la copia local. Dentro
+        de una transacción el comando queda pendiente hasta el final.
+        """
+        if self._lote is not None:
+            if nombre not in self._anteriores:
+                self._anteriores[nombre] = (getattr(self, '_' + nombre),
+                                            self._validas.get(nombre))
+            self._lote.pop(nombre, None)
+            self._lote[nombre] = comando
+        else:
+            self._lockin.write(comando)
+        setattr(self, '_' + nombre, valor)
+        self._validas[nombre] = time.time()
+    
+    def _agruparComandos(self, comandos):
+        """
+        Une los comandos con ';' en la menor cantidad de cadenas que
+        entran en el buffer de entrada del instrumento
+        """
+        cadenas = list()
+        actual = ''
+        for comando in comandos:
+            if actual and len(actual) + 1 + len(comando) > self._tamEntrada:
+                cadenas.append(actual)
+                actual = ''
+            actual = comando if not actual else actual + ';' + comando
+        if actual:
+            cadenas.append(actual)
+        return cadenas
+    
+    @contextlib.contextmanager
+    def transaccion(self, verificar=False):
+        """
+        Agrupa las escrituras de propiedades realizadas dentro del bloque
+        'with'. Cada valor se valida al asignarlo pero los comandos se
+        envían al final unidos con ';' (una escritura por cada 256
+        caracteres). Si ocurre un error antes del envío no se envía nada y
+        la copia local vuelve a su estado anterior. Con verificar=True se
+        consulta una única vez el registro de estado (*ESR?) al finalizar.
+        
+            with loc1.transaccion():
+                loc1.refFrec = 1000
+                loc1.refAmpl = 1
+        """
+        if self._lote is not None:
+            # Transacción anidada: se suma a la exterior
+            yield self
+            return
+        
+        self._lote = dict()
+        self._anteriores = dict()
+        try:
+            yield self
+            for cadena in self._agruparComandos(self._lote.values()):
+                self._lockin.write(cadena)
+        except BaseException:
+            for nombre, (valor, validez) in self._anteriores.items():
+                setattr(self, '_' + nombre, valor)
+                if validez is None:
+                    self._validas.pop(nombre, None)
+                else:
+                    self._validas[nombre] = validez
+            raise
+        finally:
+            nombres = list(self._lote)
+            self._lote = None
+            self._anteriores = None
+        
+        if verificar and len(nombres) > 0:
+            # Bits 4 y 5: error de ejecución (parámetro fuera de rango) y
+            # comando no reconocido
+            esr = int(self._lockin.query('*ESR?'))
+            if esr & 0b110000:
+                self.invalidar(*nombres)
+                raise ValueError('El instrumento rechazó la configuración '
+                                 '(*ESR? = {0})'.format(esr))
+    
+    def configurar(self, verificar=False, **propiedades):
+        """
+        Configura varias propiedades en una única transacción. Por ejemplo:
+            
+            loc1.configurar(refFrec=1000, refAmpl=1, inpOflt='100 ms')
+            
+        Ver transaccion.
+        """
+        for nombre in propiedades:
+            if nombre not in self._nombresPropiedades:
+                raise ValueError(self._nombresPropiedades)
+        with self.transaccion(verificar):
+            for nombre, valor in propiedades.items():
+                setattr(self, nombre, valor)
+    
+    def invalidar(self, *propiedades):
+        """
+        Descarta los valores guardados de las propiedades indicadas (o de
+        todas) de modo que la próxima lectura consulte al instrumento
+        """
+        if len(propiedades) == 0:
+            self._validas.clear()
+        for nombre in propiedades:
+            self._validas.pop(nombre, None)
+    
+    def sincronizar(self):
+        """
+        Vuelve a leer todas las propiedades desde el instrumento y
+        devuelve un diccionario con sus valores
+        """
+        self.invalidar()
+        return self.estadoPropiedades()
+    
+    def estadoPropiedades(self, consultar=True):
+        """
+        Diccionario con el valor de todas las propiedades (servidas desde
+        la copia local cuando es válida). Con consultar=False devuelve la
+        copia local sin comunicarse con el instrumento (None si no se
+        conoce el valor).
+        """
+        if not consultar:
+            return {nombre: getattr(self, '_' + nombre)
+                    for nombre in self._nombresPropiedades}
+        return {nombre: getattr(self, nombre) 
+                for nombre in self._nombresPropiedades}
+    
+    def estadisticasCache(self):
+        """ Lecturas servidas localmente (aciertos) y consultadas (fallos) """
+        return {'aciertos': self._aciertos, 'fallos': self._fallos}
     
     #----------------------------------------------------------------------
     # Métodos para escritura y lectura de propiedades
     #----------------------------------------------------------------------
        
     def _get_refFase(self):
-        self._refFase = float(self._lockin.query('PHAS?'))
-        return self._refFase
+        return self._leerPropiedad('refFase', lambda:
+            float(self._lockin.query('PHAS?')))
     def _set_refFase(self, fase):
         if not (-360.00 <= fase <= 729.99):
             raise ValueError('-360.00 <= fase <= 729.99')
-        self._lockin.write('PHAS{0:f}'.format(fase))
-        self._refFase = fase
+        self._escribir('refFase', 'PHAS{0:f}'.format(fase), fase)
     
     def _get_refModo(self):
-        self._refModo = self._crefModo[int(self._lockin.query('FMOD?'))]
-        return self._refModo
+        return self._leerPropiedad('refModo', lambda:
+            self._crefModo[int(self._lockin.query('FMOD?'))])
     def _set_refModo(self, modo):
         try:
             i = self._crefModo.index(modo)
         except ValueError:
             raise ValueError(self._crefModo)
-        self._lockin.write('FMOD{0}'.format(i))
-        self._refModo = modo
+        self._escribir('refModo', 'FMOD{0}'.format(i), modo)
         
     def _get_refFrec(self):
-        self._refFrec = float(self._lockin.query('FREQ?'))
-        return self._refFrec
+        return self._leerPropiedad('refFrec', lambda:
+            float(self._lockin.query('FREQ?')))
     def _set_refFrec(self, frec):
         if not (0.001 <= frec <= 102000):
             raise ValueError('0.001 <= frec <= 102000')
-        self._lockin.write('FREQ{0:f}'.format(frec))
-        self._refFrec = frec
+        self._escribir('refFrec', 'FREQ{0:f}'.format(frec), frec)
     
     def _get_refAmpl(self):
-        self._refAmpl = float(self._lockin.query('SLVL?'))
-        return self._refAmpl
+        return self._leerPropiedad('refAmpl', lambda:
+            float(self._lockin.query('SLVL?')))
     def _set_refAmpl(self, ampl):
         if not (0.004 <= ampl <= 5.000):
             raise ValueError('0.004 <= ampl <= 5.000')
-        self._lockin.write('SLVL{0:f}'.format(ampl))
-        self._refAmpl = ampl   
+        self._escribir('refAmpl', 'SLVL{0:f}'.format(ampl), ampl)
     
     def _get_refHarm(self):
-        self._refHarm = int(self._lockin.query('HARM?'))
-        return self._refHarm
+        return self._leerPropiedad('refHarm', lambda:
+            int(self._lockin.query('HARM?')))
     def _set_refHarm(self, num):
         if not (isinstance(num, int) and 1 <= num <= 19999 and
                 num * self._refFrec <= 102000):
             raise ValueError('1 <= num <= 19999, num * f <= 102000Hz')
-        self._lockin.write('HARM{0}'.format(num))
-        self._refHarm = num 
+        self._escribir('refHarm', 'HARM{0}'.format(num), num)
         
     def _get_refRslp(self):
-        self._refRslp = self._crefRslp[int(self._lockin.query('RSLP?'))]
-        return self._refRslp
+        return self._leerPropiedad('refRslp', lambda:
+            self._crefRslp[int(self._lockin.query('RSLP?'))])
     def _set_refRslp(self, modo):
         try:
             i = self._crefRslp.index(modo)
         except ValueError:
             raise ValueError(self._crefRslp)
-        self._lockin.write('RSLP{0}'.format(i))
-        self._refRslp = modo
+        self._escribir('refRslp', 'RSLP{0}'.format(i), modo)
    
     def _get_inpModo(self):
-        self._inpModo = self._cinpModo[int(self._lockin.query('ISRC?'))]
-        return self._inpModo
+        return self._leerPropiedad('inpModo', lambda:
+            self._cinpModo[int(self._lockin.query('ISRC?'))])
     def _set_inpModo(self, modo):
         try:
             i = self._cinpModo.index(modo)
         except ValueError:
             raise ValueError(self._cinpModo)
-        self._lockin.write('ISRC{0}'.format(i))
-        self._inpModo = modo
+        self._escribir('inpModo', 'ISRC{0}'.format(i), modo)
        
     def _get_inpGnd(self):
-        self._inpGnd = self._cinpGnd[int(self._lockin.query('IGND?'))]
-        return self._inpGnd
+        return self._leerPropiedad('inpGnd', lambda:
+            self._cinpGnd[int(self._lockin.query('IGND?'))])
     def _set_inpGnd(self, modo):
         try:
             i = self._cinpGnd.index(modo)
         except ValueError:
             raise ValueError(self._cinpGnd)
-        self._lockin.write('IGND{0}'.format(i))
-        self._inpGnd = modo
+        self._escribir('inpGnd', 'IGND{0}'.format(i), modo)
        
     def _get_inpCoup(self):
-        self._inpCoup = self._cinpCoup[int(self._lockin.query('ICPL?'))]
-        return self._inpCoup
+        return self._leerPropiedad('inpCoup', lambda:
+            self._cinpCoup[int(self._lockin.query('ICPL?'))])
     def _set_inpCoup(self, modo):
         try:
             i = self._cinpCoup.index(modo)   
         except ValueError:    
             raise ValueError(self._cinpCoup)
-        self._lockin.write('ICPL{0}'.format(i))
-        self._inpCoup = modo
+        self._escribir('inpCoup', 'ICPL{0}'.format(i), modo)
         
     def _get_inpLine(self):
-        self._inpLine = self._cinpLine[int(self._lockin.query('ILIN?'))]
-        return self._inpLine
+        return self._leerPropiedad('inpLine', lambda:
+            self._cinpLine[int(self._lockin.query('ILIN?'))])
     def _set_inpLine(self, modo):
         try:
             i = self._cinpLine.index(modo)    
         except ValueError: 
             raise ValueError(self._cinpLine)
-        self._lockin.write('ILIN{0}'.format(i))
-        self._inpLine = modo
+        self._escribir('inpLine', 'ILIN{0}'.format(i), modo)
      
     def _get_inpSens(self):
-        self._inpSens = int(self._lockin.query('SENS?'))
-        return self._inpSens
+        return self._leerPropiedad('inpSens', lambda:
+            int(self._lockin.query('SENS?')))
     def _set_inpSens(self, valor):
         if isinstance(valor,str):
             try:
@@ -371,23 +647,21 @@ class Lockin(object):
                 i = self._floatinpSens.index(valor)
             except ValueError:
                 raise ValueError(self._floatinpSens)
-        self._lockin.write('SENS{0}'.format(i))
-        self._inpSens = i
+        self._escribir('inpSens', 'SENS{0}'.format(i), i)
         
     def _get_inpRmod(self):
-        self._inpRmod = self._cinpRmod[int(self._lockin.query('RMOD?'))]
-        return self._inpRmod
+        return self._leerPropiedad('inpRmod', lambda:
+            self._cinpRmod[int(self._lockin.query('RMOD?'))])
     def _set_inpRmod(self, modo):
         try:
             i = self._cinpRmod.index(modo)
         except ValueError:
             raise ValueError(self._cinpRmod)
-        self._lockin.write('RMOD{0}'.format(i))
-        self._inpRmod = modo
+        self._escribir('inpRmod', 'RMOD{0}'.format(i), modo)
         
     def _get_inpOflt(self):
-        self._inpOflt = int(self._lockin.query('OFLT?'))
-        return self._inpOflt
+        return self._leerPropiedad('inpOflt', lambda:
+            int(self._lockin.query('OFLT?')))
     def _set_inpOflt(self, valor):
         if isinstance(valor,str):
             try:
@@ -404,101 +678,91 @@ class Lockin(object):
                 i = self._floatinpOflt.index(valor)
             except ValueError:
                 raise ValueError(self._floatinpOflt)
-        self._lockin.write('OFLT{0}'.format(i))
-        self._inpOflt = i
+        self._escribir('inpOflt', 'OFLT{0}'.format(i), i)
         
     def _get_inpOfsl(self):
-        self._inpOfsl = self._cinpOfsl[int(self._lockin.query('OFSL?'))]
-        return self._inpOfsl
+        return self._leerPropiedad('inpOfsl', lambda:
+            self._cinpOfsl[int(self._lockin.query('OFSL?'))])
     def _set_inpOfsl(self, modo):
         try:
             i = self._cinpOfsl.index(modo)
         except ValueError:
             raise ValueError(self._cinpOfsl)
-        self._lockin.write('OFSL{0}'.format(i))
-        self._inpOfsl = modo
+        self._escribir('inpOfsl', 'OFSL{0}'.format(i), modo)
         
     def _get_inpSync(self):
-        self._inpSync = self._cinpSync[int(self._lockin.query('SYNC?'))]
-        return self._inpSync
+        return self._leerPropiedad('inpSync', lambda:
+            self._cinpSync[int(self._lockin.query('SYNC?'))])
     def _set_inpSync(self, modo):
         try:
             i = self._cinpSync.index(modo)
         except ValueError:
             raise ValueError(self._cinpSync)
-        self._lockin.write('SYNC{0}'.format(i))
-        self._inpSync = modo
+        self._escribir('inpSync', 'SYNC{0}'.format(i), modo)
       
     def _get_stpLock(self):
-        self._stpLock = self._cstpLock[int(self._lockin.query('LOCL?'))]
-        return self._stpLock
+        return self._leerPropiedad('stpLock', lambda:
+            self._cstpLock[int(self._lockin.query('LOCL?'))])
     def _set_stpLock(self, modo):
         try:
             i = self._cstpLock.index(modo)    
         except ValueError:
             raise ValueError('Local(0), Remote(1), Local Lockout(2)')
-        self._lockin.write('LOCL{0}'.format(i))
-        self._stpLock = modo
+        self._escribir('stpLock', 'LOCL{0}'.format(i), modo)
        
     def _get_ch1Modo(self):
-        self._ch1Modo, = self._cch1Modo[int(self._lockin.query_ascii_values(
-                                            'DDEF? 1', separator=",")[0])]
-        return self._ch1Modo
+        return self._leerPropiedad('ch1Modo', lambda:
+            self._cch1Modo[int(self._lockin.query_ascii_values(
+                                        'DDEF? 1', separator=",")[0])])
     def _set_ch1Modo(self, modo):
         try:
             i = self._cch1Modo.index(modo)
         except ValueError:
             raise ValueError(self._cch1Modo)
-        self._lockin.write('DDEF1,{0},0'.format(i))
-        self._ch1Modo = modo
+        self._escribir('ch1Modo', 'DDEF1,{0},0'.format(i), modo)
         
     def _get_ch2Modo(self):
-        self._ch2Modo, = self._cch2Modo[int(self._lockin.query_ascii_values(
-                                            'DDEF? 2', separator=",")[0])]
-        return self._ch2Modo
+        return self._leerPropiedad('ch2Modo', lambda:
+            self._cch2Modo[int(self._lockin.query_ascii_values(
+                                        'DDEF? 2', separator=",")[0])])
     def _set_ch2Modo(self, modo):
         try:
             i = self._cch2Modo.index(modo)
         except ValueError:
             raise ValueError(self._cch2Modo)
-        self._lockin.write('DDEF2,{0},0'.format(i))
-        self._ch2Modo = modo
+        self._escribir('ch2Modo', 'DDEF2,{0},0'.format(i), modo)
         
     def _get_auxout1(self):
-        self._auxout1 = float(self._lockin.query('AUXV?1'))
-        return self._auxout1
+        return self._leerPropiedad('auxout1', lambda:
+            float(self._lockin.query('AUXV?1')))
     def _set_auxout1(self, ampl):
         if not (-10.500 <= ampl <= 10.500):
             raise ValueError('-10.500 <= ampl <= 10.500')
-        self._lockin.write('AUXV1,{0:f}'.format(ampl))
-        self._auxout1 = ampl
+        self._escribir('auxout1', 'AUXV1,{0:f}'.format(ampl), ampl)
         
     def _get_auxout2(self):
-        self._auxout2 = float(self._lockin.query('AUXV?2'))
-        return self._auxout2
+        return self._leerPropiedad('auxout2', lambda:
+            float(self._lockin.query('AUXV?2')))
     def _set_auxout2(self, ampl):
         if not (-10.500 <= ampl <= 10.500):
             raise ValueError('-10.500 <= ampl <= 10.500')
-        self._lockin.write('AUXV2,{0:f}'.format(ampl))
-        self._auxout2 = ampl
+        self._escribir('auxout2', 'AUXV2,{0:f}'.format(ampl), ampl)
         
     def _get_auxout3(self):
-        self._auxout3 = float(self._lockin.query('AUXV?3'))
-        return self._auxout3
+        return self._leerPropiedad('auxout3', lambda:
+            float(self._lockin.query('AUXV?3')))
     def _set_auxout3(self, ampl):
         if not (-10.500 <= ampl <= 10.500):
             raise ValueError('-10.500 <= ampl <= 10.500')
-        self._lockin.write('AUXV3,{0:f}'.format(ampl))
-        self._auxout3 = ampl
+        self._escribir('auxout3', 'AUXV3,{0:f}'.format(ampl), ampl)
         
     def _get_auxout4(self):
-        self._auxout4 = float(self._lockin.query('AUXV?4'))
-        return self._auxout4
+        return self._leerPropiedad('auxout4', lambda:
+            float(self._lockin.query('AUXV?4')))
     def _set_auxout4(self, ampl):
         if not (-10.500 <= ampl <= 10.500):
             raise ValueError('-10.500 <= ampl <= 10.500')
-        self._lockin.write('AUXV4,{0:f}'.format(ampl))
-        self._auxout4 = ampl
+        self._escribir('auxout4', 'AUXV4,{0:f}'.format(ampl), ampl)
     
     
     
@@ -537,25 +801,44 @@ class Lockin(object):
     # Autofunciones (ganancia, reserva, fase y offset)
     #----------------------------------------------------------------------
     
+    def _finalizado(self):
+        """ Indica si el instrumento terminó de ejecutar los comandos """
+        # Bit 1 del byte de estado: ningún comando en ejecución
+        return bool(int(self._lockin.query('*STB?1')))
+    
+    def _esperarFinalizacion(self, espera=0.01, maxima=0.5, limite=60):
+        """
+        Espera a que termine una autofunción consultando el byte de estado
+        con intervalos crecientes (de 'espera' a 'maxima' segundos) en
+        lugar de consultar sin pausa. Falla tras 'limite' segundos.
+        """
+        inicio = time.time()
+        while not self._finalizado():
+            if time.time() - inicio > limite:
+                raise TimeoutError('El instrumento no finalizó')
+            time.sleep(espera)
+            espera = min(2 * espera, maxima)
+    
     def autoGanacia(self):
         """ Ejecuta la funcion AutoGanancia del Lockin """
         self._lockin.write('AGAN')
+        self.invalidar('inpSens')
         print('Ejecutando autoGanancia... ', end='')
-        while not bool(self._lockin.query('*STB?1')):
-            pass
+        self._esperarFinalizacion()
         print('Finalizado')
       
     def autoReserva(self):
         """ Ejecuta la funcion AutoReserva del Lockin """        
         self._lockin.write('ARSV') 
+        self.invalidar('inpRmod')
         print('Ejecutando autoReserva... ', end='')
-        while not bool(self._lockin.query('*STB?1')):
-            pass
+        self._esperarFinalizacion()
         print('Finalizado')
        
     def autoFase(self):
         """ Ejecuta la funcion AutoFase del Lockin """
         self._lockin.write('APHS')
+        self.invalidar('refFase')
         print('Ejecutando autoFase... ', end='')
         time.sleep(2)
         print('Finalizado')
@@ -592,6 +875,7 @@ class Lockin(object):
         if not (isinstance(ranura, int) and  1 <= ranura <= 9):
             raise ValueError('Ranuras válidas del 1 al 9')   
         self._lockin.write('RSET{0}'.format(ranura))
+        self.invalidar()
         print('Configuración recuperada de la ranura ' + str(ranura))
         
     #----------------------------------------------------------------------
@@ -721,135 +1005,474 @@ class Lockin(object):
             raise ValueError('Auxiliares: 1 a 4')
         return float(self._lockin.query('OAUX?{0}'.format(aux)))
     
-#    def leerBuffer(self, display=1, frecMuestreo='64 Hz', puntos = 16383,
-#                   graficar=True, archivoDatos=''):
-#        """
-#        Vacia el buffer, adquiere la cantidad de muestras indicadas a la
-#        frecuencia seleccionada y finalmente transmite el contenido.
-#        
-#        Parámetros:
-#        ----------
-#        display : int
-#            Display de origen de datos: 1 o 2.
-#        frecMuestreo : int, float, str
-#            Selecciona la frecuencia de muestreo. Dado que los valores son
-#            una lista fija, puede ingresarse el índice que figura en el
-#            manual, el valor como numero flotante o la cadena de texto que
-#            se corresponde.
-#        puntos : int
-#            Número de muestras. Máximo en self._tamBuffer (16383 por manual).
-#        graficar : bool
-#            Indica si al finalizar se obtiene un gráfico de vista previa.
-#        archivoDatos : str
-#            Nombre del archivo para el volcado de datos.
-#        """
-#
-#        strFrecs = ('62.5 mHz', '125 mHz', '250 mHz', '500 mHz', '1 Hz', 
-#                    '2 Hz', '4 Hz', '8 Hz', '16 Hz', '32 Hz', 
-#                    '64 Hz', '128 Hz', '256 Hz', '512 Hz')
-#        floatFrecs = (0.0625, 0.125, 0.25, 0.5, 1.0, 
-#                      2.0, 4.0, 8.0, 16.0, 32.0,
-#                      64.0, 128.0, 256.0, 512.0)
-#                
-#        if not (display==1 or display==2):
-#            raise ValueError('display = 1 ó display = 2')
-#        
-#        if isinstance(frecMuestreo,str):
-#            try:
-#                i = strFrecs.index(frecMuestreo)    
-#            except ValueError:
-#                raise ValueError(strFrecs)    
-#        elif isinstance(frecMuestreo, int):
-#            if 0 <= frecMuestreo <= 14:
-#                i = frecMuestreo    
-#            else:
-#                raise ValueError('0 <= frecMuestreo <= 14, valor entero')        
-#        elif isinstance(frecMuestreo, float):
-#            try:
-#                i = floatFrecs.index(frecMuestreo)
-#            except ValueError:
-#                raise ValueError(floatFrecs)   
-#        
-#        self._lockin.write('SRAT{0}'.format(i))
-#        
-#        if not (1 <= puntos <= 16383 and isinstance(puntos, int)):
-#            raise ValueError('1 <= puntos <= 16383, valor entero')
-#            
-#        orden = 'TRCB?' + str(display) + ',0,' + str(puntos)
-#        
-#        modoBuffer = int(self._lockin.query('SEND?'))
-#        
-#        self._lockin.write('SEND0')
-#        self._lockin.write('REST')
-#        print('Eliminando datos en buffer...', end='')
-#        time.sleep(0.5)
-#        print('Hecho.')
-#        print('Iniciando volcado de datos en buffer')
-#        self._lockin.write('STRT')
-#        duracion = puntos / floatFrecs[i] 
-#        if duracion > 3:
-#            print('Duración estimada: ' + str(duracion) + 's')
-#            for paso in self._barraProgreso(50):
-#                time.sleep(duracion / 50)
-#        print('\nVerificando estado del buffer...', end='')
-#        while int(self._lockin.query('SPTS?')) < puntos:
-#            time.sleep(0.1)
-#        print('Completo. \nTransmitiendo datos a la PC...', end='')
-#        
-#        self._ejeDatos = self._lockin.query_binary_values(orden, datatype='f', 
-#                                                 container=np.array)
-#        self._ejeTiempo = np.linspace(0,duracion,puntos)
-#        print('Lectura finalizada.')
-#        
-#        self._lockin.write('PAUS')
-#        self._lockin.write('SEND{0}'.format(modoBuffer))       
-#        
-#        texto_ejeX = 'Tiempo (s)'
-#        if display == 1:
-#            texto_ejeY = self.ch1Modo + ' (Vrms)'
-#        else:
-#            if self.ch2Modo == 'T':
-#                texto_ejeY = 'Fase (º)'
-#            else:
-#                texto_ejeY = self.ch1Modo + ' (Vrms)'
-#        
-#        if graficar == True:
-#            titulo = 'Display - Canal ' + str(display)
-#            figura = plt.figure()
-#            figura.canvas.set_window_title(titulo)
-#            self._figuras.append(figura)
-#            ejes = figura.add_subplot(111)
-#            ejes.set_title(titulo)
-#            ejes.set_xlabel(texto_ejeX)
-#            ejes.set_ylabel(texto_ejeY)
-#            ejes.plot(self._ejeTiempo, self._ejeDatos)
-#            ejes.legend(self.ch1Modo, loc='best', frameon=True,
-#                            shadow=True, fancybox=True)
-#            
-#        if isinstance(archivoDatos, str) and len(archivoDatos) > 0:
-#            datos = np.array([self._ejeTiempo, self._ejeDatos])
-#            datos = datos.transpose()
-#            np.savetxt(archivoDatos, datos, delimiter=',',newline='\r\n',
-#                       header= texto_ejeX + ',' + texto_ejeY)
-#        
-#        self._datos.append([self._ejeTiempo, self._ejeDatos])      
-#        
-#        if graficar == False:
-#            return self._ejeTiempo, self._ejeDatos
-#        else:
-#            return self._ejeTiempo, self._ejeDatos, figura
-    
-    def leerDirectoXY(self):
-        """ Lectura directa utilizando el comando Fast Data Transfer """
-        pass
+    def leerBuffer(self, canal=1, frecMuestreo='64 Hz', puntos=16383,
+                   graficar=True, archivoDatos='', continuo=False,
+                   puntosBloque=1024):
+        """
+        Vacia el buffer, adquiere la cantidad de muestras indicadas a la
+        frecuencia seleccionada y transmite el contenido.
+        
+        La transmisión se realiza por bloques (TRCB?) a medida que el
+        buffer se llena (según SPTS?), de modo que la descarga se
+        superpone con la adquisición. Los datos se escriben en un array
+        preasignado.
+        
+        Parámetros:
+        ----------
+        canal : int, tuple
+            Display de origen de datos: 1, 2 o (1, 2) para ambos en la
+            misma lectura.
+        frecMuestreo : int, float, str
+            Selecciona la frecuencia de muestreo. Dado que los valores son
+            una lista fija, puede ingresarse el índice que figura en el
+            manual, el valor como numero flotante o la cadena de texto que
+            se corresponde.
+        puntos : int
+            Número de muestras. Máximo en self._tamBuffer (16383 por
+            manual) salvo en modo continuo.
+        graficar : bool
+            Indica si al finalizar se obtiene un gráfico de vista previa.
+        archivoDatos : str
+            Nombre del archivo para el volcado de datos.
+        continuo : bool
+            Permite superar el tamaño del buffer: al llenarse se descarga
+            el resto y se rearma (REST, STRT). Cada rearme introduce una
+            pausa breve que queda registrada en el eje de tiempo.
+        puntosBloque : int
+            Cantidad mínima de puntos nuevos para solicitar una descarga.
+        """
+        
+        canales = (canal,) if isinstance(canal, int) else tuple(canal)
+        if not (1 <= len(canales) <= 2 and set(canales) <= {1, 2}):
+            raise ValueError('canal = 1, canal = 2 ó canal = (1, 2)')
+        
+        i = self._indiceFrecMuestreo(frecMuestreo)
+        frec = self._floatFrecMuestreo[i]
+        
+        maximo = None if continuo else self._tamBuffer
+        if not (isinstance(puntos, int) and 1 <= puntos and
+                (maximo is None or puntos <= maximo)):
+            raise ValueError('1 <= puntos <= ' + str(maximo) + 
+                             ', valor entero')
+        
+        self._lockin.write('SRAT{0}'.format(i))
+        
+        modoBuffer = int(self._lockin.query('SEND?'))
+        
+        # Datos preasignados (una fila por canal) y eje de tiempo
+        datos = np.empty((len(canales), puntos))
+        tiempo = np.empty(puntos)
+        
+        self._lockin.write('SEND0')
+        self._lockin.write('REST')
+        print('Eliminando datos en buffer...', end='')
+        time.sleep(0.5)
+        print('Hecho.')
+        print('Iniciando volcado de datos en buffer')
+        duracion = puntos / frec
+        if duracion > 3:
+            print('Duración estimada: ' + str(duracion) + 's')
+        
+        leidos = 0
+        while leidos < puntos:
+            
+            # Segmento del buffer (uno solo salvo en modo continuo)
+            segmento = min(puntos - leidos, self._tamBuffer)
+            self._lockin.write('STRT')
+            inicio = time.time()
+            if leidos == 0:
+                origen = inicio
+            tiempo[leidos:leidos + segmento] = (inicio - origen + 
+                                                np.arange(segmento) / frec)
+            
+            enBuffer = 0
+            while enBuffer < segmento:
+                disponibles = min(int(self._lockin.query('SPTS?')), segmento)
+                nuevos = disponibles - enBuffer
+                if nuevos < min(puntosBloque, segmento - enBuffer):
+                    # Espera aproximadamente lo que falta para un bloque
+                    faltan = min(puntosBloque, segmento - enBuffer) - nuevos
+                    time.sleep(min(max(faltan / frec, 0.01), 1))
+                    continue
+                
+                # Descarga los puntos nuevos de todos los canales
+                destino = leidos + enBuffer
+                for k, c in enumerate(canales):
+                    orden = 'TRCB?{0},{1},{2}'.format(c, enBuffer, nuevos)
+                    datos[k, destino:destino + nuevos] = \
+                        self._lockin.query_binary_values(orden, datatype='f',
+                                                         container=np.array)
+                enBuffer = disponibles
+                print('\r' + str(leidos + enBuffer) + ' / ' + str(puntos),
+                      end='')
+            
+            self._lockin.write('PAUS')
+            leidos += segmento
+            if leidos < puntos:
+                self._lockin.write('REST')
+        
+        print('\nLectura finalizada.')
+        self._lockin.write('SEND{0}'.format(modoBuffer))
+        
+        self._ejeTiempo = tiempo
+        self._ejeDatos = datos[0] if isinstance(canal, int) else datos
+        
+        texto_ejeX = 'Tiempo (s)'
+        modos = {1: self.ch1Modo, 2: self.ch2Modo}
+        textos_ejeY = list()
+        for c in canales:
+            if modos[c] == 'T':
+                textos_ejeY.append('Fase (º)')
+            else:
+                textos_ejeY.append(modos[c] + ' (Vrms)')
+        
+        if graficar == True:
+            import graficos
+            titulo = 'Display - Canal ' + ', '.join(str(c) for c in canales)
+            figura = graficos.ventana(titulo)
+            self.registro.agregarFigura(figura)
+            ejes = figura.add_subplot(111)
+            ejes.set_title(titulo)
+            ejes.set_xlabel(texto_ejeX)
+            ejes.set_ylabel(', '.join(textos_ejeY))
+            for k, c in enumerate(canales):
+                ejes.plot(self._ejeTiempo, datos[k])
+            ejes.legend([modos[c] for c in canales], loc='best', 
+                        frameon=True, shadow=True, fancybox=True)
+            
+        if isinstance(archivoDatos, str) and len(archivoDatos) > 0:
+            self._guardarColumnas(archivoDatos, 
+                                  ['Tiempo'] + [modos[c] for c in canales],
+                                  [self._ejeTiempo] + list(datos))
+        
+        nombres = [modos[c] for c in canales]
+        self.registro.agregar('Buffer', nombres, 
+                              [('Tiempo', self._ejeTiempo)] + 
+                              list(zip(nombres, datos)),
+                              self.estadoPropiedades(consultar=False))
+        
+        if graficar == False:
+            return self._ejeTiempo, self._ejeDatos
+        else:
+            return self._ejeTiempo, self._ejeDatos, figura
     
-    def barrerFrecuencia(self, inicio, fin, pasos, 
-                         graficar, *parametros):
+    def _indiceFrecMuestreo(self, frecMuestreo):
+        """ Índice SRAT de la frecuencia de muestreo (str, int o float) """
+        if isinstance(frecMuestreo,str):
+            try:
+                return self._strFrecMuestreo.index(frecMuestreo)    
+            except ValueError:
+                raise ValueError(self._strFrecMuestreo)    
+        elif isinstance(frecMuestreo, int):
+            if 0 <= frecMuestreo <= 13:
+                return frecMuestreo    
+            else:
+                raise ValueError('0 <= frecMuestreo <= 13, valor entero')        
+        elif isinstance(frecMuestreo, float):
+            try:
+                return self._floatFrecMuestreo.index(frecMuestreo)
+            except ValueError:
+                raise ValueError(self._floatFrecMuestreo)
+        raise ValueError(self._strFrecMuestreo)
+    
+    def leerDirectoXY(self, frecMuestreo='512 Hz', puntosBloque=256,
+                      puntos=None, bloquesCola=8):
+        """
+        Lectura directa de X e Y utilizando el comando Fast Data Transfer
+        
+        Generador: configura los displays en X e Y, activa el modo FAST2,
+        inicia el almacenamiento (STRD) y entrega bloques de puntosBloque
+        pares X, Y en Vrms (enteros de 16 bits escalados por la
+        sensibilidad actual) como arrays de forma (puntosBloque, 2).
+        
+        Un hilo lee el flujo binario sobre un conjunto fijo de arrays
+        preasignados. Si el consumidor no los devuelve a tiempo el hilo
+        espera (contrapresión), por lo que un consumidor lento puede
+        hacer que el instrumento pierda datos. El array entregado se
+        reutiliza en la iteración siguiente: debe copiarse si se lo
+        quiere conservar.
+        
+        La transferencia se detiene (PAUS, FAST0) al completar 'puntos',
+        al cerrar el generador (break o close()) o ante un error. Entonces
+        se descarta lo que quede del flujo en el bus y se restauran los
+        modos de los displays y el tiempo de espera de VISA.
+        
+        Parámetros:
+        ----------
+        frecMuestreo : int, float, str
+            Frecuencia de muestreo (igual que en leerBuffer).
+        puntosBloque : int
+            Pares X, Y por bloque.
+        puntos : int
+            Total de pares a leer. None lee hasta cerrar el generador.
+        bloquesCola : int
+            Bloques que pueden esperar al consumidor.
+            
+        Ejemplo:
+        -------
+            for bloque in loc1.leerDirectoXY('512 Hz', puntos=51200):
+                datos.append(bloque.copy())
+        """
+        i = self._indiceFrecMuestreo(frecMuestreo)
+        if not (isinstance(puntosBloque, int) and puntosBloque >= 1):
+            raise ValueError('puntosBloque >= 1, valor entero')
+        
+        # Fast Data Transfer transmite los displays, que deben ser X e Y
+        modosAnteriores = self.ch1Modo, self.ch2Modo
+        timeoutAnterior = self._lockin.timeout
+        self.ch1Modo = 'X'
+        self.ch2Modo = 'Y'
+        escala = self._floatinpSens[self.inpSens] / 30000
+        
+        # Tiempo de espera de VISA acorde a la duración de cada bloque
+        # (sólo durante la transferencia)
+        espera = 2 * puntosBloque / self._floatFrecMuestreo[i]
+        self._lockin.timeout = max(timeoutAnterior, int(1000 * espera))
+        
+        # Arrays preasignados: libres para el hilo y llenos para el
+        # consumidor (None indica el fin del flujo)
+        libres = queue.Queue()
+        llenos = queue.Queue()
+        for _ in range(bloquesCola + 1):
+            libres.put(np.empty((puntosBloque, 2)))
+        detener = threading.Event()
+        errores = list()
+        
+        def leer():
+            leidos = 0
+            try:
+                while not detener.is_set():
+                    if puntos is not None and leidos >= puntos:
+                        break
+                    bloque = libres.get()
+                    if bloque is None:
+                        break
+                    n = puntosBloque
+                    if puntos is not None:
+                        n = min(n, puntos - leidos)
+                    crudo = self._lockin.read_bytes(4 * n)
+                    enteros = np.frombuffer(crudo, dtype='<i2')
+                    np.multiply(enteros.reshape(n, 2), escala, 
+                                out=bloque[:n])
+                    leidos += n
+                    llenos.put(bloque[:n])
+            except Exception as error:
+                errores.append(error)
+            finally:
+                llenos.put(None)
+        
+        self._lockin.write('SRAT{0}'.format(i))
+        self._lockin.write('FAST2')
+        self._lockin.write('STRD')
+        
+        hilo = threading.Thread(target=leer, daemon=True)
+        hilo.start()
+        try:
+            while True:
+                bloque = llenos.get()
+                if bloque is None:
+                    break
+                yield bloque
+                libres.put(bloque.base if bloque.base is not None 
+                           else bloque)
+        finally:
+            detener.set()
+            libres.put(None)
+            hilo.join()
+            self._lockin.write('PAUS')
+            self._lockin.write('FAST0')
+            # Descarta los bytes del flujo que aún estén en camino para
+            # que la próxima consulta no los lea como respuesta
+            self._lockin.clear()
+            self._lockin.write('REST')
+            self._lockin.timeout = timeoutAnterior
+            self.ch1Modo, self.ch2Modo = modosAnteriores
+        if errores:
+            raise errores[0]
+    
+    def tiempoAsentamiento(self, constantes=None):
+        """
+        Tiempo de espera (s) para que el filtro de salida se asiente tras
+        un cambio de frecuencia, según la constante de tiempo (inpOflt) y
+        la pendiente del filtro (inpOfsl). Por defecto utiliza el número
+        de constantes de tiempo necesarias para alcanzar el 99% del valor
+        final (5, 7, 9 y 10 para 6, 12, 18 y 24 dB/oct).
         """
-        Barrido de frecuencia con obtención de multiples parámetros.
+        tau = self._floatinpOflt[self.inpOflt]
+        if constantes is None:
+            i = self._cinpOfsl.index(self.inpOfsl)
+            constantes = self._constantesAsentamiento[i]
+        return constantes * tau
+    
+    def _frecuenciasBarrido(self, inicio, fin, pasos, espaciado='Lineal'):
+        """ Frecuencias de un barrido con espaciado lineal o logarítmico """
+        if espaciado == 'Lineal':
+            return np.linspace(inicio, fin, pasos)
+        elif espaciado == 'Logaritmico':
+            return np.geomspace(inicio, fin, pasos)
+        else:
+            raise ValueError('Lineal, Logaritmico')
+    
+    def _medirFrecuencias(self, frecuencias, parametros, espera, cola=None,
+                          detener=None):
+        """
+        Mide los parámetros en cada frecuencia esperando el filtro. Si se
+        indica una cola, cada muestra (frecuencia, valores) se agrega a
+        ella apenas se obtiene (y el progreso lo muestra el consumidor).
+        Si se indica un threading.Event, el barrido se interrumpe cuando
+        se activa (devuelve sólo las filas medidas).
+        """
+        datos = np.zeros([len(frecuencias), len(parametros)])
+        pasos = range(len(frecuencias))
+        if cola is None:
+            pasos = self._barraProgreso(len(frecuencias))
+        for i in pasos:
+            if detener is not None and detener.is_set():
+                return datos[:i]
+            inicio = time.time()
+            self.refFrec = frecuencias[i]
+            # Espera sólo lo que resta del asentamiento (descontando la
+            # escritura del comando)
+            time.sleep(max(0, espera - (time.time() - inicio)))
+            datos[i] = self.consultarSimultaneo(*parametros)
+            if cola is not None:
+                cola.put((frecuencias[i], datos[i].copy()))
+        return datos
+    
+    def _consumirBarrido(self, cola, total, parametros, archivoDatos='',
+                         enVivo=False, intervalo=0.2, estado=None):
+        """
+        Consume las muestras de un barrido a medida que llegan (hasta
+        recibir None): las agrega al archivo (texto o binario, ver
+        guardarDatos), actualiza el gráfico en vivo cada 'intervalo'
+        segundos y muestra el progreso. Nunca hace esperar al hilo del
+        instrumento.
+        """
+        archivo = None
+        binario = None
+        if isinstance(archivoDatos, str) and archivoDatos.endswith('.npz'):
+            # Binario: bloques escritos como máximo cada un segundo
+            binario = almacenamiento.ArchivoDatos(
+                archivoDatos, ['F'] + list(parametros), estado)
+            guardado = time.time()
+        elif isinstance(archivoDatos, str) and len(archivoDatos) > 0:
+            archivo = open(archivoDatos, 'w')
+            archivo.write('# F,' + ','.join(parametros) + '\r\n')
+            archivo.flush()
+        
+        if enVivo:
+            import matplotlib.pyplot as plt
+            import graficos
+            figura = graficos.ventana('Barrido en curso')
+            ejes = figura.add_subplot(111)
+            ejes.set_xlabel('Frecuencia (Hz)')
+            lineas = [ejes.plot([], [], '.', label=p)[0] for p in parametros]
+            ejes.legend(loc='best')
+            frecuencias = list()
+            valores = list()
+            dibujado = time.time()
+        
+        progreso = self._barraProgreso(total)
+        next(progreso, None)
+        
+        try:
+            terminado = False
+            while not terminado:
+                # Toma todas las muestras disponibles (espera la primera)
+                muestras = [cola.get()]
+                while True:
+                    try:
+                        muestras.append(cola.get_nowait())
+                    except queue.Empty:
+                        break
+                if muestras[-1] is None:
+                    terminado = True
+                    muestras.pop()
+                
+                for frecuencia, fila in muestras:
+                    next(progreso, None)
+                    if archivo is not None:
+                        archivo.write(','.join('{0:.9e}'.format(v) for v in
+                                               (frecuencia,) + tuple(fila)))
+                        archivo.write('\r\n')
+                    if binario is not None:
+                        binario.agregar((frecuencia,) + tuple(fila))
+                    if enVivo:
+                        frecuencias.append(frecuencia)
+                        valores.append(fila)
+                if archivo is not None:
+                    archivo.flush()
+                if binario is not None and time.time() - guardado > 1:
+                    binario.vaciar()
+                    guardado = time.time()
+                
+                if enVivo and len(valores) > 0 and (
+                   terminado or time.time() - dibujado > intervalo):
+                    columnas = np.array(valores).transpose()
+                    for linea, columna in zip(lineas, columnas):
+                        linea.set_data(frecuencias, columna)
+                    ejes.relim()
+                    ejes.autoscale_view()
+                    plt.pause(0.001)
+                    dibujado = time.time()
+        finally:
+            if archivo is not None:
+                archivo.close()
+            if binario is not None:
+                binario.cerrar()
+    
+    def _refinarBarrido(self, frecuencias, datos, parametros, espera, 
+                        puntos, espaciado, cola=None, detener=None):
+        """
+        Agrega 'puntos' frecuencias en los intervalos donde la respuesta
+        (normalizada por el rango de cada parámetro) cambia más rápido.
+        Los puntos se agregan en tandas de a lo sumo un cuarto de los
+        intervalos, recalculando los cambios entre tandas. Se interrumpe
+        al activarse 'detener' (ver _medirFrecuencias).
+        """
+        agregados = 0
+        while agregados < puntos:
+            if detener is not None and detener.is_set():
+                break
+            escala = np.ptp(datos, axis=0)
+            escala[escala == 0] = 1
+            cambio = np.max(np.abs(np.diff(datos, axis=0)) / escala, axis=1)
+            
+            tanda = min(puntos - agregados, max(1, len(cambio) // 4))
+            intervalos = np.sort(np.argsort(cambio)[::-1][:tanda])
+            a = frecuencias[intervalos]
+            b = frecuencias[intervalos + 1]
+            if espaciado == 'Logaritmico':
+                nuevas = np.sqrt(a * b)
+            else:
+                nuevas = (a + b) / 2
+            
+            medidas = self._medirFrecuencias(nuevas, parametros, espera, 
+                                             cola, detener)
+            if len(medidas) < len(nuevas):
+                break
+            
+            frecuencias = np.concatenate([frecuencias, nuevas])
+            datos = np.concatenate([datos, medidas])
+            orden = np.argsort(frecuencias, kind='stable')
+            frecuencias = frecuencias[orden]
+            datos = datos[orden]
+            agregados += tanda
+            
+        return frecuencias, datos
+    
+    def medirBarrido(self, inicio, fin, pasos, *parametros, 
+                     espaciado='Lineal', espera=None, refinar=0, 
+                     archivoDatos='', enVivo=False):
+        """
+        Barrido de frecuencia sin gráficos: sólo adquiere y registra.
         Se utiliza la función consultar simultáneo al mismo tiempo que se
         barre entre la frecuencia inicial y final a un número dado de pasos.
         
+        Después de cada cambio de frecuencia se espera el asentamiento del
+        filtro de salida (ver tiempoAsentamiento). Opcionalmente se
+        agregan puntos donde la respuesta cambia más rápido.
+        
         Parámetros:
         ----------
         inicio : float
@@ -858,70 +1481,187 @@ class Lockin(object):
             Frecuencia final.
         puntos : int
             Número de pasos.
-        graficar : bool
-            Indica si al finalizar se obtiene un gráfico de vista previa.
         parametros : tuple
             Parámetros a medir. Los valores permitidos son los mismos que
             para la función consultarSimultaneo.
+        espaciado : str
+            'Lineal' o 'Logaritmico'.
+        espera : float
+            Espera en segundos tras cada cambio de frecuencia. Por defecto
+            la calculada por tiempoAsentamiento.
+        refinar : int
+            Cantidad de puntos a agregar en forma adaptativa.
+        archivoDatos : str
+            Archivo al que se agrega cada muestra apenas se obtiene (un
+            corte a mitad del barrido conserva lo medido). Binario con el
+            estado del instrumento si termina en '.npz', si no texto
+            separado por comas (ver guardarDatos).
+        enVivo : bool
+            Muestra un gráfico que se actualiza durante el barrido (única
+            opción que utiliza pyplot).
+            
+        Devuelve la Medicion agregada al registro: medicion['F'] y
+        medicion[parametro] son los arrays medidos y medicion.estado el
+        estado del instrumento. Para graficarla ver graficos.py.
+            
+        La comunicación con el instrumento corre en un hilo dedicado y las
+        muestras pasan por una cola al guardado y al gráfico en vivo, de
+        modo que el instrumento nunca espera a esas tareas.
         """                           
         
-        self._frecBarrido = np.linspace(inicio, fin, pasos)
+        frecuencias = self._frecuenciasBarrido(inicio, fin, pasos, espaciado)
+        
+        if espera is None:
+            espera = self.tiempoAsentamiento()
+        
         self.consultarSimultaneo(*parametros)
         
-        self._datosBarrido = np.zeros([pasos, len(parametros)])
-            
-        for i in self._barraProgreso(pasos):
-            self.refFrec = self._frecBarrido[i]
-            self._datosBarrido[i] = self.consultarSimultaneo(*parametros)
-            
-        self._datosBarrido = self._datosBarrido.transpose()
+        # El estado se lee antes de ceder el instrumento al hilo
+        estado = None
+        if isinstance(archivoDatos, str) and len(archivoDatos) > 0:
+            estado = self.estadoPropiedades()
         
-        if 0 < graficar <= len(parametros):
-            figura = plt.figure()
-            titulo = ('Barrido de frecuencia: ' + str(inicio) +
-                      ' a ' + str(fin) + ' Hz')  
-            figura.canvas.set_window_title(titulo)
-            ejes = figura.add_subplot(111)
-            ejes.set_title(titulo)
-            ejes.set_xlabel('Frecuencia (Hz)')
-
-            for i in range(graficar):
-                ejes.plot(self._frecBarrido, self._datosBarrido[i])            
-            
-            if graficar == 1:
-                if parametros[0] == 'T':
-                    ejes.set_ylabel('Fase (º)')    
-                else:
-                    ejes.set_ylabel(parametros[0] + '(Vrms)')
-                ejes.legend([parametros[0]], loc='best', frameon=True,
-                            shadow=True, fancybox=True)
-            else:
-                ejes.set_ylabel('Tensión (Vrms)')
-                ejes.legend(parametros, loc='best', frameon=True,
-                            shadow=True, fancybox=True)
-                
-            self._figuras.append(figura)
+        # El instrumento se maneja desde un hilo dedicado; este hilo
+        # guarda y grafica las muestras a medida que llegan
+        cola = queue.Queue()
+        resultado = dict()
+        detener = threading.Event()
         
-        self._datos.append([self._frecBarrido, self._datosBarrido])
+        def medir():
+            try:
+                datos = self._medirFrecuencias(frecuencias, parametros,
+                                               espera, cola, detener)
+                resultado['barrido'] = frecuencias, datos
+                if refinar > 0:
+                    resultado['barrido'] = self._refinarBarrido(
+                        frecuencias, datos, parametros, espera, refinar,
+                        espaciado, cola, detener)
+            except Exception as error:
+                resultado['error'] = error
+            finally:
+                cola.put(None)
+        
+        hilo = threading.Thread(target=medir, daemon=True)
+        hilo.start()
+        try:
+            self._consumirBarrido(cola, pasos + refinar, parametros, 
+                                  archivoDatos, enVivo, estado=estado)
+        finally:
+            # Si el consumidor falla (Ctrl-C, archivo, gráfico) el hilo
+            # deja de manejar el instrumento antes de propagar el error
+            detener.set()
+            hilo.join()
+        
+        if 'error' in resultado:
+            raise resultado['error']
+        frecuencias, datos = resultado['barrido']
+        
+        self._frecBarrido = frecuencias
+        self._datosBarrido = datos.transpose()
+        self._parametrosBarrido = parametros
+        
+        return self.registro.agregar('Barrido', parametros,
+                                     [('F', self._frecBarrido)] + 
+                                     list(zip(parametros, self._datosBarrido)),
+                                     self.estadoPropiedades(consultar=False))
+    
+    def barrerFrecuencia(self, inicio, fin, pasos, 
+                         graficar, *parametros, espaciado='Lineal',
+                         espera=None, refinar=0, archivoDatos='', 
+                         enVivo=False):
+        """
+        Barrido de frecuencia con obtención de multiples parámetros y
+        gráfico de vista previa (ver medirBarrido).
+        
+        Parámetros:
+        ----------
+        graficar : int
+            Cantidad de parámetros a graficar al finalizar (0 o False no
+            grafica).
+        
+        El resto de los parámetros son los de medirBarrido. Devuelve las
+        frecuencias y los datos (un parámetro por fila), y la figura si se
+        graficó. Para barridos sin pantalla o que guardan los gráficos en
+        PNG conviene medirBarrido junto con graficos.Renderizador.
+        """                           
+        
+        medicion = self.medirBarrido(inicio, fin, pasos, *parametros,
+                                     espaciado=espaciado, espera=espera,
+                                     refinar=refinar, 
+                                     archivoDatos=archivoDatos, 
+                                     enVivo=enVivo)
+        
+        if 0 < graficar <= len(parametros):
+            import graficos
+            figura = graficos.ventana(
+                graficos.tituloBarrido(self._frecBarrido))
+            graficos.dibujarBarrido(figura.add_subplot(111), 
+                                    self._frecBarrido, self._datosBarrido,
+                                    medicion.parametros, graficar)
+            self.registro.agregarFigura(figura)
         
         if graficar == False:
             return self._frecBarrido, self._datosBarrido
         else:
             return self._frecBarrido, self._datosBarrido, figura
    
-    def guardarDatos(self, archivoDatos, datos, nombre_columnas=''):  
+    def _guardarColumnas(self, archivoDatos, nombres, columnas, 
+                         estado=True):
+        """ Guarda columnas con nombre en texto o en el formato binario """
+        if len(nombres) != len(columnas):
+            raise ValueError(str(len(nombres)) + ' nombres para ' +
+                             str(len(columnas)) + ' columnas')
+        if archivoDatos.endswith('.npz'):
+            almacenamiento.guardar(archivoDatos, nombres, columnas,
+                                   self.estadoPropiedades() if estado 
+                                   else None)
+        else:
+            np.savetxt(archivoDatos, np.column_stack(columnas), 
+                       delimiter=',', newline='\r\n', 
+                       header=','.join(nombres))
+    
+    def guardarDatos(self, archivoDatos, datos, nombre_columnas='',
+                     estado=True):  
         """ 
-        Guarda los datos ingresados como iterable (tupla o lista) en el
-        archivo indicado.
+        Guarda los datos ingresados como iterable (tupla o lista) de
+        columnas en el archivo indicado.
+        
+        Si el archivo termina en '.npz' se utiliza el formato binario por
+        columnas de almacenamiento.py, que incluye el estado del instrumento
+        (estado=True) y se carga con memory-map. En otro caso se guarda como
+        texto separado por comas. La cantidad de nombres en nombre_columnas
+        (separados por coma) debe coincidir con la de columnas.
         """
-        datos = np.array([datos])
-        datos = datos.transpose()
-        np.savetxt(archivoDatos, datos, delimiter=',',newline='\r\n',
-                   header=nombre_columnas)         
+        if nombre_columnas:
+            nombres = [n.strip() for n in nombre_columnas.split(',')]
+        else:
+            nombres = ['Columna' + str(i) for i in range(len(datos))]
+        self._guardarColumnas(archivoDatos, nombres, list(datos), estado)
+    
+    def guardarBarrido(self, archivoDatos, estado=True):
+        """
+        Guarda el último barrido de frecuencia con los nombres de columna
+        de sus parámetros (F seguido de los parámetros medidos)
+        """
+        if self._frecBarrido is None:
+            raise ValueError('No hay un barrido para guardar')
+        self._guardarColumnas(archivoDatos, 
+                              ['F'] + list(self._parametrosBarrido),
+                              [self._frecBarrido] + list(self._datosBarrido),
+                              estado)
     
-    def cargarDatos(self, archivoDatos, unpack=True):
-        """ Carga los datos del archivo indicado y puede desempacarlos """
-        return np.loadtxt(archivoDatos, delimiter=',', unpack=True)
+    def cargarDatos(self, archivoDatos, unpack=True, mmap=True):
+        """ 
+        Carga los datos del archivo indicado (texto o binario .npz) y puede
+        desempacarlos por columnas. Las columnas de un archivo binario se
+        abren con memory-map (mmap=True).
+        """
+        if not archivoDatos.endswith('.npz'):
+            return np.loadtxt(archivoDatos, delimiter=',', unpack=unpack)
+        columnas = list(almacenamiento.cargar(archivoDatos, mmap).values())
+        if unpack:
+            return columnas
+        return np.column_stack(columnas)
     
     def _probarTodasLasFunciones(self):
         """ Función auxiliar para pruebas """
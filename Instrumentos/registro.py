@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de los resultados obtenidos durante una sesión.
+
+Cada barrido o lectura del buffer se guarda como una Medicion (fecha,
+tipo, parámetros, estado del instrumento y arrays). El Registro mantiene
+en memoria sólo las mediciones más recientes que entran en el presupuesto
+indicado: las anteriores se vuelcan a disco (formato de almacenamiento.py)
+y se vuelven a abrir con memory-map al consultarlas. De las figuras sólo
+se conservan referencias débiles y a lo sumo 'maxFiguras' abiertas, de
+modo que una sesión larga mantiene el uso de memoria acotado.
+
+Ejemplo:
+
+    for medicion in loc1.registro.buscar(parametro='R', desde=inicio):
+        print(medicion.fecha, medicion.arrays['R'].max())
+"""
+import os
+import time
+import bisect
+import weakref
+import tempfile
+from collections import OrderedDict
+import almacenamiento
+
+class Medicion(object):
+    '''
+    Resultado de una adquisición.
+
+    Atributos
+    ---------
+    indice : int
+        Posición en el registro.
+    tipo : str
+        'Barrido', 'Buffer', etc.
+    fecha : float
+        Momento de la adquisición (time.time()).
+    parametros : tuple
+        Nombres de los parámetros medidos.
+    estado : dict
+        Estado del instrumento durante la adquisición.
+    arrays : OrderedDict
+        Datos por nombre (se leen del disco si la medición fue volcada).
+        medicion[nombre] equivale a medicion.arrays[nombre].
+    ruta : str
+        Archivo en disco (None mientras la medición está en memoria).
+    '''
+    __slots__ = ('indice', 'tipo', 'fecha', 'parametros', 'estado',
+                 'ruta', '_arrays', '__weakref__')
+
+    def __init__(self, indice, tipo, fecha, parametros, estado, arrays):
+        self.indice = indice
+        self.tipo = tipo
+        self.fecha = fecha
+        self.parametros = tuple(parametros)
+        self.estado = estado
+        self.ruta = None
+        self._arrays = arrays
+
+    def _get_arrays(self):
+        if self._arrays is not None:
+            return self._arrays
+        return almacenamiento.cargar(self.ruta)
+    arrays = property(_get_arrays)
+
+    def __getitem__(self, nombre):
+        return self.arrays[nombre]
+
+    def _get_bytes(self):
+        if self._arrays is None:
+            return 0
+        return sum(a.nbytes for a in self._arrays.values())
+    bytes = property(_get_bytes)
+
+    def __repr__(self):
+        return ('Medicion({0}, {1!r}, {2}, {3})'.format(
+                self.indice, self.tipo,
+                time.strftime('%H:%M:%S', time.localtime(self.fecha)),
+                ','.join(self.parametros)) +
+                ('' if self.ruta is None else ' [disco]'))
+
+class Registro(object):
+    '''
+    Almacén de mediciones con presupuesto de memoria.
+
+    Parámetros
+    ----------
+    presupuesto : int
+        Bytes de arrays que pueden permanecer en memoria.
+    carpeta : str (opcional)
+        Carpeta para las mediciones volcadas a disco. Por defecto una
+        carpeta temporal creada al volcar la primera.
+    maxFiguras : int
+        Figuras registradas que pueden permanecer abiertas. Al superarlo se
+        cierran las más antiguas.
+    '''
+    def __init__(self, presupuesto=64 * 2 ** 20, carpeta=None, maxFiguras=16):
+        self.presupuesto = presupuesto
+        self.carpeta = carpeta
+        self.maxFiguras = maxFiguras
+
+        self._mediciones = list()
+        self._fechas = list()
+        self._porParametro = dict()
+        self._porTipo = dict()
+        self._residentes = OrderedDict()
+        self._memoria = 0
+        self._figuras = list()
+
+    def __len__(self):
+        return len(self._mediciones)
+
+    def __getitem__(self, i):
+        return self._mediciones[i]
+
+    def __iter__(self):
+        return iter(self._mediciones)
+
+    def memoria(self):
+        """ Bytes de arrays en memoria """
+        return self._memoria
+
+    #----------------------------------------------------------------------
+    # Mediciones
+    #----------------------------------------------------------------------
+
+    def agregar(self, tipo, parametros, arrays, estado=None):
+        """
+        Agrega una medición (arrays: diccionario nombre -> array) y vuelca
+        a disco las más antiguas si se supera el presupuesto
+        """
+        # Las fechas se mantienen crecientes para indexarlas con bisect
+        fecha = time.time()
+        if self._fechas and fecha < self._fechas[-1]:
+            fecha = self._fechas[-1]
+        medicion = Medicion(len(self._mediciones), tipo, fecha, parametros,
+                            dict() if estado is None else dict(estado),
+                            OrderedDict(arrays))
+        self._mediciones.append(medicion)
+        self._fechas.append(fecha)
+        
+        # Índices por parámetro y por tipo (listas ordenadas de índices)
+        for parametro in medicion.parametros:
+            self._porParametro.setdefault(parametro, list()).append(
+                medicion.indice)
+        self._porTipo.setdefault(tipo, list()).append(medicion.indice)
+
+        self._residentes[medicion.indice] = medicion
+        self._memoria += medicion.bytes
+        self._ajustar()
+        return medicion
+
+    def _ajustar(self):
+        """ Vuelca a disco las mediciones más antiguas en memoria """
+        while self._memoria > self.presupuesto and len(self._residentes) > 1:
+            _, medicion = self._residentes.popitem(last=False)
+            self._volcar(medicion)
+
+    def _volcar(self, medicion):
+        if self.carpeta is None:
+            self.carpeta = tempfile.mkdtemp(prefix='registro_')
+        ruta = os.path.join(self.carpeta,
+                            'medicion_{0:05d}.npz'.format(medicion.indice))
+        arrays = medicion._arrays
+        almacenamiento.guardar(ruta, list(arrays), list(arrays.values()),
+                               {'tipo': medicion.tipo,
+                                'fecha': medicion.fecha,
+                                'parametros': medicion.parametros,
+                                'estado': medicion.estado})
+        self._memoria -= medicion.bytes
+        medicion.ruta = ruta
+        medicion._arrays = None
+
+    def buscar(self, parametro=None, desde=None, hasta=None, tipo=None):
+        """
+        Devuelve las mediciones que incluyen el parámetro indicado, del
+        tipo indicado y con fecha entre 'desde' y 'hasta' (time.time())
+        """
+        inicio = 0 if desde is None else bisect.bisect_left(self._fechas,
+                                                            desde)
+        fin = (len(self._fechas) if hasta is None else
+               bisect.bisect_right(self._fechas, hasta))
+        indices = range(inicio, fin)
+        for indice, clave in ((self._porParametro, parametro),
+                              (self._porTipo, tipo)):
+            if clave is not None:
+                candidatos = indice.get(clave, [])
+                a = bisect.bisect_left(candidatos, inicio)
+                b = bisect.bisect_left(candidatos, fin)
+                indices = set(candidatos[a:b]).intersection(indices)
+        return [self._mediciones[i] for i in sorted(indices)]
+
+    def ultima(self, tipo=None):
+        """ Última medición (del tipo indicado) o None """
+        if tipo is None:
+            return self._mediciones[-1] if self._mediciones else None
+        indices = self._porTipo.get(tipo)
+        return self._mediciones[indices[-1]] if indices else None
+
+    def limpiar(self):
+        """ Elimina todas las mediciones (y sus archivos en disco) """
+        for medicion in self._mediciones:
+            if medicion.ruta is not None and os.path.exists(medicion.ruta):
+                os.remove(medicion.ruta)
+        self.__init__(self.presupuesto, self.carpeta, self.maxFiguras)
+
+    #----------------------------------------------------------------------
+    # Figuras
+    #----------------------------------------------------------------------
+
+    def _abiertas(self):
+        """ Referencias a las figuras registradas que siguen abiertas """
+        import matplotlib.pyplot as plt
+        return [f for f in self._figuras if f() is not None and
+                plt.fignum_exists(f().number)]
+
+    def agregarFigura(self, figura):
+        """
+        Registra una figura sin impedir que se libere al cerrarla. Si hay
+        más de maxFiguras abiertas se cierran las más antiguas.
+        """
+        import matplotlib.pyplot as plt
+        self._figuras = self._abiertas() + [weakref.ref(figura)]
+        while len(self._figuras) > self.maxFiguras:
+            plt.close(self._figuras.pop(0)())
+
+    def figuras(self):
+        """ Figuras registradas que siguen abiertas """
+        self._figuras = self._abiertas()
+        return [f() for f in self._figuras]
+
+    def cerrarFigura(self, figura, archivo=None):
+        """ Guarda la figura (si se indica un archivo) y la cierra """
+        import matplotlib.pyplot as plt
+        if archivo is not None:
+            figura.savefig(archivo)
+        plt.close(figura)
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+Simulador del amplificador Lock-In SR830 para probar el código sin el
+instrumento.
+
+SimuladorVISA reemplaza a la sesión de PyVISA (write, query,
+query_ascii_values, query_binary_values y read_bytes). Mantiene el estado
+completo de los registros del SR830 que utiliza la clase Lockin y calcula
+las salidas a partir de un dispositivo bajo prueba (CircuitoRC,
+MuestraFoucault o cualquier objeto con un método respuesta(frecuencia)),
+con ruido gaussiano reproducible (semilla) y, opcionalmente, la latencia
+del bus y el asentamiento del filtro de salida.
+
+Ejemplo:
+
+    simulador = SimuladorVISA(MuestraFoucault(resistividad=2.8e-8),
+                              semilla=1, latencia=2e-3, asentamiento=True)
+    loc1 = Lockin(modo_simulador=simulador)
+"""
+import re
+import math
+import time
+import numpy as np
+
+class CircuitoRC(object):
+    """
+    Filtro RC pasabajos alimentado por la salida de referencia: la
+    entrada A mide la tensión sobre el capacitor.
+    """
+    def __init__(self, resistencia=1e3, capacidad=1e-7):
+        self.resistencia = resistencia
+        self.capacidad = capacidad
+
+    def respuesta(self, frecuencia):
+        """ Transferencia compleja Ventrada / Vreferencia """
+        omega = 2 * np.pi * np.asarray(frecuencia)
+        return 1 / (1 + 1j * omega * self.resistencia * self.capacidad)
+
+class MuestraFoucault(object):
+    """
+    Muestra cilíndrica conductora dentro de un par de bobinas (práctica de
+    resistividad por el método no inductivo). La primaria se alimenta con
+    la referencia a través de 'resistenciaSerie' y la entrada mide la
+    tensión inducida en la secundaria, modificada por las corrientes de
+    Foucault de la muestra:
+
+        V = j w M I (1 + llenado * chi),
+        chi = 2 J1(ka) / (ka J0(ka)) - 1,   k = (1 - j) / delta
+
+    Con resistividad=None se simula el vacío (chi = 0).
+    """
+    def __init__(self, radio=6.5e-3, resistividad=2.8e-8, mutua=1e-4,
+                 resistenciaSerie=1e3, llenado=0.8):
+        self.radio = radio
+        self.resistividad = resistividad
+        self.mutua = mutua
+        self.resistenciaSerie = resistenciaSerie
+        self.llenado = llenado
+
+    def susceptibilidad(self, frecuencia):
+        """ Susceptibilidad efectiva (compleja) de la muestra """
+        omega = 2 * np.pi * np.asarray(frecuencia, dtype=float)
+        if self.resistividad is None:
+            return np.zeros_like(omega, dtype=complex)
+        from scipy.special import jv
+        delta = np.sqrt(2 * self.resistividad / (4e-7 * np.pi * omega))
+        ka = (1 - 1j) * self.radio / delta
+        return 2 * jv(1, ka) / (ka * jv(0, ka)) - 1
+
+    def respuesta(self, frecuencia):
+        """ Transferencia compleja Ventrada / Vreferencia """
+        omega = 2 * np.pi * np.asarray(frecuencia, dtype=float)
+        corriente = 1 / self.resistenciaSerie
+        return (1j * omega * self.mutua * corriente *
+                (1 + self.llenado * self.susceptibilidad(frecuencia)))
+
+class SimuladorVISA:
+    """
+    Clase auxiliar para simular la comunicación con un dispositivo PyVISA.
+
+    Parámetros
+    ----------
+    dispositivo : objeto (opcional)
+        Dispositivo bajo prueba con un método respuesta(frecuencia) que
+        devuelve la transferencia compleja. Por defecto un CircuitoRC.
+    semilla : int
+        Semilla del ruido (las mismas llamadas dan las mismas respuestas).
+    ruido : float
+        Ruido gaussiano en Vrms sumado a X e Y.
+    latencia : float
+        Demora en segundos de cada escritura o consulta (bus GPIB).
+    asentamiento : bool
+        Emula la respuesta del filtro de salida (constante de tiempo y
+        pendiente configuradas) tras cada cambio de la referencia.
+    duracionAuto : float
+        Duración de las autofunciones (AGAN, ARSV, APHS, AOFF) en segundos.
+    """
+
+    # Rango válido de los registros enteros y reales
+    _enteros = {'FMOD': 1, 'RSLP': 2, 'ISRC': 3, 'IGND': 1, 'ICPL': 1,
+                'ILIN': 3, 'SENS': 26, 'RMOD': 2, 'OFLT': 19, 'OFSL': 3,
+                'SYNC': 1, 'LOCL': 2, 'OVRM': 1, 'SRAT': 14, 'SEND': 1,
+                'TSTR': 1, 'FAST': 2}
+    _reales = {'PHAS': (-360.0, 729.99), 'FREQ': (0.001, 102000.0),
+               'SLVL': (0.004, 5.0), 'HARM': (1, 19999)}
+
+    # Estado luego de *RST
+    _inicial = {'PHAS': 0.0, 'FMOD': 1, 'FREQ': 1000.0, 'SLVL': 1.0,
+                'HARM': 1, 'RSLP': 0, 'ISRC': 0, 'IGND': 0, 'ICPL': 0,
+                'ILIN': 0, 'SENS': 26, 'RMOD': 1, 'OFLT': 8, 'OFSL': 1,
+                'SYNC': 0, 'LOCL': 0, 'OVRM': 0, 'SRAT': 10, 'SEND': 1,
+                'TSTR': 0, 'FAST': 0, 'DDEF1': (0, 0, 0), 'DDEF2': (0, 0, 0),
+                'AUXV1': 0.0, 'AUXV2': 0.0, 'AUXV3': 0.0, 'AUXV4': 0.0}
+
+    _sensibilidades = (2e-9, 5e-9, 10e-9, 20e-9, 50e-9, 100e-9, 200e-9,
+                       500e-9, 1e-6, 2e-6, 5e-6, 10e-6, 20e-6, 50e-6,
+                       100e-6, 200e-6, 500e-6, 1e-3, 2e-3, 5e-3, 10e-3,
+                       20e-3, 50e-3, 100e-3, 200e-3, 500e-3, 1)
+    _constantes = (10e-6, 30e-6, 100e-6, 300e-6, 1e-3, 3e-3, 10e-3, 30e-3,
+                   100e-3, 300e-3, 1.0, 3.0, 10.0, 30.0, 100.0, 300.0,
+                   1e3, 3e3, 10e3, 30e3)
+
+    _formato = re.compile(r'\s*(\*?[A-Z]{3,4})(\?)?\s*(.*?)\s*$')
+
+    def __init__(self, dispositivo=None, semilla=0, ruido=1e-6, latencia=0.0,
+                 asentamiento=False, duracionAuto=0.05):
+        print('Simulador de dispositivo VISA')
+        print('Modo de respuesta automatica: 0')
+
+        self.dispositivo = CircuitoRC() if dispositivo is None else dispositivo
+        self.semilla = semilla
+        self.ruido = ruido
+        self.latencia = latencia
+        self.asentamiento = asentamiento
+        self.duracionAuto = duracionAuto
+        self.timeout = 2000
+
+        self._azar = np.random.RandomState(semilla)
+        self._registros = dict(self._inicial)
+        self._ranuras = dict()
+        self._esr = 0
+        self._ocupadoHasta = 0
+        self._auxiliares = [0.0, 0.0, 0.0, 0.0]
+
+        # Asentamiento: salida previa y momento del último cambio
+        self._previa = 0j
+        self._cambio = None
+
+        # Estado del buffer interno
+        self._inicioBuffer = None
+        self._puntosBuffer = 0
+        self._ruidoBuffer = None
+
+        # Estado del modo Fast Data Transfer
+        self._inicio = None
+        self._enviados = 0
+
+        self.transacciones = 0
+
+    #----------------------------------------------------------------------
+    # Modelo del instrumento
+    #----------------------------------------------------------------------
+
+    def _esperar(self):
+        """ Emula la demora de una transacción en el bus """
+        self.transacciones += 1
+        if self.latencia > 0:
+            time.sleep(self.latencia)
+
+    def _final(self):
+        """ Salida X + jY asentada para la configuración actual """
+        r = self._registros
+        frecuencia = r['FREQ'] * r['HARM']
+        entrada = r['SLVL'] * complex(self.dispositivo.respuesta(frecuencia))
+        return entrada * np.exp(-1j * np.radians(r['PHAS']))
+
+    def _salida(self, instante=None, final=None):
+        """ Salida X + jY (sin ruido) en el instante indicado """
+        if final is None:
+            final = self._final()
+        if not self.asentamiento or self._cambio is None:
+            return final
+        if instante is None:
+            instante = time.time()
+        # Respuesta al escalón de un filtro de orden n (6 dB/oct por orden)
+        tau = self._constantes[self._registros['OFLT']]
+        orden = self._registros['OFSL'] + 1
+        x = max(0.0, instante - self._cambio) / tau
+        resto = math.exp(-x) * sum(x ** k / math.factorial(k)
+                                   for k in range(orden))
+        return final + (self._previa - final) * resto
+
+    def _cambiarReferencia(self, registro, valor):
+        """ Registra un cambio que modifica la salida (para asentamiento) """
+        if self.asentamiento:
+            self._previa = self._salida()
+            self._cambio = time.time()
+        self._registros[registro] = valor
+
+    def _valores(self, indices, instante=None, ruido=None, final=None):
+        """ Valores de SNAP? / OUTP? / OUTR? para los índices (1 a 11) """
+        z = self._salida(instante, final)
+        if ruido is None:
+            ruido = self._azar.normal(0, self.ruido, 2)
+        x = z.real + ruido[0]
+        y = z.imag + ruido[1]
+        r = self._registros
+        todos = {1: x, 2: y, 3: math.hypot(x, y),
+                 4: math.degrees(math.atan2(y, x)),
+                 5: self._auxiliares[0], 6: self._auxiliares[1],
+                 7: self._auxiliares[2], 8: self._auxiliares[3],
+                 9: r['FREQ']}
+        # Displays: X, R, Xn, Aux1, Aux2 / Y, T, Yn, Aux3, Aux4
+        ch1 = (1, 3, None, 5, 6)[r['DDEF1'][0]]
+        ch2 = (2, 4, None, 7, 8)[r['DDEF2'][0]]
+        todos[10] = self.ruido if ch1 is None else todos[ch1]
+        todos[11] = self.ruido if ch2 is None else todos[ch2]
+        return [todos[i] for i in indices]
+
+    def _frecuenciaBuffer(self):
+        return 2.0 ** (self._registros['SRAT'] - 4)
+
+    def _puntosAlmacenados(self):
+        """ Puntos almacenados desde STRT (máximo 16383) """
+        if self._inicioBuffer is None:
+            return self._puntosBuffer
+        transcurrido = time.time() - self._inicioBuffer
+        return self._puntosBuffer + min(16383 - self._puntosBuffer,
+            int(transcurrido * self._frecuenciaBuffer()))
+
+    def _autofuncion(self, comando, argumentos):
+        """ Efecto de las autofunciones sobre los registros """
+        self._ocupadoHasta = time.time() + self.duracionAuto
+        z = self._final()
+        if comando == 'AGAN':
+            # Menor sensibilidad que contiene a R con margen
+            r = abs(z) * 1.25
+            for i, s in enumerate(self._sensibilidades):
+                if s >= r:
+                    break
+            self._registros['SENS'] = i
+        elif comando == 'APHS':
+            fase = self._registros['PHAS'] + np.degrees(np.angle(z))
+            self._cambiarReferencia('PHAS', (fase + 180) % 360 - 180)
+
+    #----------------------------------------------------------------------
+    # Interfaz de PyVISA
+    #----------------------------------------------------------------------
+
+    def write(self, cadena):
+        self._esperar()
+        for comando in cadena.split(';'):
+            if comando.strip():
+                self._ejecutar(comando)
+
+    def query(self, cadena, separator=''):
+        self._esperar()
+        respuesta = ''
+        for comando in cadena.split(';'):
+            if comando.strip():
+                respuesta = self._ejecutar(comando)
+        return respuesta
+
+    def query_ascii_values(self, cadena, separator=',', **args):
+        return [float(v) for v in self.query(cadena).split(separator)]
+
+    def query_binary_values(self, cadena, datatype='f', container=list,
+                            **args):
+        self._esperar()
+        coincide = self._formato.match(cadena)
+        if coincide is None or coincide.group(1) not in ('TRCB', 'TRCL'):
+            self._esr |= 0b100000
+            raise IOError('Consulta binaria no soportada: ' + cadena)
+        canal, inicio, puntos = [int(v) for v in coincide.group(3).split(',')]
+        if not (canal in (1, 2) and 0 <= inicio and
+                inicio + puntos <= self._puntosAlmacenados()):
+            self._esr |= 0b10000
+            raise IOError('Puntos fuera del buffer')
+
+        # El ruido de cada posición del buffer es siempre el mismo
+        if self._ruidoBuffer is None:
+            azar = np.random.RandomState(self.semilla + 1)
+            self._ruidoBuffer = azar.normal(0, self.ruido, (16383, 2))
+        frec = self._frecuenciaBuffer()
+        origen = self._inicioBuffer
+        if origen is None:
+            origen = time.time() - self._puntosBuffer / frec
+        final = self._final()
+        valores = np.empty(puntos, dtype=np.float32)
+        for k in range(puntos):
+            i = inicio + k
+            valores[k] = self._valores([9 + canal], origen + i / frec,
+                                       self._ruidoBuffer[i], final)[0]
+        return container(valores)
+
+    def clear(self):
+        # Device clear: el simulador no deja bytes pendientes en el bus
+        self._esperar()
+
+    def read_bytes(self, cantidad):
+        # Flujo FAST2: pares X, Y int16 (little endian) a la frecuencia
+        # de muestreo configurada, escalados a la sensibilidad
+        if not (self._registros['FAST'] and self._inicio is not None):
+            raise IOError('Fast Data Transfer inactivo')
+        n = cantidad // 4
+        frec = self._frecuenciaBuffer()
+        disponible = self._inicio + (self._enviados + n) / frec
+        time.sleep(max(0, disponible - time.time()))
+        escala = 30000 / self._sensibilidades[self._registros['SENS']]
+        final = self._final()
+        datos = np.empty((n, 2))
+        for k in range(n):
+            instante = self._inicio + (self._enviados + k) / frec
+            datos[k] = self._valores([1, 2], instante, final=final)
+        self._enviados += n
+        datos = np.clip(np.round(datos * escala), -32768, 32767)
+        return datos.astype('<i2').tobytes()
+
+    #----------------------------------------------------------------------
+    # Intérprete de comandos
+    #----------------------------------------------------------------------
+
+    def _ejecutar(self, comando):
+        """ Ejecuta un comando y devuelve la respuesta (o '') """
+        coincide = self._formato.match(comando)
+        if coincide is None:
+            self._esr |= 0b100000
+            return ''
+        nombre, consulta, texto = coincide.groups()
+        argumentos = [a.strip() for a in texto.split(',')] if texto else []
+        try:
+            if consulta:
+                return self._consultar(nombre, argumentos)
+            self._escribir(nombre, argumentos)
+        except KeyError:
+            # Comando no reconocido
+            self._esr |= 0b100000
+        except (ValueError, IndexError):
+            # Parámetro fuera de rango
+            self._esr |= 0b10000
+        return ''
+
+    def _escribir(self, nombre, argumentos):
+        r = self._registros
+        if nombre in self._enteros:
+            valor = int(argumentos[0])
+            if not 0 <= valor <= self._enteros[nombre]:
+                raise ValueError(nombre)
+            r[nombre] = valor
+            if nombre == 'FAST' and valor == 0:
+                self._inicio = None
+        elif nombre in self._reales:
+            valor = float(argumentos[0])
+            minimo, maximo = self._reales[nombre]
+            if not minimo <= valor <= maximo:
+                raise ValueError(nombre)
+            if nombre == 'HARM':
+                valor = int(valor)
+            self._cambiarReferencia(nombre, valor)
+        elif nombre == 'AUXV':
+            i, valor = int(argumentos[0]), float(argumentos[1])
+            if not (1 <= i <= 4 and -10.5 <= valor <= 10.5):
+                raise ValueError(nombre)
+            r['AUXV{0}'.format(i)] = valor
+        elif nombre == 'DDEF':
+            i = int(argumentos[0])
+            valores = tuple(int(a) for a in argumentos[1:3])
+            if not (i in (1, 2) and 0 <= valores[0] <= 4):
+                raise ValueError(nombre)
+            r['DDEF{0}'.format(i)] = valores
+        elif nombre in ('AGAN', 'ARSV', 'APHS', 'AOFF'):
+            self._autofuncion(nombre, argumentos)
+        elif nombre == 'SSET':
+            self._ranuras[int(argumentos[0])] = dict(r)
+        elif nombre == 'RSET':
+            self._registros = dict(self._ranuras.get(int(argumentos[0]),
+                                                     self._inicial))
+        elif nombre == 'STRT':
+            if self._inicioBuffer is None:
+                self._inicioBuffer = time.time()
+        elif nombre == 'STRD':
+            # El instrumento comienza 0.5 s después del comando
+            self._inicio = time.time() + 0.5
+            self._enviados = 0
+        elif nombre == 'PAUS':
+            self._puntosBuffer = self._puntosAlmacenados()
+            self._inicioBuffer = None
+            self._inicio = None
+        elif nombre == 'REST':
+            self._puntosBuffer = 0
+            self._inicioBuffer = None
+            self._inicio = None
+        elif nombre == '*RST':
+            self._registros = dict(self._inicial)
+        elif nombre == '*CLS':
+            self._esr = 0
+        else:
+            raise KeyError(nombre)
+
+    def _consultar(self, nombre, argumentos):
+        r = self._registros
+        if nombre in self._enteros:
+            return '{0:d}'.format(r[nombre])
+        elif nombre in self._reales:
+            return '{0:.10g}'.format(r[nombre])
+        elif nombre == 'AUXV':
+            return '{0:g}'.format(r['AUXV' + argumentos[0]])
+        elif nombre == 'DDEF':
+            return '{0},{1}'.format(*r['DDEF' + argumentos[0]][:2])
+        elif nombre == 'SNAP':
+            indices = [int(a) for a in argumentos]
+            if not 2 <= len(indices) <= 6:
+                raise ValueError(nombre)
+            return ','.join('{0:.6e}'.format(v)
+                            for v in self._valores(indices))
+        elif nombre == 'OUTP':
+            i = int(argumentos[0])
+            if not 1 <= i <= 4:
+                raise ValueError(nombre)
+            return '{0:.6e}'.format(self._valores([i])[0])
+        elif nombre == 'OUTR':
+            i = int(argumentos[0])
+            if not 1 <= i <= 2:
+                raise ValueError(nombre)
+            return '{0:.6e}'.format(self._valores([9 + i])[0])
+        elif nombre == 'OAUX':
+            return '{0:.6e}'.format(self._auxiliares[int(argumentos[0]) - 1])
+        elif nombre == 'SPTS':
+            return '{0:d}'.format(self._puntosAlmacenados())
+        elif nombre == '*IDN':
+            return 'Stanford_Research_Systems,SR830,s/n00000,ver1.07'
+        elif nombre == '*ESR':
+            esr, self._esr = self._esr, 0
+            return '{0:d}'.format(esr)
+        elif nombre == '*STB':
+            # Bit 1: ningún comando en ejecución; bit 5: *ESR distinto de 0
+            libre = time.time() >= self._ocupadoHasta
+            estado = (2 if libre else 0) | (32 if self._esr else 0)
+            if argumentos:
+                return '{0:d}'.format((estado >> int(argumentos[0])) & 1)
+            return '{0:d}'.format(estado)
+        raise KeyError(nombre)
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Banco de pruebas de rendimiento de la adquisición y el análisis.
+
+Mide, sin instrumentos conectados, los caminos críticos del laboratorio:
+
+    lockin_consultarSimultaneo     consultas/s contra el simulador
+    lockin_barrerFrecuencia        puntos/s de un barrido (sin espera)
+    lockin_listarPropiedades       listados/s
+    lockin_crearRegistro           registros/s
+    camara_perfil_intensidad       perfiles/s sobre un video
+    difraccion_analizar_patron_*   cuadros/s por método de mínimos
+    resistividad_PruebaIntervalos  ventanas/s
+    importar_*                     importaciones/s (intérprete nuevo)
+
+El video y los perfiles son sintéticos salvo que se indiquen grabaciones.
+Los resultados se guardan en JSON y pueden compararse con una base
+anterior: una prueba es una regresión si su valor cae más que la
+tolerancia (todas las medidas son tasas, mayor es mejor).
+
+Uso:
+    python banco.py [-s resultados.json] [-b base.json] [-t 0.2]
+                    [--video captura.avi] [--perfiles perfiles.csv]
+                    [--latencia 0.0] [prueba ...]
+
+Las pruebas cuyos módulos no pueden importarse (por ej. sin PyVISA) se
+informan como omitidas.
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+import importlib.util
+from time import perf_counter
+from collections import OrderedDict
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for carpeta in ('Instrumentos', 'Camara'):
+    sys.path.insert(0, os.path.join(raiz, carpeta))
+
+pruebas = OrderedDict()
+
+def prueba(funcion):
+    """ Registra una prueba: funcion(opciones) -> [(nombre, valor, unidad)] """
+    pruebas[funcion.__name__] = funcion
+    return funcion
+
+def cronometrar(funcion, minimo=0.5, repeticiones=3):
+    """
+    Ejecuta funcion() hasta acumular 'minimo' segundos y devuelve la mejor
+    tasa (llamadas/s) de las repeticiones
+    """
+    mejor = 0.0
+    for _ in range(repeticiones):
+        n = 0
+        inicio = perf_counter()
+        while True:
+            funcion()
+            n += 1
+            duracion = perf_counter() - inicio
+            if duracion >= minimo:
+                break
+        mejor = max(mejor, n / duracion)
+    return mejor
+
+def silencio():
+    """ Descarta lo impreso por los módulos medidos """
+    return contextlib.redirect_stdout(io.StringIO())
+
+#%% Lockin (simulador)
+
+def _lockin(opciones):
+    from instrumentos import Lockin
+    from simulador import SimuladorVISA
+    with silencio():
+        return Lockin(modo_simulador=SimuladorVISA(
+            semilla=0, latencia=opciones.latencia))
+
+@prueba
+def lockin(opciones):
+    loc = _lockin(opciones)
+    resultados = list()
+
+    tasa = cronometrar(lambda: loc.consultarSimultaneo('X', 'Y', 'R', 'T'))
+    resultados.append(('lockin_consultarSimultaneo', tasa, 'consultas/s'))
+
+    pasos = 50
+    def barrer():
+        with silencio():
+            loc.barrerFrecuencia(100, 20000, pasos, 0, 'X', 'Y', espera=0)
+    tasa = cronometrar(barrer)
+    resultados.append(('lockin_barrerFrecuencia', pasos * tasa, 'puntos/s'))
+
+    tasa = cronometrar(lambda: loc.listarPropiedades(impr=lambda t: None))
+    resultados.append(('lockin_listarPropiedades', tasa, 'listados/s'))
+
+    with tempfile.TemporaryDirectory() as directorio:
+        archivo = os.path.join(directorio, 'LockinSR830.log')
+        tasa = cronometrar(lambda: loc.crearRegistro(archivo))
+    resultados.append(('lockin_crearRegistro', tasa, 'registros/s'))
+    return resultados
+
+#%% Cámara y difracción
+
+def _perfiles_sinteticos(cantidad=20):
+    from rendimiento import patron_sinc2
+    rendijas = np.linspace(60e-6, 200e-6, cantidad)
+    perfiles = [patron_sinc2(rendija=r, semilla=i)[1]
+                for i, r in enumerate(rendijas)]
+    eje_x = patron_sinc2()[0]
+    return eje_x, perfiles, rendijas
+
+def _video_sintetico(ruta, cuadros, alto=480):
+    """ Video con un patrón sinc^2 horizontal (una rendija por cuadro) """
+    import cv2
+    eje_x, perfiles, _ = _perfiles_sinteticos(cuadros)
+    ancho = len(eje_x)
+    video = cv2.VideoWriter(ruta, cv2.VideoWriter_fourcc(*'MJPG'), 30,
+                            (ancho, alto))
+    if not video.isOpened():
+        raise IOError('No se puede escribir el video sintético')
+    for perfil in perfiles:
+        cuadro = np.repeat(perfil[np.newaxis, :, np.newaxis], alto, axis=0)
+        video.write(np.repeat(cuadro, 3, axis=2))
+    video.release()
+
+@prueba
+def camara(opciones):
+    from camara import Camara
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = opciones.video
+        cuadros = 300
+        if ruta is None:
+            ruta = os.path.join(directorio, 'sintetico.avi')
+            _video_sintetico(ruta, cuadros)
+
+        cam = Camara(ruta, y1=240, x2=639, y2=240)
+        # El primer cuadro queda fuera de la medición (apertura)
+        eje_x, salida = cam.perfil_intensidad()
+        salida = np.empty_like(salida)
+        n = 0
+        inicio = perf_counter()
+        while n < cuadros - 1:
+            try:
+                cam.perfil_intensidad(salida=salida)
+            except AttributeError:
+                # Fin del video (el cuadro leído es None)
+                break
+            n += 1
+        duracion = perf_counter() - inicio
+        del cam
+    return [('camara_perfil_intensidad', n / duracion, 'perfiles/s')]
+
+@prueba
+def difraccion(opciones):
+    from rendimiento import comparar_minimos
+    if opciones.perfiles is None:
+        eje_x, perfiles, rendijas = _perfiles_sinteticos()
+    else:
+        datos = np.loadtxt(opciones.perfiles, delimiter=',')
+        eje_x, perfiles, rendijas = datos[0], datos[1:], None
+    resultados = comparar_minimos(eje_x, perfiles, rendijas)
+    return [('difraccion_analizar_patron_' + nombre,
+             r['cuadros_por_segundo'], 'cuadros/s')
+            for nombre, r in resultados.items()]
+
+#%% Resistividad
+
+def _importar(nombre, ruta):
+    """ Importa un módulo por ruta (hay varios analisis.py) """
+    especificacion = importlib.util.spec_from_file_location(nombre, ruta)
+    modulo = importlib.util.module_from_spec(especificacion)
+    especificacion.loader.exec_module(modulo)
+    return modulo
+
+@prueba
+def resistividad(opciones):
+    from simulador import MuestraFoucault
+    import matplotlib.pyplot as plt
+    analisis = _importar('analisis_resistividad',
+                         os.path.join(raiz, 'Resistividad', 'analisis.py'))
+
+    # Barridos sintéticos de 2000 puntos (vacío y aluminio de 13 mm)
+    azar = np.random.RandomState(0)
+    frec = np.linspace(100, 20000, 2000)
+    with tempfile.TemporaryDirectory() as directorio:
+        carpeta = os.path.join(directorio, analisis.carpeta[1])
+        os.mkdir(carpeta)
+        for nombre, resistividad in (('Vacio', None),
+                                     ('Aluminio13mm', 2.8e-8)):
+            muestra = MuestraFoucault(radio=6.5e-3,
+                                      resistividad=resistividad)
+            z = muestra.respuesta(frec) + azar.normal(0, 1e-7, 2000)
+            np.savetxt(os.path.join(carpeta, nombre + '.csv'),
+                       np.transpose([frec, z.real, z.imag]), delimiter=',',
+                       newline='\r\n', header='F,X,Y')
+
+        analisis.medicion = analisis.Mediciones(analisis.carpeta,
+                                                analisis.ruta, directorio)
+        with silencio():
+            ventanas = len(analisis.PruebaIntervalos(2, 'Aluminio13mm',
+                                                     13e-3))
+        def intervalos():
+            analisis.PruebaIntervalos(2, 'Aluminio13mm', 13e-3)
+            plt.close(0)
+        tasa = cronometrar(intervalos)
+    return [('resistividad_PruebaIntervalos', ventanas * tasa, 'ventanas/s')]
+
+#%% Tiempo de importación
+
+# Código a cronometrar en un intérprete nuevo (el arranque de los scripts
+# y de los procesos de analizar_lote y del Renderizador)
+importaciones = OrderedDict([
+    ('instrumentos', 'import instrumentos'),
+    ('lockin_simulador', 'from instrumentos import Lockin\n'
+                         'Lockin(modo_simulador=True)'),
+    ('graficos', 'import graficos'),
+    ('camara', 'import camara'),
+    ('difraccion', 'import analisis'),
+])
+
+def tiempo_importacion(codigo, repeticiones=5):
+    """
+    Mejor duración (s) de 'codigo' ejecutado en un intérprete nuevo, sin
+    contar el arranque del intérprete
+    """
+    programa = '\n'.join([
+        'import sys, time',
+        'sys.path[:0] = ' + repr([os.path.join(raiz, c) for c in
+                                  ('Instrumentos', 'Camara')]),
+        'inicio = time.perf_counter()',
+        codigo,
+        'print(time.perf_counter() - inicio)'])
+    mejor = np.inf
+    for _ in range(repeticiones):
+        proceso = subprocess.run([sys.executable, '-c', programa],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+        if proceso.returncode != 0:
+            raise ImportError(proceso.stderr.strip().splitlines()[-1])
+        mejor = min(mejor, float(proceso.stdout.split()[-1]))
+    return mejor
+
+@prueba
+def importacion(opciones):
+    return [('importar_' + nombre, 1 / tiempo_importacion(codigo),
+             'importaciones/s') for nombre, codigo in importaciones.items()]
+
+#%% Ejecución y comparación
+
+def ejecutar(nombres, opciones):
+    """ Ejecuta las pruebas indicadas y devuelve el informe (dict) """
+    informe = OrderedDict()
+    informe['fecha'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    informe['python'] = platform.python_version()
+    informe['numpy'] = np.__version__
+    informe['plataforma'] = platform.platform()
+    informe['latencia'] = opciones.latencia
+    informe['resultados'] = OrderedDict()
+    informe['omitidas'] = OrderedDict()
+    for nombre in nombres:
+        try:
+            medidas = pruebas[nombre](opciones)
+        except ImportError as error:
+            informe['omitidas'][nombre] = str(error)
+            print('{0:>40s}: omitida ({1})'.format(nombre, error))
+            continue
+        for medida, valor, unidad in medidas:
+            informe['resultados'][medida] = {'valor': valor,
+                                             'unidad': unidad}
+            print('{0:>40s}: {1:12.1f} {2}'.format(medida, valor, unidad))
+    return informe
+
+def comparar(base, informe, tolerancia=0.2):
+    """
+    Compara el informe con una base anterior. Devuelve una lista de
+    (prueba, valor base, valor actual, razón, estado)
+    """
+    filas = list()
+    for nombre, actual in informe['resultados'].items():
+        if nombre not in base['resultados']:
+            continue
+        anterior = base['resultados'][nombre]['valor']
+        razon = actual['valor'] / anterior if anterior else np.inf
+        if razon < 1 - tolerancia:
+            estado = 'REGRESIÓN'
+        elif razon > 1 + tolerancia:
+            estado = 'mejora'
+        else:
+            estado = 'igual'
+        filas.append((nombre, anterior, actual['valor'], razon, estado))
+    return filas
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('pruebas', nargs='*',
+                        help='pruebas a ejecutar (por defecto todas): ' +
+                        ', '.join(pruebas))
+    parser.add_argument('-s', '--salida', default='rendimiento.json',
+                        help='archivo JSON de resultados')
+    parser.add_argument('-b', '--base', help='JSON de referencia')
+    parser.add_argument('-t', '--tolerancia', type=float, default=0.2,
+                        help='caída relativa tolerada respecto de la base')
+    parser.add_argument('--video', help='video grabado para la cámara')
+    parser.add_argument('--perfiles', help='CSV de perfiles grabados')
+    parser.add_argument('--latencia', type=float, default=0.0,
+                        help='latencia del bus simulado (s)')
+    opciones = parser.parse_args()
+    for nombre in opciones.pruebas:
+        if nombre not in pruebas:
+            parser.error('prueba desconocida: ' + nombre)
+
+    informe = ejecutar(opciones.pruebas or list(pruebas), opciones)
+    with open(opciones.salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print('Resultados guardados en ' + opciones.salida)
+
+    if opciones.base is not None:
+        with open(opciones.base, encoding='utf-8') as f:
+            base = json.load(f)
+        filas = comparar(base, informe, opciones.tolerancia)
+        print('\nComparación con ' + opciones.base + ' (' +
+              base.get('fecha', '') + ')')
+        for nombre, anterior, actual, razon, estado in filas:
+            print('{0:>40s}: {1:12.1f} -> {2:12.1f}  x{3:5.2f}  {4}'.format(
+                nombre, anterior, actual, razon, estado))
+        if any(fila[4] == 'REGRESIÓN' for fila in filas):
+            sys.exit(1)
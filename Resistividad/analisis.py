@@ -10,6 +10,13 @@ from scipy import stats
 #%% CARGA DE DATOS
 
 import os
+import sys
+from collections import OrderedDict
+
+# Formato binario de los barridos (Instrumentos/almacenamiento.py)
+raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(raiz, 'Instrumentos'))
+import almacenamiento
 #os.chdir(r'/Susceptibilidad y conductividad/Datos (día 2)')
 
 muestras = ('Vacio', 'Bronce13mm', 'Aluminio13mm', 'Aluminio9mm', 'Cobre9mm4')
@@ -35,15 +42,171 @@ carpeta = ('Primera medición - 100 pts',
             'Quinta medición',
             'Sexta medición')
 
-medicion = list()        
-for i in range(6):
-    medicion.append(dict())
-    for archivo in ruta[carpeta[i]]:
-        rutaCompleta = './' + carpeta[i] + '/' + archivo + '.csv'
+class Mediciones(object):
+    """
+    Acceso diferido a las mediciones: medicion[i][archivo].
+    
+    Cada CSV se lee recién la primera vez que se lo pide y se guarda junto
+    al original una copia binaria (.npy) que las siguientes sesiones abren
+    con memory-map. La copia se descarta si el CSV cambió (fecha de
+    modificación o tamaño).
+    
+    Si junto al CSV existe un archivo .npz (formato de guardarBarrido) se
+    utiliza éste.
+    
+    Parámetros
+    ----------
+    carpetas : tuple
+        Nombres de las carpetas en el orden del índice.
+    archivos : dict
+        Archivos (sin extensión) disponibles en cada carpeta.
+    raiz : str
+        Directorio que contiene las carpetas.
+    maximo : int
+        Cantidad máxima de arrays residentes. Se liberan los menos usados.
+    """
+    def __init__(self, carpetas, archivos, raiz='.', maximo=16):
+        
+        assert maximo > 0
+        
+        self._carpetas = carpetas
+        self._archivos = archivos
+        self._raiz = raiz
+        self._maximo = maximo
+        
+        self._residentes = OrderedDict()
+        
+    def __len__(self):
+        return len(self._carpetas)
+        
+    def __getitem__(self, i):
+        # Permite medicion[i][archivo] y también medicion[i, archivo]
+        if isinstance(i, tuple):
+            return self.cargar(*i)
+        return _CarpetaMediciones(self, i)
+    
+    def _ruta(self, i, archivo):
+        # Ruta del CSV original
+        return os.path.join(self._raiz, self._carpetas[i], archivo + '.csv')
+    
+    def cargar(self, i, archivo):
+        """ Devuelve los datos de medicion[i][archivo] (desempacados) """
+        
+        if archivo not in self._archivos[self._carpetas[i]]:
+            raise KeyError(archivo)
+        
+        clave = (i, archivo)
+        if clave in self._residentes:
+            self._residentes.move_to_end(clave)
+            return self._residentes[clave]
+        
+        datos = self._leer(i, archivo)
+        self._residentes[clave] = datos
+        
+        # Libera los arrays menos usados recientemente
+        while len(self._residentes) > self._maximo:
+            self._residentes.popitem(last=False)
+        
+        return datos
+    
+    def _leer(self, i, archivo):
+        # Los barridos guardados con Lockin.guardarBarrido (.npz) ya son
+        # binarios: se devuelven F, X, Y (como en los CSV) y luego el resto
+        # de las columnas, con memory-map si el archivo está compactado (un
+        # barrido cortado queda en bloques, que almacenamiento.cargar
+        # concatena)
+        rutaCompleta = self._ruta(i, archivo)
+        rutaNpz = rutaCompleta[:-4] + '.npz'
+        if os.path.exists(rutaNpz):
+            datos = almacenamiento.cargar(rutaNpz)
+            orden = [c for c in ('F', 'X', 'Y') if c in datos]
+            orden += [c for c in datos if c not in orden]
+            return [datos[c] for c in orden]
+        
+        # Usa la copia binaria si coincide con el CSV, si no la regenera
+        rutaBinaria = rutaCompleta[:-4] + '.npy'
+        rutaFirma = rutaBinaria + '.firma'
+        
+        estado = os.stat(rutaCompleta)
+        firma = '{0} {1}'.format(estado.st_mtime_ns, estado.st_size)
+        
+        try:
+            with open(rutaFirma) as f:
+                if f.read().strip() == firma:
+                    return np.load(rutaBinaria, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            pass
+        
         print('medicion[' + str(i) + ']["' + archivo + '"] = ' + rutaCompleta)
-        medicion[i].update({archivo: np.loadtxt(rutaCompleta, delimiter=',',
-                                                unpack=True)})
+        datos = np.loadtxt(rutaCompleta, delimiter=',', unpack=True)
+        
+        # La copia binaria es opcional (por ej. carpeta de sólo lectura)
+        try:
+            np.save(rutaBinaria, datos)
+            with open(rutaFirma, 'w') as f:
+                f.write(firma)
+        except (IOError, OSError):
+            pass
+        
+        return datos
+    
+    def precargar(self, i=None):
+        """ Carga todos los archivos de una carpeta (o de todas) """
+        indices = range(len(self)) if i is None else (i,)
+        for j in indices:
+            for archivo in self._archivos[self._carpetas[j]]:
+                self.cargar(j, archivo)
+    
+    def liberar(self):
+        """ Libera todos los arrays residentes """
+        self._residentes.clear()
+
+class _CarpetaMediciones(object):
+    """ Vista de una carpeta de Mediciones indexable por archivo """
+    def __init__(self, mediciones, i):
+        self._mediciones = mediciones
+        self._i = i
+    
+    def __getitem__(self, archivo):
+        return self._mediciones.cargar(self._i, archivo)
+    
+    def __contains__(self, archivo):
+        return archivo in self.keys()
+    
+    def keys(self):
+        return self._mediciones._archivos[self._mediciones._carpetas[self._i]]
+
+medicion = Mediciones(carpeta, ruta)
                                                 
+#%% RESTAR VACIO Y CALCULA W(-Y/X)
+
+def CalcularW(numero, muestra, vacio='Vacio'):
+    """
+    Resta el vacío, rota 50° y evalúa el polinomio W(-Y/X).
+    
+    Devuelve frec, x, y, z (-Y/X) y w como arrays completos.
+    """
+
+    frec = medicion[numero - 1][muestra][0]
+    x_vacio = medicion[numero - 1][vacio][1]
+    y_vacio = medicion[numero - 1][vacio][2]
+    x_muestra = medicion[numero - 1][muestra][1]
+    y_muestra = medicion[numero - 1][muestra][2]
+
+       
+    x_rotado = x_muestra - x_vacio
+    y_rotado = y_muestra - y_vacio
+    
+    x = x_rotado * np.cos(np.pi * 50/180) + y_rotado * np.sin(np.pi * 50/180)
+    y = -x_rotado * np.sin(np.pi * 50/180) + y_rotado * np.cos(np.pi * 50/180)
+    
+    z = -y/x
+    #slopexy, interceptxy = stats.linregress(x,y)[0:2]
+    
+    w = -0.01 + 3.06 * z - 0.105 * z**2 + 0.167 * z**3
+    
+    return frec, x, y, z, w
+
 #%% RESTAR VACIO, CALCULA RESISTIVIDAD Y GRAFICA
 
 def Resistividad(numero, muestra, diametro, inicio=0, fin=2000, 
@@ -69,24 +232,8 @@ def Resistividad(numero, muestra, diametro, inicio=0, fin=2000,
         Opción para habilitar / deshabilitar los gráficos.
     """
 
-    frec = medicion[numero - 1][muestra][0]
-    x_vacio = medicion[numero - 1][vacio][1]
-    y_vacio = medicion[numero - 1][vacio][2]
-    x_muestra = medicion[numero - 1][muestra][1]
-    y_muestra = medicion[numero - 1][muestra][2]
-
-       
-    x_rotado = x_muestra - x_vacio
-    y_rotado = y_muestra - y_vacio
+    frec, x, y, z, w = CalcularW(numero, muestra, vacio)
     
-    x = x_rotado * np.cos(np.pi * 50/180) + y_rotado * np.sin(np.pi * 50/180)
-    y = -x_rotado * np.sin(np.pi * 50/180) + y_rotado * np.cos(np.pi * 50/180)
-    
-    d = ((2*2.82e-8)/(3.95e-6*frec))**0.5
-    z = -y/x
-    #slopexy, interceptxy = stats.linregress(x,y)[0:2]
-    
-    w = -0.01 + 3.06 * z - 0.105 * z**2 + 0.167 * z**3
     slopefrecw, interceptfrecw = stats.linregress(frec[inicio:fin],
                                                   w[inicio:fin])[0:2]
     ajuste = frec*slopefrecw + interceptfrecw
@@ -132,21 +279,118 @@ def Resistividad(numero, muestra, diametro, inicio=0, fin=2000,
     
     return x, y, Rho
     
+#%% REGRESIÓN LINEAL EN VENTANAS MÓVILES
+
+def RegresionMovil(x, y, ventana, errores=False):
+    """
+    Ajuste lineal por cuadrados mínimos sobre todas las ventanas de
+    largo fijo en una sola pasada (sumas acumuladas de x, y, x², x·y, y²).
+    
+    La ventana i abarca los puntos [i, i + ventana). El resultado coincide
+    con aplicar stats.linregress a cada ventana por separado.
+    
+    Parámetros:
+    ----------
+    x, y : 1D array
+        Datos a ajustar.
+    ventana : int
+        Número de puntos de cada ventana (mínimo 2, o 3 con errores).
+    errores : bool
+        Devuelve además los errores estándar de pendiente y ordenada.
+        
+    Retorna:
+    --------
+    pendiente, ordenada (y error_pendiente, error_ordenada si errores=True)
+    """
+    
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = ventana
+    
+    if len(x) != len(y):
+        raise ValueError('x e y deben tener el mismo largo')
+    if not (2 + errores <= n <= len(x)):
+        raise ValueError(str(2 + errores) + ' <= ventana <= ' + str(len(x)))
+    
+    # Centra los datos para evitar cancelaciones en las sumas acumuladas
+    x0 = x.mean()
+    y0 = y.mean()
+    x = x - x0
+    y = y - y0
+    
+    def sumas(a):
+        # Suma de cada ventana como diferencia de la suma acumulada
+        acumulada = np.concatenate(([0.0], np.cumsum(a)))
+        return acumulada[n:] - acumulada[:-n]
+    
+    sx = sumas(x)
+    sy = sumas(y)
+    sxx = sumas(x * x) - sx * sx / n
+    sxy = sumas(x * y) - sx * sy / n
+    
+    pendiente = sxy / sxx
+    ordenada = (sy - pendiente * sx) / n
+    
+    # Devuelve la ordenada al eje original (sin centrar)
+    ordenada = ordenada + y0 - pendiente * x0
+    
+    if errores == False:
+        return pendiente, ordenada
+    
+    syy = sumas(y * y) - sy * sy / n
+    residuos = np.clip(syy - pendiente * sxy, 0, None)
+    error_pendiente = np.sqrt(residuos / (n - 2) / sxx)
+    media_x2 = (sxx + sx * sx / n) / n + 2 * x0 * sx / n + x0 ** 2
+    error_ordenada = error_pendiente * np.sqrt(media_x2)
+    
+    return pendiente, ordenada, error_pendiente, error_ordenada
+
+def ResistividadMovil(numero, muestra, diametro, ventana=100, inicio=0, 
+                      fin=2000, vacio='Vacio', errores=False):
+    """
+    Calcula la resistividad para cada ventana móvil de N puntos.
+    
+    Parámetros:
+    ----------
+    Los mismos que Resistividad, más:
+    ventana : int
+        Número de puntos de cada ventana.
+    errores : bool
+        Devuelve además el error de la resistividad en cada ventana.
+        
+    Retorna:
+    --------
+    frecuencia inicial de cada ventana, resistividad (y su error)
+    """
+    
+    frec, x, y, z, w = CalcularW(numero, muestra, vacio)
+    fin = min(fin, len(frec))
+    frec = frec[inicio:fin]
+    w = w[inicio:fin]
+    
+    # Se descarta la última ventana para conservar los mismos intervalos
+    # que el cálculo original range(inicio, fin - ventana)
+    ajuste = RegresionMovil(frec, w, ventana, errores)
+    pendiente = ajuste[0][:-1]
+    
+    radio = diametro / 2
+    rho = ((3.95e-6)*(radio**2)) / pendiente
+    frecuencia = frec[:len(rho)]
+    
+    if errores == False:
+        return frecuencia, rho
+    
+    error_rho = np.abs(rho * ajuste[2][:-1] / pendiente)
+    return frecuencia, rho, error_rho
+    
 #%% CALCULA RESISTIVIDAD EN INTERVALOS MOVILES DE N PUNTOS
 
 def PruebaIntervalos(numero, muestra, diametro, ventana=100, 
                      inicio=0, fin=2000):
     """ Permite calcular la resistividad tomando una ventana móvil """
     
-    resultado = list()
-    frecuencia = list()
-    frec = medicion[numero - 1][muestra][0]
-    
-    for i in range(inicio,fin-ventana):
-        x, y , Rho = Resistividad(numero, muestra, diametro, 
-                                  inicio=i, fin=i+ventana, graficar=False)
-        resultado.append(Rho)
-        frecuencia.append(frec[i])
+    frecuencia, resultado = ResistividadMovil(numero, muestra, diametro,
+                                              ventana, inicio, fin)
     
     figura = plt.figure(0)
     eje = figura.add_subplot(111)